@@ -23,7 +23,11 @@ class StatusCsr(Csr):
     _fields = { 0:  CsrField(width=6, name="bits_valid", brief="bv", doc="Number of bits valid in Tdo register"),
                 6:  CsrFieldZero(width=2),
                 8:  CsrField(width=1, name="mode", brief="mode", doc="If 0 use OpenOCD mode; otherwise use nybble mode"),
-                9:  CsrFieldZero(width=15),
+                9:  CsrFieldZero(width=7),
+               16:  CsrField(width=3, name="tdi_fifo_level", brief="tdil", doc="Number of words in the TDI FIFO (0 to 4)"),
+               19:  CsrFieldZero(width=1),
+               20:  CsrField(width=3, name="tdo_fifo_level", brief="tdol", doc="Number of words in the TDO FIFO (0 to 4)"),
+               23:  CsrField(width=1, name="fifo_active", brief="fa", doc="Set while a FIFO mode shift is in progress"),
                24:  CsrField(width=1, name="tms", brief="tms", doc="Value of TMS 'pin'"),
                25:  CsrField(width=1, name="tdi", brief="tdo", doc="Value of TDI 'pin'"),
                26:  CsrField(width=1, name="tdo", brief="tdi", doc="Value of TDO 'pin'"),
@@ -40,6 +44,17 @@ class DataCsr(Csr):
                24:  CsrField(width=8, name="byte3", brief="b3", doc="byte of JTAG control data; in OpenOCD mode 0x30-0x37 ('0' to '7') control tdi, tms and tck; 0x52 ('R') shifts TDO in"),
               }
 
+class FifoCommandCsr(Csr):
+    _fields = {0:   CsrField(width=24, name="num_bits", brief="n", doc="Number of bits to shift in FIFO mode, with TDI from the TDI FIFO"),
+               24:  CsrField(width=1, name="last_tms", brief="ltms", doc="If set, TMS is high for the last bit of the shift"),
+               25:  CsrField(width=1, name="capture", brief="cap", doc="If set, TDO is pushed to the TDO FIFO in words (the last word holding its bits at the top)"),
+               26:  CsrFieldZero(width=6),
+              }
+
+class FifoCsr(Csr):
+    _fields = {0:  CsrField(width=32, name="data", brief="data", doc="Write to push a word of TDI (bit 0 shifted first) to the TDI FIFO; read to pop a word of TDO from the TDO FIFO"),
+              }
+
 class JtagAddressMap(Map):
     _map = [ MapCsr(reg=0, name="status",    brief="sts",  csr=StatusCsr, doc="read-only"),
              MapCsr(reg=2, name="tdo",       brief="tdo",  csr=TdoCsr, doc="read-only"),
@@ -48,5 +63,7 @@ class JtagAddressMap(Map):
              MapCsr(reg=5, name="data2",     brief="d2",   csr=DataCsr, doc="write-only"),
              MapCsr(reg=6, name="data3",     brief="d3",   csr=DataCsr, doc="write-only"),
              MapCsr(reg=7, name="data4",     brief="d4",   csr=DataCsr, doc="write-only"),
+             MapCsr(reg=8, name="fifo_command", brief="fcmd", csr=FifoCommandCsr, doc="write-only"),
+             MapCsr(reg=9, name="fifo",      brief="fifo", csr=FifoCsr, doc="TDI FIFO when written, TDO FIFO when read"),
              ]
              
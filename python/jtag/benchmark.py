@@ -0,0 +1,256 @@
+#a Copyright
+#
+#  This file 'benchmark.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+Benchmarks of the JTAG backends (JtagModule, JtagModuleApbSlow,
+JtagModuleApbFast, JtagModuleApbFifo and JtagModuleRemoteBitbang)
+without a simulator.
+
+Each backend is driven against a JtagApbTimerModel (a model of
+tb_jtag_apb_timer, from the jtag_model module), and for each operation (reset, IR scan, DR scans of various lengths (and a write-only DR scan, without TDO),
+IDCODE read, idle clocks, a sequence of IR and DR scans (individually and through a JtagQueue), and APB reads and writes of single words and blocks through a JtagApbMaster) the
+following are recorded, as the mean over a number of repeats (after
+one unmeasured run of the operation):
+
+  apb_transactions : APB reads and writes of apb_target_jtag
+  tcks             : JTAG TCK cycles
+  clocks           : jtag_tck clocks of the model (the clock of the
+                     test harness and apb_target_jtag)
+  bfm_waits        : calls of bfm_wait (each a round trip to a simulator)
+  bytes            : bytes sent and received over the remote_bitbang
+                     socket (JtagModuleRemoteBitbang only)
+  wall_time        : host wall time in seconds
+
+and, for DR scans and blocks, the same per bit transferred.
+
+JtagModuleRemoteBitbang is driven through an OpenocdServer (in its
+own thread) whose target drives the pins of the model, as the
+bit-bang JtagModule does.
+
+The results may be written to a JSON file, so that the cost per bit
+can be tracked over time; run this as
+
+  python -m regress.jtag.benchmark [results.json]
+"""
+
+#a Imports
+import asyncio
+import json
+import platform
+import sys
+import time
+from array import array
+from .bits import BitVector
+from .jtag_module import JtagModule, JtagModuleApbSlow, JtagModuleApbFast, JtagModuleApbFifo, JtagModuleRemoteBitbang
+from .jtag_apb import JtagApbMaster
+from .jtag_queue import JtagQueue
+from .jtag_model import JtagApbTimerModel, JtagModelTh, JtagModelApbBfm, JtagModelMap
+from .openocd_server import OpenocdServer, BitbangJtagPinsTarget
+
+#a Backends
+#c BenchmarkBackend
+class BenchmarkBackend:
+    """
+    A JtagModule* driven against a model of the hardware, with counters
+    """
+    #f __init__
+    def __init__(self, name):
+        self.name = name
+        self.model = JtagApbTimerModel()
+        self.th = JtagModelTh(self.model)
+        self.server = None
+        if name=="bitbang":
+            self.jtag_module = JtagModule(self.th.bfm_wait, self.th.tck_enable, self.th.jtag__tms, self.th.jtag__tdi, self.th.tdo, self.th)
+            pass
+        elif name=="remote_bitbang":
+            target = BitbangJtagPinsTarget(self.th.bfm_wait, self.th.tck_enable, self.th.jtag__tms, self.th.jtag__tdi, self.th.tdo)
+            self.server = OpenocdServer(target=target).start()
+            self.jtag_module = JtagModuleRemoteBitbang(port=self.server.port, mixin=self.th)
+            pass
+        else:
+            jtag_module_class = {"apb_slow":JtagModuleApbSlow, "apb_fast":JtagModuleApbFast, "apb_fifo":JtagModuleApbFifo}[name]
+            self.jtag_module = jtag_module_class(self.th, JtagModelApbBfm(self.model), JtagModelMap())
+            pass
+        self.apb_master = JtagApbMaster(self.jtag_module)
+        pass
+
+    #f sync
+    def sync(self):
+        """
+        Wait for the server (if any) to handle all of the data sent
+        to it; write-only operations of JtagModuleRemoteBitbang do not
+        wait for a response, so may not have been performed yet
+        """
+        if self.server is None: return
+        while self.server.stats.bytes_received<self.jtag_module.bytes_sent:
+            time.sleep(0.0001)
+            pass
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), self.server.loop).result()
+        pass
+
+    #f counters
+    def counters(self):
+        """
+        Return a dictionary of the counters so far (not including wall time)
+        """
+        self.sync()
+        return {"apb_transactions":self.model.apb_reads+self.model.apb_writes,
+                "tcks":self.model.tcks,
+                "clocks":self.model.cycle,
+                "bfm_waits":self.th.bfm_waits,
+                "bytes":getattr(self.jtag_module, "bytes_sent", 0)+getattr(self.jtag_module, "bytes_received", 0),
+                }
+
+    #f close
+    def close(self):
+        """
+        Close the remote_bitbang connection and server, if any
+        """
+        if self.server is not None:
+            self.jtag_module.close()
+            self.server.stop()
+            self.server = None
+            pass
+        pass
+    pass
+
+backend_names = ["bitbang", "apb_slow", "apb_fast", "apb_fifo", "remote_bitbang"]
+
+#a Operations
+block_data = array("I", range(64))
+
+#f dr_scan_operation
+def dr_scan_operation(length, capture=True):
+    pattern = BitVector(length, int.from_bytes(bytes([(0x5a+i*37)&0xff for i in range((length+7)//8)]), "little"))
+    def dr_scan(backend):
+        backend.jtag_module.jtag_write_drs(pattern, capture=capture)
+        pass
+    return (length, dr_scan)
+
+#f scans_operation
+def scans_operation(queued):
+    """
+    Eight IR writes (discarding TDO) each followed by a 32-bit DR scan,
+    performed as individual operations or as a single JtagQueue
+    """
+    def scans(backend):
+        jm = backend.jtag_module
+        for i in range(8):
+            jm.jtag_write_irs(BitVector(5,0x10+i))
+            jm.jtag_write_drs(BitVector(32,i))
+            pass
+        pass
+    def queued_scans(backend):
+        q = JtagQueue(backend.jtag_module)
+        for i in range(8):
+            q.add_ir_scan(BitVector(5,0x10+i))
+            q.add_dr_scan(BitVector(32,i))
+            pass
+        q.execute()
+        pass
+    if queued: return (8*37, queued_scans)
+    return (8*37, scans)
+
+operations = [ ("reset",        None, lambda b: b.jtag_module.jtag_reset()),
+               ("ir_scan",      None, lambda b: b.jtag_module.jtag_write_irs(BitVector(5,0x1f))),
+               ("dr_scan_32",   ) + dr_scan_operation(32),
+               ("dr_scan_50",   ) + dr_scan_operation(50),
+               ("dr_scan_1024", ) + dr_scan_operation(1024),
+               ("dr_write_1024", ) + dr_scan_operation(1024, capture=False),
+               ("idcode",       None, lambda b: b.jtag_module.jtag_read_idcodes()),
+               ("idle_1000",    None, lambda b: b.jtag_module.run_test_idle(1000)),
+               ("scans_8",      ) + scans_operation(False),
+               ("queued_scans_8", ) + scans_operation(True),
+               ("apb_write",    None, lambda b: b.apb_master.write(0x1204, 0x40000000)),
+               ("apb_read",     None, lambda b: b.apb_master.read(0x1200)),
+               ("read_block_64",  64*32, lambda b: b.apb_master.read_block(0x1200, 64)),
+               ("write_block_64", 64*32, lambda b: b.apb_master.write_block(0x1200, block_data)),
+               ]
+
+#a Benchmark
+#f benchmark_operation
+def benchmark_operation(backend, operation, repeat):
+    """
+    Run an operation on a backend once, then 'repeat' times measured;
+    return a dictionary of the mean costs
+    """
+    (name, num_bits, fn) = operation
+    fn(backend)
+    before = backend.counters()
+    t = time.perf_counter()
+    for i in range(repeat): fn(backend)
+    backend.sync()
+    wall_time = time.perf_counter() - t
+    after = backend.counters()
+    result = {}
+    for k in before:
+        result[k] = (after[k]-before[k]) / repeat
+        pass
+    result["wall_time"] = wall_time / repeat
+    if num_bits is not None:
+        result["bits"] = num_bits
+        for k in list(result.keys()):
+            if k!="bits": result[k+"_per_bit"] = result[k] / num_bits
+            pass
+        pass
+    return result
+
+#f benchmark
+def benchmark(backends=None, repeat=20):
+    """
+    Run all of the operations on each of the backends (by default
+    all of them), returning a dictionary of backend name to
+    dictionary of operation name to costs
+    """
+    if backends is None: backends = backend_names
+    results = {}
+    for backend_name in backends:
+        backend = BenchmarkBackend(backend_name)
+        backend.jtag_module.jtag_reset()
+        results[backend_name] = {}
+        for operation in operations:
+            results[backend_name][operation[0]] = benchmark_operation(backend, operation, repeat)
+            pass
+        backend.close()
+        pass
+    return results
+
+#f main
+def main(argv):
+    repeat = 20
+    results = benchmark(repeat=repeat)
+    for (backend_name, backend_results) in results.items():
+        for (operation_name, r) in backend_results.items():
+            print("%-14s %-14s apb %8.1f tcks %8.1f clocks %9.1f waits %8.1f bytes %8.1f wall %9.2fus"%
+                  (backend_name, operation_name, r["apb_transactions"], r["tcks"], r["clocks"], r["bfm_waits"], r["bytes"], r["wall_time"]*1E6))
+            pass
+        pass
+    if len(argv)>0:
+        with open(argv[0], "w") as f:
+            json.dump({"time":time.time(),
+                       "python":platform.python_version(),
+                       "repeat":repeat,
+                       "results":results,
+                       }, f, indent=1, sort_keys=True)
+            pass
+        pass
+    pass
+
+#a Toplevel
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,301 @@
+#a Copyright
+#
+#  This file 'bitbang_compiler.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+Compile OpenOCD remote_bitbang character streams to apb_target_jtag
+fast mode commands.
+
+A remote_bitbang stream sets TCK, TMS and TDI with the characters
+'0'-'7', and reads TDO with 'R'; OpenOCD sends two characters per
+TCK (TCK low then TCK high), and an 'R' before the rising edge of
+TCK for each bit whose TDO it requires. Forwarded character by
+character to apb_target_jtag, this is (at best) one APB write per
+character.
+
+The compiler reduces the stream to the TCK rising edges (each with
+a TMS and TDI value, and the number of 'R' that preceded it), and
+lowers these to fast mode commands (op, n, value, capture), as
+executed by JtagModuleApbFast._fast_execute:
+
+  * a run of TMS=0 clocks, optionally ending in a TMS=1 clock, is a
+    shift (op 2, or op 3) with TDI data
+
+  * a run of clocks whose TDI is not significant is a TMS sequence
+    (op 1), or a TMS=1 sequence (op 0) if all the TMS are 1
+
+TDI is significant only in Shift-DR and Shift-IR, and the fast mode
+TMS commands leave TDI unchanged; the compiler follows the TAP
+state (unknown until five TMS=1 clocks), and the TDI last driven,
+to determine this.
+
+An 'R' maps to the TDO captured by the fast mode command for the
+following clock (the fast mode captures TDO before each rising
+edge, as OpenOCD expects); an 'R' with no following clock in the
+stream is a character mode 'R' after the fast mode commands.
+
+The compiler is stateful, so a stream may be compiled in batches
+(as received by an OpenocdServer); BitbangFastTarget is a
+BitbangTarget that compiles and executes each batch with a
+JtagModuleApbFast.
+"""
+
+#a Imports
+from .tap_state import TapState, tap_next_state
+from .openocd_server import BitbangTarget
+
+#a Stream encoding
+#f bitbang_encode
+def bitbang_encode(tms, tdi=None, read=False):
+    """
+    Encode clocks of BitVectors tms and tdi (of the same length, or
+    tdi of None for zeros) as a remote_bitbang stream, as OpenOCD
+    does; if read is True then TDO is read for every clock
+    """
+    data = bytearray()
+    tdi_value = 0
+    if tdi is not None: tdi_value = tdi.value
+    tms_value = tms.value
+    for i in range(tms.length):
+        c = 0x30 | (((tms_value>>i)&1)<<1) | ((tdi_value>>i)&1)
+        if read:
+            data += bytes((c, 0x52, c|4))
+            pass
+        else:
+            data += bytes((c, c|4))
+            pass
+        pass
+    return data
+
+#a Classes
+#c BitbangProgram
+class BitbangProgram:
+    """
+    The result of compiling a remote_bitbang stream
+
+    cmds is a list of fast mode commands (op, n, value, capture)
+
+    reads has an entry for each 'R' of the stream of (cmd_index, bit)
+    for the TDO captured by a command, or None for a TDO read after
+    all of the commands (without a clock)
+
+    reset is True if the clocks may take the TAP through
+    test_logic_reset (so its IR is reset to IDCODE)
+    """
+    #f __init__
+    def __init__(self):
+        self.cmds = []
+        self.reads = []
+        self.num_clocks = 0
+        self.num_direct_reads = 0
+        self.reset = False
+        pass
+
+    #f __repr__
+    def __repr__(self):
+        return "BitbangProgram(%d clocks, %d commands, %d reads)"%(self.num_clocks, len(self.cmds), len(self.reads))
+    pass
+
+#c BitbangCompiler
+class BitbangCompiler:
+    """
+    Stateful compiler of remote_bitbang streams to fast mode commands
+    """
+    #f __init__
+    def __init__(self):
+        self.tck = 0
+        self.tms = 0
+        self.tdi = 0
+        self.pending_reads = 0
+        self.tap_state = None
+        self.tms_ones = 0
+        self.hw_tdi = None
+        pass
+
+    #f clocks
+    def clocks(self, data):
+        """
+        Reduce a stream to a list of (tms, tdi, num_reads) for each
+        rising edge of TCK; reads after the last edge are left in
+        pending_reads
+        """
+        clocks = []
+        tck = self.tck
+        tms = self.tms
+        tdi = self.tdi
+        reads = self.pending_reads
+        for c in data:
+            if (c&0xf8)==0x30:
+                tdi = c&1
+                tms = (c>>1)&1
+                if (c&4) and not tck:
+                    clocks.append((tms, tdi, reads))
+                    reads = 0
+                    pass
+                tck = c&4
+                pass
+            elif c==0x52: # 'R'
+                reads += 1
+                pass
+            pass
+        self.tck = tck
+        self.tms = tms
+        self.tdi = tdi
+        self.pending_reads = reads
+        return clocks
+
+    #f tdi_significant
+    def tdi_significant(self, clocks):
+        """
+        Return (significant, reset): a list of whether TDI is
+        significant for each clock, following the TAP state through
+        the clocks, and whether the clocks may enter test_logic_reset
+        """
+        shift_states = (TapState.shift_dr, TapState.shift_ir)
+        significant = []
+        reset = False
+        state = self.tap_state
+        ones = self.tms_ones
+        for (tms, tdi, reads) in clocks:
+            significant.append((state is None) or (state in shift_states))
+            ones = (ones+1) if tms else 0
+            if state is not None:
+                next_state = tap_next_state[state][tms]
+                if (next_state==TapState.test_logic_reset) and (state!=next_state): reset = True
+                state = next_state
+                pass
+            elif tms:
+                reset = True # The state is unknown, so it may be select_ir_scan
+                if ones>=5: state = TapState.test_logic_reset
+                pass
+            pass
+        self.tap_state = state
+        self.tms_ones = ones
+        return (significant, reset)
+
+    #f compile
+    def compile(self, data):
+        """
+        Compile a stream (bytes, bytearray or memoryview) to a BitbangProgram
+        """
+        program = BitbangProgram()
+        clocks = self.clocks(data)
+        (significant, program.reset) = self.tdi_significant(clocks)
+        n = len(clocks)
+        program.num_clocks = n
+        i = 0
+        while i<n:
+            # Length of a shift (op 2, or op 3 if ending with TMS=1) from clock i
+            shift_length = 0
+            if clocks[i][0]==0:
+                j = i
+                while (j<n) and (clocks[j][0]==0): j+=1
+                if j<n: j+=1
+                shift_length = j-i
+                pass
+            # Length of a TMS sequence (op 1) from clock i, leaving TDI unchanged
+            tms_length = 0
+            j = i
+            while (j<n) and ((not significant[j]) or (clocks[j][1]==self.hw_tdi)): j+=1
+            tms_length = j-i
+
+            if (shift_length>0) and (shift_length>=tms_length):
+                length = shift_length
+                op = 2 + clocks[i+length-1][0]
+                value = 0
+                for k in range(length): value |= clocks[i+k][1]<<k
+                self.hw_tdi = clocks[i+length-1][1]
+                pass
+            elif tms_length>0:
+                length = tms_length
+                value = 0
+                for k in range(length): value |= clocks[i+k][0]<<k
+                op = 1
+                if value==(1<<length)-1: op=0
+                pass
+            else: # TMS=1 with a significant TDI that is not the current TDI
+                length = 1
+                op = 3
+                value = clocks[i][1]
+                self.hw_tdi = value
+                pass
+            capture = False
+            cmd_index = len(program.cmds)
+            for k in range(length):
+                for r in range(clocks[i+k][2]):
+                    program.reads.append((cmd_index, k))
+                    capture = True
+                    pass
+                pass
+            program.cmds.append((op, length, value, capture))
+            i += length
+            pass
+        for r in range(self.pending_reads):
+            program.reads.append(None)
+            program.num_direct_reads += 1
+            pass
+        self.pending_reads = 0
+        return program
+    pass
+
+#c BitbangFastTarget
+class BitbangFastTarget(BitbangTarget):
+    """
+    A BitbangTarget that compiles each batch of characters, and
+    executes it with a JtagModuleApbFast
+    """
+    #f __init__
+    def __init__(self, jtag_module):
+        self.jtag_module = jtag_module
+        self.compiler = BitbangCompiler()
+        self.num_clocks = 0
+        self.num_cmds = 0
+        pass
+
+    #f bitbang
+    def bitbang(self, data):
+        program = self.compiler.compile(data)
+        self.num_clocks += program.num_clocks
+        self.num_cmds += len(program.cmds)
+        results = []
+        if program.cmds!=[]:
+            results = self.jtag_module._fast_execute(program.cmds)
+            pass
+        direct_tdo = 0
+        if program.num_direct_reads>0:
+            self.jtag_module.jtag_data1_reg.write(0x52) # 'R' in character mode
+            direct_tdo = (self.jtag_module.jtag_tdocl_reg.read()>>31)&1
+            pass
+        if program.reset: self.jtag_module.num_resets += 1
+        if self.compiler.tap_state is not None:
+            self.jtag_module.tap_state = self.compiler.tap_state
+            pass
+        elif program.num_clocks>0:
+            self.jtag_module.tap_state = TapState.unknown
+            pass
+        response = bytearray(len(program.reads))
+        for i in range(len(program.reads)):
+            read = program.reads[i]
+            if read is None:
+                response[i] = 0x30 + direct_tdo
+                pass
+            else:
+                response[i] = 0x30 + ((results[read[0]]>>read[1])&1)
+                pass
+            pass
+        return response
+    pass
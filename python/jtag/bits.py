@@ -0,0 +1,326 @@
+#a Copyright
+#
+#  This file 'bits.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+Bit vectors for JTAG scans.
+
+A JTAG scan is a sequence of bits, the first of which is shifted in
+to (or out of) the chain first. A BitVector holds such a sequence as
+a single Python integer together with its length; bit 0 of the
+integer is the first bit shifted.
+
+This matches the previous convention of per-bit lists, where
+element 0 of the list was shifted first, so that
+
+  BitVector.of_bits(bits).value == int_of_bits(bits)
+
+The conversions between lists of bits and integers (int_of_bits and
+bits_of_n, and their batch forms for many scans at once) are
+performed with the integer and bytes conversions built in to Python
+(or with numpy packbits/unpackbits for batches, if numpy is
+available) rather than a loop per bit; benchmark() compares them
+with the per-bit loops they replace.
+"""
+
+#a Imports
+import time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    pass
+
+#a Conversion functions
+_bits_to_chars = bytes.maketrans(b"\x00\x01", b"01")
+_chars_to_bits = bytes.maketrans(b"01", b"\x00\x01")
+
+#f int_of_bits
+def int_of_bits(bits):
+    """
+    Return the integer of a list of bits (each 0 or 1), element 0 being bit 0
+    """
+    if len(bits)==0: return 0
+    if (numpy is not None) and isinstance(bits, numpy.ndarray):
+        return int.from_bytes(numpy.packbits(bits.astype(numpy.uint8), bitorder="little").tobytes(), "little")
+    return int(bytes(bits).translate(_bits_to_chars)[::-1], 2)
+
+#f bits_of_n
+def bits_of_n(nbits, n):
+    """
+    Return a list of the bottom nbits bits of integer n, element 0 being bit 0
+    """
+    if nbits==0: return []
+    return list(format(n & ((1<<nbits)-1), "0%db"%nbits).encode("ascii").translate(_chars_to_bits)[::-1])
+
+#f ints_of_bits_batch
+def ints_of_bits_batch(bits_list):
+    """
+    Return a list of the integers of a list of lists of bits (all of
+    the same length, or a 2D numpy array with a row per scan), such
+    as the data of many scans
+    """
+    if len(bits_list)==0: return []
+    if (numpy is None) or not isinstance(bits_list, numpy.ndarray):
+        return [int_of_bits(bits) for bits in bits_list]
+    packed = numpy.packbits(bits_list.astype(numpy.uint8), axis=1, bitorder="little")
+    return [int.from_bytes(row.tobytes(), "little") for row in packed]
+
+#f bits_of_ints_batch
+def bits_of_ints_batch(nbits, values):
+    """
+    Return a list of lists of the bottom nbits bits of each of a list of integers
+    """
+    if len(values)==0: return []
+    if (numpy is None) or (nbits==0): return [bits_of_n(nbits, n) for n in values]
+    mask = (1<<nbits)-1
+    nbytes = (nbits+7)//8
+    data = b"".join([(n & mask).to_bytes(nbytes, "little") for n in values])
+    packed = numpy.frombuffer(data, dtype=numpy.uint8).reshape(len(values), nbytes)
+    return numpy.unpackbits(packed, axis=1, count=nbits, bitorder="little").tolist()
+
+#f vectors_of_bytes
+def vectors_of_bytes(data, chunk_bits=1024, length=None):
+    """
+    Generate BitVectors of chunk_bits bits (a multiple of 8) from
+    bytes-like data or a binary file, byte 0 holding the first bits;
+    the last may be shorter. If length is given only that many bits
+    are generated, else all the bits of the data.
+
+    Only one chunk is held at a time, so the data may be a file of any size.
+    """
+    chunk_bytes = chunk_bits//8
+    if hasattr(data, "read"):
+        read = lambda offset: data.read(chunk_bytes)
+        pass
+    else:
+        data = memoryview(data).cast("B")
+        read = lambda offset: data[offset:offset+chunk_bytes]
+        pass
+    offset = 0
+    while (length is None) or (offset*8<length):
+        chunk = read(offset)
+        if len(chunk)==0: break
+        n = 8*len(chunk)
+        if (length is not None) and (offset*8+n>length): n = length-offset*8
+        yield BitVector.of_bytes(chunk, n)
+        offset += len(chunk)
+        pass
+    pass
+
+#a Classes
+#c BitVector
+class BitVector(object):
+    """
+    An immutable vector of 'length' bits held as an integer 'value'
+    """
+    __slots__ = ("length", "value")
+    #f __init__
+    def __init__(self, length, value=0):
+        self.length = length
+        self.value  = value & ((1<<length)-1)
+        pass
+
+    #f of_bits - classmethod
+    @classmethod
+    def of_bits(cls, bits):
+        """
+        Create a BitVector from a list of bits, element 0 being bit 0
+        """
+        return cls(len(bits), int_of_bits(bits))
+
+    #f of_bytes - classmethod
+    @classmethod
+    def of_bytes(cls, data, length=None):
+        """
+        Create a BitVector from bytes, byte 0 holding bits 0 to 7; the
+        length defaults to 8 bits per byte
+        """
+        if length is None: length = 8*len(data)
+        return cls(length, int.from_bytes(data, "little"))
+
+    #f of - classmethod
+    @classmethod
+    def of(cls, values):
+        """
+        Return values as a BitVector; values may be a BitVector already, or a list of bits
+        """
+        if isinstance(values, BitVector): return values
+        return cls.of_bits(values)
+
+    #f bits
+    def bits(self):
+        """
+        Return the vector as a list of bits, element 0 being bit 0
+        """
+        return bits_of_n(self.length, self.value)
+
+    #f to_bytes
+    def to_bytes(self):
+        """
+        Return the vector as bytes, byte 0 holding bits 0 to 7
+        """
+        return self.value.to_bytes((self.length+7)//8, "little")
+
+    #f bit
+    def bit(self, n):
+        """
+        Return bit 'n' of the vector
+        """
+        return (self.value>>n)&1
+
+    #f slice
+    def slice(self, start, length):
+        """
+        Return a BitVector of 'length' bits starting at bit 'start'
+        """
+        return BitVector(length, self.value>>start)
+
+    #f chunks
+    def chunks(self, width):
+        """
+        Generate (start, length, value) for successive chunks of at most 'width' bits
+        """
+        mask = (1<<width)-1
+        start = 0
+        while start<self.length:
+            n = self.length-start
+            if n>width: n=width
+            yield (start, n, (self.value>>start) & mask)
+            start += n
+            pass
+        pass
+
+    #f runs
+    def runs(self):
+        """
+        Generate (bit, n) for successive runs of n equal bits
+        """
+        v = self.value
+        start = 0
+        while start<self.length:
+            x = v>>start
+            b = x&1
+            if b: x = ~x
+            n = self.length-start
+            if x!=0:
+                run = (x & -x).bit_length()-1
+                if run<n: n=run
+                pass
+            yield (b, n)
+            start += n
+            pass
+        pass
+
+    #f concat
+    def concat(self, other):
+        """
+        Return a BitVector of this vector followed by 'other' (which is shifted after this)
+        """
+        return BitVector(self.length+other.length, self.value | (other.value<<self.length))
+
+    #f __len__
+    def __len__(self):
+        return self.length
+
+    #f __int__
+    def __int__(self):
+        return self.value
+
+    #f __eq__
+    def __eq__(self, other):
+        if not isinstance(other, BitVector): return NotImplemented
+        return (self.length==other.length) and (self.value==other.value)
+
+    #f __hash__
+    def __hash__(self):
+        return hash((self.length, self.value))
+
+    #f __repr__
+    def __repr__(self):
+        return "BitVector(%d, 0x%x)"%(self.length, self.value)
+
+    pass
+
+#a Benchmark
+#f _int_of_bits_per_bit
+def _int_of_bits_per_bit(bits):
+    """
+    The per-bit conversion previously used, for comparison
+    """
+    l = len(bits)
+    m = 1<<(l-1)
+    v = 0
+    for b in bits:
+        v = (v>>1) | (m*b)
+        pass
+    return v
+
+#f _bits_of_n_per_bit
+def _bits_of_n_per_bit(nbits, n):
+    """
+    The per-bit conversion previously used, for comparison
+    """
+    bits = []
+    for i in range(nbits):
+        bits.append(n&1)
+        n >>= 1
+        pass
+    return bits
+
+#f _time_per_call
+def _time_per_call(fn, args, repeat):
+    t = time.perf_counter()
+    for i in range(repeat): fn(*args)
+    return (time.perf_counter()-t)/repeat
+
+#f benchmark
+def benchmark(sizes=(32, 50, 4096), batch=64):
+    """
+    Time the per-bit conversions against int_of_bits and bits_of_n
+    (and their batch forms, for 'batch' scans) for vectors of each
+    of the sizes; return a dictionary of size to a dictionary of
+    times (in seconds per vector)
+    """
+    results = {}
+    for nbits in sizes:
+        n = int.from_bytes(bytes([(0x5a+i*37)&0xff for i in range((nbits+7)//8)]), "little") & ((1<<nbits)-1)
+        bits = bits_of_n(nbits, n)
+        bits_list = [bits] * batch
+        values = [n] * batch
+        repeat = max(10, 200000//nbits)
+        r = {}
+        r["int_of_bits_per_bit"] = _time_per_call(_int_of_bits_per_bit, (bits,), repeat)
+        r["int_of_bits"]         = _time_per_call(int_of_bits, (bits,), repeat)
+        r["ints_of_bits_batch"]  = _time_per_call(ints_of_bits_batch, (bits_list,), max(1,repeat//batch)) / batch
+        r["bits_of_n_per_bit"]   = _time_per_call(_bits_of_n_per_bit, (nbits, n), repeat)
+        r["bits_of_n"]           = _time_per_call(bits_of_n, (nbits, n), repeat)
+        r["bits_of_ints_batch"]  = _time_per_call(bits_of_ints_batch, (nbits, values), max(1,repeat//batch)) / batch
+        results[nbits] = r
+        pass
+    return results
+
+#a Toplevel
+if __name__ == "__main__":
+    print("numpy %s"%("not available" if numpy is None else numpy.__version__))
+    for (nbits, r) in benchmark().items():
+        print("%5d bits: int_of_bits %8.2fus (per-bit %8.2fus, x%.1f, batch %8.2fus); bits_of_n %8.2fus (per-bit %8.2fus, x%.1f, batch %8.2fus)"%
+              (nbits,
+               r["int_of_bits"]*1E6, r["int_of_bits_per_bit"]*1E6, r["int_of_bits_per_bit"]/r["int_of_bits"], r["ints_of_bits_batch"]*1E6,
+               r["bits_of_n"]*1E6,   r["bits_of_n_per_bit"]*1E6,   r["bits_of_n_per_bit"]/r["bits_of_n"],     r["bits_of_ints_batch"]*1E6))
+        pass
+    pass
@@ -0,0 +1,316 @@
+#a Copyright
+#
+#  This file 'instrument.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+Optional instrumentation of a JtagModule* instance.
+
+A JtagInstrumentation, when enabled, wraps the public operations of
+a JtagModule* instance (jtag_reset, jtag_tms, jtag_shift,
+jtag_read_idcodes, jtag_write_irs and jtag_write_drs), its bfm_wait,
+and its TCK enable pin (for JtagModule) or its apb_target_jtag
+registers (for JtagModuleApb*), to count:
+
+  * calls of each operation, with histograms of their latency in
+    simulation cycles (from global_cycle, if available) and in host
+    wall time (in nanoseconds)
+
+  * TCKs (for the APB modules these are counted from the character
+    and fast mode command bytes written, and from the lengths of the
+    FIFO mode commands written)
+
+  * APB reads and writes, and bfm_wait calls and cycles
+
+The wrappers are instance attributes installed by enable() and
+removed by disable() (and the operations are exported again to the
+mixin or test harness), so a module that is not instrumented runs
+exactly as it would without this module.
+
+Latencies are inclusive, so (for example) the jtag_tms and
+jtag_shift of a jtag_write_drs are counted too. Histogram bucket i
+counts latencies of i bits - i.e. from 2^(i-1) to 2^i-1.
+
+A profile may be dumped in run__finalize with, for example:
+
+  for l in self.jtag_instrumentation.report(): self.verbose.info(l)
+"""
+
+#a Imports
+import time
+
+#a Classes
+#c JtagInstrumentedPin
+class JtagInstrumentedPin:
+    """
+    A wrapper of a test harness pin, recording the value last driven
+    """
+    #f __init__
+    def __init__(self, pin, value=0):
+        self.pin = pin
+        self.v = value
+        pass
+
+    #f drive
+    def drive(self, value):
+        self.v = value
+        self.pin.drive(value)
+        pass
+
+    #f value
+    def value(self):
+        return self.pin.value()
+    pass
+
+#c JtagInstrumentedReg
+class JtagInstrumentedReg:
+    """
+    A wrapper of an apb_target_jtag register, counting accesses and
+    (for the data registers) the TCKs of the command bytes written,
+    or (for the FIFO command register) the TCKs of the length field
+    (length_mask) of the command written
+    """
+    #f __init__
+    def __init__(self, instrumentation, reg, num_bytes=0, length_mask=0):
+        self.instrumentation = instrumentation
+        self.reg = reg
+        self.num_bytes = num_bytes
+        self.length_mask = length_mask
+        pass
+
+    #f write
+    def write(self, data):
+        instrumentation = self.instrumentation
+        instrumentation.apb_writes += 1
+        instrumentation.tcks += data & self.length_mask
+        for i in range(self.num_bytes):
+            b = (data>>(8*i)) & 0xff
+            if b & 0x80:
+                instrumentation.tcks += ((b>>2)&0x1f)+1
+                pass
+            elif ((b&0xf8)==0x30) and (b&4):
+                instrumentation.tcks += 1
+                pass
+            pass
+        self.reg.write(data)
+        pass
+
+    #f read
+    def read(self):
+        self.instrumentation.apb_reads += 1
+        return self.reg.read()
+    pass
+
+#c JtagInstrumentation
+class JtagInstrumentation:
+    """
+    Counters and latency histograms for a JtagModule* instance
+    """
+    operations = ("jtag_reset", "jtag_tms", "jtag_shift", "jtag_read_idcodes", "jtag_write_irs", "jtag_write_drs", "jtag_execute")
+    data_regs = ("jtag_data1_reg", "jtag_data2_reg", "jtag_data3_reg", "jtag_data4_reg")
+    other_regs = ("jtag_status_reg", "jtag_tdo_reg", "jtag_tdocl_reg", "jtag_fifo_command_reg", "jtag_fifo_reg")
+    length_masks = {"jtag_fifo_command_reg":(1<<24)-1}
+    num_buckets = 64
+    #f __init__
+    def __init__(self, jtag_module, global_cycle=None, enable=True):
+        """
+        Create instrumentation of jtag_module; global_cycle defaults
+        to that of the module's mixin (normally the test harness)
+        """
+        self.jtag_module = jtag_module
+        self.global_cycle = global_cycle
+        if global_cycle is None:
+            self.global_cycle = getattr(getattr(jtag_module, "mixin", None), "global_cycle", None)
+            pass
+        self.enabled = False
+        self.saved = {}
+        self.reset()
+        if enable: self.enable()
+        pass
+
+    #f reset
+    def reset(self):
+        """
+        Reset all the counters and histograms
+        """
+        self.calls = {}
+        self.cycles = {}
+        self.wall_time = {}
+        self.cycle_histograms = {}
+        self.time_histograms = {}
+        for op in self.operations:
+            self.calls[op] = 0
+            self.cycles[op] = 0
+            self.wall_time[op] = 0
+            self.cycle_histograms[op] = [0] * self.num_buckets
+            self.time_histograms[op] = [0] * self.num_buckets
+            pass
+        self.tcks = 0
+        self.apb_reads = 0
+        self.apb_writes = 0
+        self.wait_calls = 0
+        self.wait_cycles = 0
+        pass
+
+    #f _save
+    def _save(self, name, value):
+        """
+        Save the instance attribute 'name' of the module (None if it is not set) and set it to value
+        """
+        self.saved[name] = self.jtag_module.__dict__.get(name)
+        setattr(self.jtag_module, name, value)
+        pass
+
+    #f _wrap_operation
+    def _wrap_operation(self, op, fn):
+        cycle_histogram = self.cycle_histograms[op]
+        time_histogram = self.time_histograms[op]
+        global_cycle = self.global_cycle
+        perf_counter_ns = time.perf_counter_ns
+        def wrapped(*args, **kwargs):
+            c = 0
+            if global_cycle is not None: c = global_cycle()
+            t = perf_counter_ns()
+            r = fn(*args, **kwargs)
+            t = perf_counter_ns() - t
+            if global_cycle is not None: c = global_cycle() - c
+            self.calls[op] += 1
+            self.cycles[op] += c
+            self.wall_time[op] += t
+            cycle_histogram[min(c.bit_length(), self.num_buckets-1)] += 1
+            time_histogram[min(t.bit_length(), self.num_buckets-1)] += 1
+            return r
+        return wrapped
+
+    #f _wrap_bfm_wait
+    def _wrap_bfm_wait(self, bfm_wait, tck_pin):
+        def wrapped(n):
+            self.wait_calls += 1
+            self.wait_cycles += n
+            if (tck_pin is not None) and tck_pin.v: self.tcks += n
+            bfm_wait(n)
+            pass
+        return wrapped
+
+    #f enable
+    def enable(self):
+        """
+        Install the wrappers in the module
+        """
+        if self.enabled: return
+        jm = self.jtag_module
+        self.saved = {}
+        for op in self.operations:
+            self._save(op, self._wrap_operation(op, getattr(jm, op)))
+            pass
+        tck_pin = None
+        if hasattr(jm, "jtag_data1_reg"):
+            for i in range(len(self.data_regs)):
+                self._save(self.data_regs[i], JtagInstrumentedReg(self, getattr(jm, self.data_regs[i]), i+1))
+                pass
+            for r in self.other_regs:
+                if not hasattr(jm, r): continue
+                self._save(r, JtagInstrumentedReg(self, getattr(jm, r), length_mask=self.length_masks.get(r,0)))
+                pass
+            self._save("jtag_data_regs", [getattr(jm, r) for r in self.data_regs])
+            pass
+        else:
+            tck_pin = JtagInstrumentedPin(jm.tck_enable)
+            self._save("tck_enable", tck_pin)
+            pass
+        self._save("bfm_wait", self._wrap_bfm_wait(jm.bfm_wait, tck_pin))
+        jm._export()
+        self.enabled = True
+        pass
+
+    #f disable
+    def disable(self):
+        """
+        Remove the wrappers from the module (the counters are kept)
+        """
+        if not self.enabled: return
+        jm = self.jtag_module
+        for (name, value) in self.saved.items():
+            if value is None:
+                delattr(jm, name)
+                pass
+            else:
+                setattr(jm, name, value)
+                pass
+            pass
+        self.saved = {}
+        jm._export()
+        self.enabled = False
+        pass
+
+    #f histogram_buckets
+    @staticmethod
+    def histogram_buckets(histogram):
+        """
+        Return a list of (lowest value, count) for the nonzero buckets of a histogram
+        """
+        buckets = []
+        for i in range(len(histogram)):
+            if histogram[i]==0: continue
+            lowest = 0
+            if i>0: lowest = 1<<(i-1)
+            buckets.append((lowest, histogram[i]))
+            pass
+        return buckets
+
+    #f profile
+    def profile(self):
+        """
+        Return a dictionary of the counters and histograms (e.g. for a JSON dump)
+        """
+        operations = {}
+        for op in self.operations:
+            operations[op] = {"calls":self.calls[op],
+                              "cycles":self.cycles[op],
+                              "wall_time_ns":self.wall_time[op],
+                              "cycle_histogram":self.histogram_buckets(self.cycle_histograms[op]),
+                              "wall_time_histogram":self.histogram_buckets(self.time_histograms[op]),
+                              }
+            pass
+        return {"operations":operations,
+                "tcks":self.tcks,
+                "apb_reads":self.apb_reads,
+                "apb_writes":self.apb_writes,
+                "wait_calls":self.wait_calls,
+                "wait_cycles":self.wait_cycles,
+                }
+
+    #f report
+    def report(self):
+        """
+        Return a list of lines reporting the profile
+        """
+        lines = ["tcks %d apb_reads %d apb_writes %d wait_calls %d wait_cycles %d"%
+                 (self.tcks, self.apb_reads, self.apb_writes, self.wait_calls, self.wait_cycles)]
+        for op in self.operations:
+            n = self.calls[op]
+            if n==0: continue
+            lines.append("%-18s calls %6d mean cycles %9.1f mean wall %9.1fus"%
+                         (op, n, self.cycles[op]/n, self.wall_time[op]/n/1000.))
+            lines.append("    cycles  %s"%(" ".join(["%d:%d"%b for b in self.histogram_buckets(self.cycle_histograms[op])])))
+            lines.append("    wall ns %s"%(" ".join(["%d:%d"%b for b in self.histogram_buckets(self.time_histograms[op])])))
+            pass
+        return lines
+
+    #f __str__
+    def __str__(self):
+        return "\n".join(self.report())
+    pass
@@ -0,0 +1,462 @@
+#a Copyright
+#
+#  This file 'jtag_apb.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+APB master accesses through the jtag_tap_apb JTAG TAP client.
+
+jtag_tap_apb has a 32-bit CONTROL register (IR=0x10) and a 50-bit
+ACCESS register (IR=0x11) of address(16), data(32) and
+access/status(2).
+
+Shifting in an ACCESS value with access 1 (read) or 2 (write)
+starts an APB access on update; the value shifted out (captured) is
+the address and read data of the last APB access, with an op_status
+in the bottom two bits that is 2b11 if an access was attempted while
+a previous access was still in progress.
+
+This module pipelines accesses: each ACCESS DR scan starts the next
+access and returns the result of the previous one. Hence N reads
+require N+1 DR scans; the IR is only scanned when it has to change.
+
+A read must complete before the next capture of the ACCESS register,
+so read_idle_cycles TCKs are spent in idle after a DR scan that
+starts a read before the next DR scan. The handshake between the TCK
+and APB clock domains takes 11 TCKs from Update-DR to the first
+Capture-DR that sees the read complete (with an APB clock three
+times TCK, as in test_jtag), which is 9 TCKs in idle.
+
+The op_status of every DR scan is checked. An overrun of a read
+(the capture of a scan after a read was too soon) is recovered from
+if adaptive is set (the default): the idle TCKs are increased
+(backing off by a quarter, up to max_read_idle_cycles), the read is
+allowed to complete, the op_status is cleared and the scan is
+repeated. Any other overrun is recorded in a sticky error, and a
+JtagApbError is raised at the end of the call. The error (and the
+op_status in the hardware) is cleared with clear_error().
+
+The idle TCKs needed depend on the clock ratio and synchronizers of
+the hardware, so calibrate() measures them once (probing reads with
+a binary search on the idle TCKs) and sets read_idle_cycles to the
+smallest safe value; it can also measure the APB clocks per TCK by
+reading a free-running APB timer.
+
+Blocks of 32-bit words at incrementing addresses are read and written
+with read_block() and write_block(), which pipeline the accesses as
+read_many() and write_many() do, and use array('I') buffers (bytes
+or a memoryview may be written too, as little-endian words). Larger
+transfers may be streamed in chunks with read_stream() (a generator
+of arrays) and write_stream() (from a binary file or an iterable of
+buffers). The words transferred by these, and the wall time taken,
+are accumulated for words_per_second().
+"""
+
+#a Imports
+import sys
+import time
+from array import array
+from .bits import BitVector
+
+#a Exceptions
+#c JtagApbError
+class JtagApbError(Exception):
+    pass
+
+#a Classes
+#c JtagApbMaster
+class JtagApbMaster:
+    """
+    APB master over JTAG, using a JtagModule* (or, for devices on a
+    longer scan chain, a ScanChainTap for the scans, with the
+    JtagModule* for idle cycles)
+    """
+    ir_apb_control  = 0x10
+    ir_apb_access   = 0x11
+    access_none     = 0
+    access_read     = 1
+    access_write    = 2
+    status_overrun  = 3
+    control_clear_status = 0x10000
+    #f __init__
+    def __init__(self, jtag_module, tap=None, ir_length=5, read_idle_cycles=9, adaptive=True, max_read_idle_cycles=64):
+        self.jtag_module = jtag_module
+        self.tap = tap
+        if tap is None: self.tap = jtag_module
+        self.ir_length = ir_length
+        self.read_idle_cycles = read_idle_cycles
+        self.adaptive = adaptive
+        self.max_read_idle_cycles = max_read_idle_cycles
+        self.read_latency_tcks = None
+        self.apb_clocks_per_tck = None
+        self.current_ir = None
+        self.ir_resets = None
+        self.read_pending = False
+        self.error = False
+        self.num_scans = 0
+        self.num_backoffs = 0
+        self.block_words = 0
+        self.block_time = 0.
+        pass
+
+    #f invalidate
+    def invalidate(self):
+        """
+        Invalidate the cached IR; use this if the IR may have been written by something else
+        """
+        self.current_ir = None
+        pass
+
+    #f select_ir
+    def select_ir(self, ir):
+        """
+        Write the IR if it is not already 'ir'
+
+        A JTAG reset sets the IR to IDCODE, so the cached IR is
+        invalidated if the JTAG module has counted a reset since the IR
+        was written - by jtag_reset, or by TMS values that pass through
+        test_logic_reset - even if the TAP has since left reset.
+        """
+        num_resets = getattr(self.jtag_module, "num_resets", None)
+        if num_resets!=self.ir_resets:
+            self.current_ir = None
+            pass
+        if self.current_ir==ir: return
+        self.tap.jtag_write_irs(BitVector(self.ir_length, ir), capture=False)
+        self.current_ir = ir
+        self.ir_resets = num_resets
+        pass
+
+    #f access
+    def access(self, address, data, access):
+        """
+        Perform a single ACCESS DR scan to start an access (or not,
+        if access is access_none), and return the read data of the
+        previous access.
+
+        Idle cycles are inserted first if the previous access was a
+        read; the status returned is recorded in the sticky error.
+        """
+        self.select_ir(self.ir_apb_access)
+        if self.read_pending and self.read_idle_cycles>0:
+            self.jtag_module.run_test_idle(self.read_idle_cycles)
+            pass
+        dr = BitVector(50, ((address&0xffff)<<34) | ((data&0xffffffff)<<2) | access)
+        r = self.tap.jtag_write_drs(dr).value
+        self.num_scans += 1
+        if ((r&3)==self.status_overrun) and self.read_pending and self.adaptive:
+            r = self.back_off(dr)
+            pass
+        self.read_pending = (access==self.access_read)
+        if (r&3)==self.status_overrun: self.error=True
+        return (r>>2) & 0xffffffff
+
+    #f back_off
+    def back_off(self, dr):
+        """
+        Recover from the overrun of a read by the scan of dr (which
+        will not have started its access): increase the idle TCKs,
+        wait for the read to complete, clear the op_status and repeat
+        the scan. Return the value scanned out.
+        """
+        self.num_backoffs += 1
+        self.read_idle_cycles = min(self.max_read_idle_cycles, self.read_idle_cycles + max(1, self.read_idle_cycles//4))
+        self.jtag_module.run_test_idle(self.max_read_idle_cycles)
+        self.clear_status()
+        self.select_ir(self.ir_apb_access)
+        r = self.tap.jtag_write_drs(dr).value
+        self.num_scans += 1
+        return r
+
+    #f check_error
+    def check_error(self):
+        """
+        Raise a JtagApbError if the sticky error is set
+        """
+        if self.error:
+            raise JtagApbError("APB access over JTAG attempted while a previous access was in progress (status 2b11)")
+        pass
+
+    #f clear_status
+    def clear_status(self):
+        """
+        Clear the op_status in the hardware through the CONTROL register
+        """
+        self.select_ir(self.ir_apb_control)
+        self.tap.jtag_write_drs(BitVector(32, self.control_clear_status), capture=False)
+        pass
+
+    #f clear_error
+    def clear_error(self):
+        """
+        Clear the sticky error, and the op_status in the hardware through the CONTROL register
+        """
+        self.clear_status()
+        self.error = False
+        self.read_pending = False
+        pass
+
+    #f probe_read
+    def probe_read(self, address, idle_cycles):
+        """
+        Start a read of address, and capture its result after
+        idle_cycles TCKs in idle; return True if the read had
+        completed (no overrun). The hardware is left idle with its
+        op_status clear.
+        """
+        self.select_ir(self.ir_apb_access)
+        self.tap.jtag_write_drs(BitVector(50, ((address&0xffff)<<34) | self.access_read), capture=False)
+        self.jtag_module.run_test_idle(idle_cycles)
+        r = self.tap.jtag_write_drs(BitVector(50, self.access_none)).value
+        self.num_scans += 2
+        self.jtag_module.run_test_idle(self.max_read_idle_cycles)
+        if (r&3)==self.status_overrun:
+            self.clear_status()
+            return False
+        return True
+
+    #f calibrate
+    def calibrate(self, address, timer_address=None, repeats=4):
+        """
+        Measure the smallest number of idle TCKs after a read (of
+        address) that is safe, and use it for subsequent reads. The
+        smallest value for which a read completes is found with a
+        binary search, and then increased until 'repeats' reads in
+        succession complete (as the clock domain crossing may take
+        a cycle more or less depending on the clock phases).
+
+        If timer_address is given, it should be an APB timer that
+        increments every APB clock; apb_clocks_per_tck is then
+        measured too, from the difference in the timer over two
+        different numbers of idle TCKs.
+
+        Sets and returns read_idle_cycles; read_latency_tcks is set
+        to the TCKs from Update-DR of a read to the Capture-DR that
+        sees it complete.
+        """
+        self.clear_status()
+        self.read_pending = False
+        if not self.probe_read(address, self.max_read_idle_cycles):
+            raise JtagApbError("APB read over JTAG did not complete in %d idle TCKs"%self.max_read_idle_cycles)
+        lo = 0
+        hi = self.max_read_idle_cycles
+        while lo<hi:
+            mid = (lo+hi)//2
+            if self.probe_read(address, mid):
+                hi = mid
+                pass
+            else:
+                lo = mid+1
+                pass
+            pass
+        idle_cycles = lo
+        n = 0
+        while n<repeats:
+            if self.probe_read(address, idle_cycles):
+                n += 1
+                pass
+            else:
+                idle_cycles = min(self.max_read_idle_cycles, idle_cycles+1)
+                n = 0
+                pass
+            pass
+        self.read_idle_cycles = idle_cycles
+        self.read_latency_tcks = idle_cycles + 2
+        if timer_address is not None:
+            self.apb_clocks_per_tck = self.measure_clock_ratio(timer_address)
+            pass
+        return idle_cycles
+
+    #f measure_clock_ratio
+    def measure_clock_ratio(self, timer_address, extra_idle_cycles=(16, 144)):
+        """
+        Measure the APB clocks per TCK (in idle) with three pipelined
+        reads of a free-running APB timer, with two different numbers
+        of extra idle TCKs between them; the cost of the scans is the
+        same for both, so the difference of the timer differences is
+        due only to the difference in idle TCKs
+        """
+        (n0, n1) = extra_idle_cycles
+        self.access(timer_address, 0, self.access_read)
+        self.jtag_module.run_test_idle(n0)
+        t0 = self.access(timer_address, 0, self.access_read)
+        self.jtag_module.run_test_idle(n1)
+        t1 = self.access(timer_address, 0, self.access_read)
+        t2 = self.access(0, 0, self.access_none)
+        self.check_error()
+        d0 = (t1-t0) & 0xffffffff
+        d1 = (t2-t1) & 0xffffffff
+        return (d1-d0) / float(n1-n0)
+
+    #f read_many
+    def read_many(self, addresses):
+        """
+        Read from a list of APB addresses, returning a list of the data read
+        """
+        data = []
+        first = True
+        for address in addresses:
+            d = self.access(address, 0, self.access_read)
+            if not first: data.append(d)
+            first = False
+            pass
+        if not first:
+            data.append(self.access(0, 0, self.access_none))
+            pass
+        self.check_error()
+        return data
+
+    #f write_many
+    def write_many(self, writes):
+        """
+        Write to APB from a list of (address, data)
+        """
+        for (address, data) in writes:
+            self.access(address, data, self.access_write)
+            pass
+        self.check_error()
+        pass
+
+    #f read
+    def read(self, address):
+        """
+        Read a single APB address
+        """
+        return self.read_many([address])[0]
+
+    #f write
+    def write(self, address, data):
+        """
+        Write a single APB address
+        """
+        self.write_many([(address, data)])
+        pass
+    #f words_of
+    @staticmethod
+    def words_of(data):
+        """
+        Return data as an array('I') of 32-bit words; data may be an
+        array('I'), bytes-like (such as bytes or a memoryview, taken
+        as little-endian words), or an iterable of integers
+        """
+        if isinstance(data, array) and (data.typecode=="I"): return data
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = memoryview(data).cast("B")
+            if len(data)%4!=0:
+                raise JtagApbError("Block data of %d bytes is not a whole number of 32-bit words"%len(data))
+            words = array("I")
+            words.frombytes(data)
+            if sys.byteorder=="big": words.byteswap()
+            return words
+        return array("I", data)
+
+    #f words_per_second
+    def words_per_second(self):
+        """
+        Return the throughput of the block transfers so far, in words per second of wall time
+        """
+        if self.block_time==0: return 0.
+        return self.block_words / self.block_time
+
+    #f read_block
+    def read_block(self, address, num_words, address_increment=4):
+        """
+        Read num_words 32-bit words from incrementing APB addresses,
+        returning an array('I')
+        """
+        t = time.perf_counter()
+        data = array("I", self.read_many(range(address, address+num_words*address_increment, address_increment)))
+        self.block_time += time.perf_counter() - t
+        self.block_words += num_words
+        return data
+
+    #f write_block
+    def write_block(self, address, data, address_increment=4):
+        """
+        Write 32-bit words (an array('I'), bytes-like data or an
+        iterable of integers) to incrementing APB addresses; return
+        the number of words written
+        """
+        t = time.perf_counter()
+        words = self.words_of(data)
+        self.write_many(zip(range(address, address+len(words)*address_increment, address_increment), words))
+        self.block_time += time.perf_counter() - t
+        self.block_words += len(words)
+        return len(words)
+
+    #f read_stream
+    def read_stream(self, address, num_words, chunk_words=1024, address_increment=4):
+        """
+        Generate arrays of up to chunk_words words read from
+        incrementing APB addresses, num_words in total (for example,
+        to write to a file with tofile())
+
+        The read pipeline is carried from one chunk to the next: the
+        first read of a chunk is started by the scan that returns the
+        last word of the previous chunk (so each chunk is generated
+        once the next has been started), and the pipeline is drained
+        only at the end.
+        """
+        data = array("I")
+        first = True
+        while num_words>0:
+            t = time.perf_counter()
+            n = min(num_words, chunk_words)
+            for a in range(address, address+n*address_increment, address_increment):
+                d = self.access(a, 0, self.access_read)
+                if not first: data.append(d)
+                first = False
+                pass
+            address += n*address_increment
+            num_words -= n
+            if num_words==0:
+                data.append(self.access(0, 0, self.access_none))
+                pass
+            self.check_error()
+            self.block_time += time.perf_counter() - t
+            if len(data)>=chunk_words:
+                self.block_words += chunk_words
+                yield data[:chunk_words]
+                data = data[chunk_words:]
+                pass
+            pass
+        if len(data)>0:
+            self.block_words += len(data)
+            yield data
+            pass
+        pass
+
+    #f write_stream
+    def write_stream(self, address, source, chunk_words=1024, address_increment=4):
+        """
+        Write words to incrementing APB addresses from a binary file
+        (read chunk_words words at a time) or from an iterable of
+        buffers (each as for write_block); return the number of words
+        written
+        """
+        chunks = source
+        if hasattr(source, "read"):
+            chunks = iter(lambda: source.read(chunk_words*4), b"")
+            pass
+        total = 0
+        for chunk in chunks:
+            n = self.write_block(address, chunk, address_increment)
+            address += n*address_increment
+            total += n
+            pass
+        return total
+
+    pass
@@ -0,0 +1,160 @@
+#a Copyright
+#
+#  This file 'jtag_async.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+An asyncio interface to JtagModule* instances, so that one event loop
+can drive several scan chains (each with its own JtagModule*)
+concurrently.
+
+The JtagModule* backends are blocking (bfm_wait, APB accesses, or
+socket I/O), so a JtagAsync runs the operations of its module in a
+single worker thread of its own; operations on one chain are
+performed in order, and operations on different chains overlap. This
+gives a total time approaching that of the slowest chain when the
+backends spend their time waiting (on hardware, sockets, or separate
+simulator processes); backends that are pure Python computation are
+still serialized by the interpreter.
+
+A simulation that is driven from a single thread (such as a cdl test
+harness) must not be called from worker threads; a JtagAsync with
+threaded=False performs each operation directly in the event loop
+thread, so the same coroutines can be used there (without overlap).
+
+For example:
+
+  async def program(chain, image):
+      await chain.reset()
+      await chain.write_irs(BitVector(5, 0x11))
+      return await chain.call(JtagApbMaster(chain.jtag_module).write_block, 0, image)
+
+  async def main(modules, image):
+      chains = [JtagAsync(m) for m in modules]
+      await asyncio.gather(*[program(c, image) for c in chains])
+      for c in chains: c.close()
+"""
+
+#a Imports
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+#a Classes
+#c JtagAsync
+class JtagAsync:
+    """
+    Async wrapper of a JtagModule* (one per scan chain)
+    """
+    #f __init__
+    def __init__(self, jtag_module, threaded=True, executor=None):
+        """
+        Operations are run in executor if given (operations on this
+        chain are still performed in order), else (if threaded) in a
+        single worker thread owned by this object, else directly
+        """
+        self.jtag_module = jtag_module
+        self.threaded = threaded
+        self.executor = executor
+        self.own_executor = False
+        if threaded and (executor is None):
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jtag")
+            self.own_executor = True
+            pass
+        self.lock = asyncio.Lock()
+        self.num_operations = 0
+        pass
+
+    #f close
+    def close(self):
+        """
+        Shut down the worker thread (if owned)
+        """
+        if self.own_executor: self.executor.shutdown()
+        self.own_executor = False
+        pass
+
+    #f __aenter__
+    async def __aenter__(self):
+        return self
+
+    #f __aexit__
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+        pass
+
+    #f call
+    async def call(self, fn, *args, **kwargs):
+        """
+        Run a blocking function that uses this chain (such as a
+        method of a JtagApbMaster using the module) in order with the
+        other operations of the chain, and return its result
+        """
+        async with self.lock:
+            self.num_operations += 1
+            if not self.threaded: return fn(*args, **kwargs)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        pass
+
+    #f reset
+    async def reset(self):
+        return await self.call(self.jtag_module.jtag_reset)
+
+    #f tms
+    async def tms(self, tms_values):
+        return await self.call(self.jtag_module.jtag_tms, tms_values)
+
+    #f goto
+    async def goto(self, state):
+        return await self.call(self.jtag_module.jtag_goto, state)
+
+    #f shift
+    async def shift(self, tdi_values, last_tms=1, capture=True):
+        return await self.call(self.jtag_module.jtag_shift, tdi_values, last_tms, capture)
+
+    #f run_test_idle
+    async def run_test_idle(self, n):
+        return await self.call(self.jtag_module.run_test_idle, n)
+
+    #f read_idcodes
+    async def read_idcodes(self):
+        return await self.call(self.jtag_module.jtag_read_idcodes)
+
+    #f write_irs
+    async def write_irs(self, ir_bits, end_state=None, capture=True):
+        return await self.call(self.jtag_module.jtag_write_irs, ir_bits, end_state, capture)
+
+    #f write_drs
+    async def write_drs(self, dr_bits, end_state=None, capture=True):
+        return await self.call(self.jtag_module.jtag_write_drs, dr_bits, end_state, capture)
+    pass
+
+#f run_chains
+def run_chains(jtag_modules, coroutine_fn, threaded=True):
+    """
+    Run coroutine_fn(chain) for a JtagAsync of each of jtag_modules
+    concurrently in a new event loop, returning the list of results
+    """
+    async def run_all():
+        chains = [JtagAsync(m, threaded=threaded) for m in jtag_modules]
+        try:
+            return await asyncio.gather(*[coroutine_fn(c) for c in chains])
+        finally:
+            for c in chains: c.close()
+            pass
+        pass
+    return asyncio.run(run_all())
@@ -0,0 +1,891 @@
+#a Copyright
+#
+#  This file 'jtag_model.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+A bit-accurate Python model of tb_jtag_apb_timer: apb_target_jtag,
+jtag_tap and jtag_tap_apb, with an APB target (by default a model
+of apb_target_timer) on the APB master of jtag_tap_apb.
+
+The model is cycle-based, in cycles of jtag_tck (which clocks
+apb_target_jtag and the test harness); the JTAG TAP is clocked by
+jtag_tck gated by the OR of the test harness tck_enable and the
+apb_target_jtag jtag_tck_enable, and the APB clock of jtag_tap_apb
+runs at apb_clocks_per_tck times jtag_tck (3, as in test_jtag), with
+the first APB clock edge of each cycle coinciding with the jtag_tck
+edge.
+
+For speed:
+
+  * the clock domain crossing of jtag_tap_apb is only modelled
+    cycle by cycle while an APB access is in progress; otherwise
+    the APB clock just counts (the timer is evaluated lazily)
+
+  * runs of TCKs in Shift-DR or Shift-IR (from the test harness
+    pins, or from apb_target_jtag fast mode shift commands), and
+    waits with no TCK or with the TAP in an unchanging state, are
+    performed in bulk with integer operations
+
+apb_target_jtag FIFO mode shifts (which overlap with APB accesses)
+are modelled cycle by cycle.
+
+A model created with bulk=False performs everything cycle by cycle,
+as a reference for the bulk paths (test_jtag_model checks that the
+two agree).
+
+JtagModelTh and JtagModelApbBfm present the model with the
+interfaces of the simulation test harness and APB master used by the
+JtagModule* classes (bfm_wait and pins; reg() with read() and
+write()), so those classes can be used with the model in place of
+the simulator.
+
+An APB target for the model requires a single method:
+
+  access(apb_cycle, pwrite, paddr, pwdata)
+
+which performs an APB access (completing in one APB clock) at the
+given APB clock cycle, returning the read data.
+"""
+
+#a Imports
+from .tap_state import TapState, tap_next_state
+
+#a APB targets
+#c ApbTimerModel
+class ApbTimerModel:
+    """
+    Model of apb_target_timer: a 31-bit timer incrementing every APB
+    clock (at register 0), and three comparators (registers 1 to 3),
+    each of whose 'equalled' bit (bit 31 when read) is set when the
+    timer reaches it, and cleared when it is read
+    """
+    mask = 0x7fffffff
+    #f __init__
+    def __init__(self):
+        self.comparators = [0, 0, 0]
+        self.equalled = [0, 0, 0]
+        self.last_cycle = 0
+        pass
+
+    #f advance
+    def advance(self, apb_cycle):
+        """
+        Set the 'equalled' bits for the timer values reached up to apb_cycle
+        """
+        n = apb_cycle - self.last_cycle
+        if n<=0: return
+        first = (self.last_cycle+1) & self.mask
+        for i in range(3):
+            if (n>self.mask) or (((self.comparators[i]-first) & self.mask) < n):
+                self.equalled[i] = 1
+                pass
+            pass
+        self.last_cycle = apb_cycle
+        pass
+
+    #f access
+    def access(self, apb_cycle, pwrite, paddr, pwdata):
+        self.advance(apb_cycle)
+        reg = (paddr>>2) & 3
+        if pwrite:
+            if reg>0:
+                self.comparators[reg-1] = pwdata & self.mask
+                self.equalled[reg-1] = 0
+                pass
+            return 0
+        if reg==0: return apb_cycle & self.mask
+        r = self.comparators[reg-1] | (self.equalled[reg-1]<<31)
+        self.equalled[reg-1] = 0
+        return r
+    pass
+
+#a JTAG TAP and client
+#c JtagTapApbModel
+class JtagTapApbModel:
+    """
+    Model of jtag_tap_apb, the JTAG TAP client with IDCODE, APB
+    CONTROL and APB ACCESS data registers, and an APB master
+    """
+    ir_idcode      = 1
+    ir_apb_control = 0x10
+    ir_apb_access  = 0x11
+    idcode = 0xabcde6e3
+    #f __init__
+    def __init__(self, apb_target=None):
+        self.apb_target = apb_target
+        if apb_target is None: self.apb_target = ApbTimerModel()
+        self.active = False
+        self.apb_cycle = 0
+        # JTAG clock domain
+        self.op_status = 0
+        self.address = 0
+        self.last_read_data = 0
+        self.write_data = 0
+        self.write_not_read = 0
+        self.busy = 0
+        self.ready = 0
+        self.complete_ack = 0
+        self.ready_ack_sync = 0
+        self.complete_sync = 0
+        # APB clock domain
+        self.a_busy = 0
+        self.a_access_in_progress = 0
+        self.a_ready_ack = 0
+        self.a_complete = 0
+        self.a_ready_sync = 0
+        self.a_complete_ack_sync = 0
+        self.a_last_read_data = 0
+        self.a_psel = 0
+        self.a_penable = 0
+        self.a_pwrite = 0
+        self.a_paddr = 0
+        self.a_pwdata = 0
+        pass
+
+    #f tdi_position
+    def tdi_position(self, ir):
+        """
+        Return the bit of the DR that TDI is shifted in to (the DR length less one) for an IR
+        """
+        if (ir==self.ir_idcode) or (ir==self.ir_apb_control): return 31
+        if ir==self.ir_apb_access: return 49
+        return 0
+
+    #f capture_dr
+    def capture_dr(self, ir, dr):
+        """
+        Return the DR captured for an IR, given the current DR
+        """
+        if ir==self.ir_idcode:
+            return (dr & ~0xffffffff) | self.idcode
+        if ir==self.ir_apb_control:
+            return (7<<12) | (self.op_status<<10) | (16<<4) | 1
+        if ir==self.ir_apb_access:
+            op_status = self.op_status
+            if self.busy and not self.write_not_read:
+                self.op_status = 3
+                op_status = 3
+                pass
+            return op_status | (self.last_read_data<<2) | (self.address<<34)
+        return 0
+
+    #f update_dr
+    def update_dr(self, ir, dr):
+        """
+        Update the DR for an IR
+        """
+        if ir==self.ir_apb_control:
+            if (dr>>16)&3: self.op_status = 0
+            pass
+        elif ir==self.ir_apb_access:
+            access = dr&3
+            if (access==1) or (access==2):
+                if self.busy or (self.op_status!=0):
+                    self.op_status = 3
+                    pass
+                else:
+                    self.write_data = (dr>>2) & 0xffffffff
+                    self.address = (dr>>34) & 0xffff
+                    self.ready = 1
+                    self.busy = 1
+                    self.write_not_read = (access==2)
+                    self.active = True
+                    pass
+                pass
+            pass
+        pass
+
+    #f tck_sync
+    def tck_sync(self, old_busy):
+        """
+        Clock the JTAG clock domain handshake (on a TCK edge), given
+        the value of busy before the edge
+        """
+        if old_busy:
+            if self.ready_ack_sync & 1: self.ready = 0
+            if self.complete_sync & 1:
+                self.complete_ack = 1
+                pass
+            elif self.complete_ack:
+                self.complete_ack = 0
+                if not self.write_not_read: self.last_read_data = self.a_last_read_data
+                self.busy = 0
+                pass
+            pass
+        self.ready_ack_sync = (self.ready_ack_sync>>1) | (self.a_ready_ack<<2)
+        self.complete_sync  = (self.complete_sync>>1)  | (self.a_complete<<2)
+        pass
+
+    #f jtag_outputs
+    def jtag_outputs(self):
+        """
+        Return the JTAG clock domain state used by the APB clock domain
+        """
+        return (self.ready, self.complete_ack, self.address, self.write_data, self.write_not_read)
+
+    #f apb_edge
+    def apb_edge(self, jtag_outputs):
+        """
+        Clock the APB clock domain, given the JTAG clock domain state
+        """
+        (ready, complete_ack, address, write_data, write_not_read) = jtag_outputs
+        sync_ready = self.a_ready_sync & 1
+        sync_complete_ack = self.a_complete_ack_sync & 1
+        if self.a_busy:
+            access_in_progress = self.a_access_in_progress
+            if access_in_progress:
+                penable = self.a_penable
+                self.a_penable = 1
+                if penable:
+                    self.a_last_read_data = self.apb_target.access(self.apb_cycle, self.a_pwrite, self.a_paddr, self.a_pwdata)
+                    self.a_penable = 0
+                    self.a_psel = 0
+                    self.a_pwrite = 0
+                    self.a_access_in_progress = 0
+                    pass
+                pass
+            if self.a_ready_ack and not sync_ready:
+                self.a_ready_ack = 0
+                pass
+            elif not access_in_progress:
+                complete = self.a_complete
+                self.a_complete = 1
+                if sync_complete_ack and complete:
+                    self.a_complete = 0
+                    self.a_busy = 0
+                    pass
+                pass
+            pass
+        elif sync_ready:
+            self.a_ready_ack = 1
+            self.a_busy = 1
+            self.a_access_in_progress = 1
+            self.a_paddr = ((address>>8)<<16) | (address&0xff)
+            self.a_penable = 0
+            self.a_psel = 1
+            self.a_pwrite = write_not_read
+            self.a_pwdata = write_data
+            pass
+        self.a_ready_sync        = (self.a_ready_sync>>1)        | (ready<<2)
+        self.a_complete_ack_sync = (self.a_complete_ack_sync>>1) | (complete_ack<<2)
+        self.apb_cycle += 1
+        pass
+
+    #f check_active
+    def check_active(self):
+        """
+        Determine if the clock domain crossing is active (i.e. if it must be modelled cycle by cycle)
+        """
+        self.active = bool(self.busy or self.ready or self.complete_ack or self.ready_ack_sync or self.complete_sync or
+                           self.a_busy or self.a_ready_ack or self.a_complete or self.a_ready_sync or self.a_complete_ack_sync)
+        return self.active
+    pass
+
+#c JtagTapModel
+class JtagTapModel:
+    """
+    Model of jtag_tap, with a 5-bit IR and a 50-bit shift register,
+    and a client (a JtagTapApbModel) for the data registers
+    """
+    ir_length = 5
+    sr_mask = (1<<50)-1
+    #f __init__
+    def __init__(self, client):
+        self.client = client
+        self.state = TapState.test_logic_reset
+        self.sr = 0
+        self.ir = 1
+        pass
+
+    #f tdo
+    def tdo(self):
+        return self.sr & 1
+
+    #f tdi_position
+    def tdi_position(self):
+        """
+        Return the bit of the shift register that TDI is shifted in to in the current state
+        """
+        if self.state==TapState.shift_ir: return self.ir_length-1
+        return self.client.tdi_position(self.ir)
+
+    #f clock
+    def clock(self, tms, tdi):
+        """
+        Clock the TAP with a TCK edge
+        """
+        state = self.state
+        client = self.client
+        old_busy = client.busy
+        if state==TapState.shift_dr:
+            self.sr = (self.sr>>1) | (tdi<<client.tdi_position(self.ir))
+            pass
+        elif state==TapState.shift_ir:
+            self.sr = ((self.sr>>1) & ~0x10) | (tdi<<4)
+            pass
+        elif state==TapState.capture_dr:
+            self.sr = client.capture_dr(self.ir, self.sr)
+            pass
+        elif state==TapState.update_dr:
+            client.update_dr(self.ir, self.sr)
+            pass
+        elif state==TapState.capture_ir:
+            self.sr = self.ir
+            pass
+        elif state==TapState.update_ir:
+            self.ir = self.sr & 0x1f
+            pass
+        elif state==TapState.test_logic_reset:
+            self.ir = 1
+            pass
+        if client.active: client.tck_sync(old_busy)
+        self.state = tap_next_state[state][tms]
+        pass
+
+    #f shift
+    def shift(self, n, tdi):
+        """
+        Clock the TAP n times in Shift-DR or Shift-IR with TMS low,
+        with TDI from the bits of integer tdi; return the TDO values
+        (before each edge) as an integer.
+
+        TDI is ORed in to the shift register as it shifts (as in the
+        hardware), so the TDO and new shift register value are
+        calculated from the stream of the shift register followed by
+        TDI.
+
+        The client must not be active.
+        """
+        if n==0: return 0
+        stream = self.sr | (tdi << (self.tdi_position()+1))
+        self.sr = (stream >> n) & self.sr_mask
+        return stream & ((1<<n)-1)
+    pass
+
+#a apb_target_jtag
+#c ApbTargetJtagModel
+class ApbTargetJtagModel:
+    """
+    Model of apb_target_jtag's JTAG state (jtag_state in the CDL)
+    and FIFO mode state (fifo_state, tdi_fifo and tdo_fifo)
+    """
+    fifo_depth = 4
+    #f __init__
+    def __init__(self):
+        self.tck_enable = 0
+        self.tdi = 0
+        self.tms = 0
+        self.tdo = 0
+        self.tdo_sr = 0
+        self.num_valid_tdo = 0
+        self.num_bytes_valid = 0
+        self.bytes = 0
+        self.bits_remaining = 0
+        self.busy = 0
+        self.cycle = 0
+        self.tdi_fifo = []
+        self.tdo_fifo = []
+        self.fifo_bits_remaining = 0
+        self.fifo_last_tms = 0
+        self.fifo_capture = 0
+        self.fifo_tdi_sr = 0
+        self.fifo_tdi_bits = 0
+        self.fifo_tdo_sr = 0
+        self.fifo_tdo_bits = 0
+        self.fifo_cycle = 0
+        pass
+
+    #f fifo_active
+    def fifo_active(self):
+        return self.fifo_bits_remaining!=0
+
+    #f fifo_shift_stall
+    def fifo_shift_stall(self):
+        """
+        Return True if the FIFO mode shift must stall (for TDI, or for space in the TDO FIFO)
+        """
+        if self.fifo_cycle: return False
+        if (self.fifo_tdi_bits==0) and (len(self.tdi_fifo)==0): return True
+        return self.fifo_capture and (len(self.tdo_fifo)==self.fifo_depth)
+
+    #f edge
+    def edge(self, jtag_tdo, write, read_clear, tdo_write, fifo_command=None, fifo_write=None, fifo_read=False):
+        """
+        Clock apb_target_jtag; write is (num_bytes, data) for a data
+        register write, read_clear is True for a read of tdo_clear,
+        and tdo_write is data for a write of the TDO register (or
+        None); fifo_command and fifo_write are data for writes of the
+        FIFO command and FIFO registers (or None), and fifo_read is
+        True for a read of the FIFO register
+        """
+        tck_enable = 0
+        if self.busy:
+            if self.num_bytes_valid>0:
+                b = self.bytes & 0xff
+                if b & 0x80:
+                    if self.cycle:
+                        tck_enable = 1
+                        self.tdo_sr = (self.tdo_sr>>1) | (jtag_tdo<<31)
+                        self.bits_remaining = (self.bits_remaining-1) & 0x1f
+                        if self.bits_remaining==0x1f:
+                            self.bits_remaining = (self.bytes>>10) & 0x1f
+                            self.bytes >>= 8
+                            self.num_bytes_valid -= 1
+                            pass
+                        pass
+                    else:
+                        op = b&3
+                        if op==0:
+                            self.tms = 1
+                            pass
+                        elif op==1:
+                            self.tms = self.tdo_sr & 1
+                            pass
+                        else:
+                            self.tms = 1 if ((op==3) and (self.bits_remaining==0)) else 0
+                            self.tdi = self.tdo_sr & 1
+                            pass
+                        pass
+                    pass
+                else:
+                    if self.cycle:
+                        if (b&0xf8)==0x30:
+                            tck_enable = (b>>2)&1
+                            pass
+                        elif b==0x52: # 'R'
+                            self.tdo_sr = (self.tdo_sr>>1) | (jtag_tdo<<31)
+                            self.num_valid_tdo = (self.num_valid_tdo+1) & 0x3f
+                            pass
+                        self.bytes >>= 8
+                        self.num_bytes_valid -= 1
+                        pass
+                    elif (b&0xf8)==0x30:
+                        self.tdi = b&1
+                        self.tms = (b>>1)&1
+                        pass
+                    pass
+                self.cycle ^= 1
+                pass
+            else:
+                self.busy = 0
+                pass
+            pass
+        else:
+            if write is not None:
+                (num_bytes, data) = write
+                self.num_bytes_valid = num_bytes
+                self.bytes = data
+                self.busy = 1
+                self.cycle = 0
+                self.bits_remaining = (data>>2) & 0x1f
+                pass
+            if read_clear:
+                self.tdo_sr = 0
+                self.num_valid_tdo = 0
+                pass
+            if tdo_write is not None:
+                self.tdo_sr = tdo_write
+                pass
+            tdi_level = len(self.tdi_fifo)
+            tdo_level = len(self.tdo_fifo)
+            fifo_active = self.fifo_active()
+            if fifo_active and not self.fifo_shift_stall():
+                if self.fifo_cycle:
+                    tck_enable = 1
+                    if self.fifo_capture:
+                        self.fifo_tdo_sr = (self.fifo_tdo_sr>>1) | (jtag_tdo<<31)
+                        self.fifo_tdo_bits = (self.fifo_tdo_bits+1) & 0x1f
+                        if (self.fifo_tdo_bits==0) or (self.fifo_bits_remaining==1):
+                            self.tdo_fifo.append(self.fifo_tdo_sr)
+                            pass
+                        pass
+                    self.fifo_bits_remaining -= 1
+                    pass
+                else:
+                    if self.fifo_tdi_bits==0:
+                        w = self.tdi_fifo.pop(0)
+                        self.tdi = w&1
+                        self.fifo_tdi_sr = w>>1
+                        self.fifo_tdi_bits = 31
+                        pass
+                    else:
+                        self.tdi = self.fifo_tdi_sr&1
+                        self.fifo_tdi_sr >>= 1
+                        self.fifo_tdi_bits -= 1
+                        pass
+                    self.tms = 1 if (self.fifo_last_tms and (self.fifo_bits_remaining==1)) else 0
+                    pass
+                self.fifo_cycle ^= 1
+                pass
+            if (fifo_command is not None) and not fifo_active:
+                self.fifo_bits_remaining = fifo_command & 0xffffff
+                self.fifo_last_tms = (fifo_command>>24) & 1
+                self.fifo_capture  = (fifo_command>>25) & 1
+                self.fifo_cycle = 0
+                self.fifo_tdi_bits = 0
+                self.fifo_tdo_bits = 0
+                pass
+            if (fifo_write is not None) and (tdi_level<self.fifo_depth):
+                self.tdi_fifo.append(fifo_write)
+                pass
+            if fifo_read and (tdo_level>0):
+                self.tdo_fifo.pop(0)
+                pass
+            pass
+        self.tdo = jtag_tdo
+        self.tck_enable = tck_enable
+        pass
+
+    #f status
+    def status(self):
+        return ((self.tdo<<26) | (self.tdi<<25) | (self.tms<<24) |
+                (self.fifo_active()<<23) | (len(self.tdo_fifo)<<20) | (len(self.tdi_fifo)<<16) |
+                self.num_valid_tdo)
+    pass
+
+#a Test bench
+#c JtagApbTimerModel
+class JtagApbTimerModel:
+    """
+    Model of tb_jtag_apb_timer
+    """
+    address_status    = 0
+    address_tdo       = 2
+    address_tdo_clear = 3
+    address_data1     = 4
+    address_data4     = 7
+    address_fifo_command = 8
+    address_fifo      = 9
+    shift_states = (TapState.shift_dr, TapState.shift_ir)
+    #f __init__
+    def __init__(self, apb_target=None, apb_clocks_per_tck=3, bulk=True):
+        self.bulk = bulk
+        self.client = JtagTapApbModel(apb_target)
+        self.tap = JtagTapModel(self.client)
+        self.target = ApbTargetJtagModel()
+        self.apb_clocks_per_tck = apb_clocks_per_tck
+        self.tck_enable = 0
+        self.tms = 0
+        self.tdi = 0
+        self.tdo_sampled = 0
+        self.cycle = 0
+        self.tcks = 0
+        self.apb_reads = 0
+        self.apb_writes = 0
+        pass
+
+    #f step
+    def step(self, write=None, read_clear=False, tdo_write=None, **fifo_access):
+        """
+        Run a single jtag_tck cycle, cycle-accurately; fifo_access
+        may have the FIFO register accesses for ApbTargetJtagModel.edge
+        """
+        tap = self.tap
+        target = self.target
+        client = self.client
+        gate = self.tck_enable | target.tck_enable
+        tms  = self.tms | target.tms
+        tdi  = self.tdi | target.tdi
+        tdo  = tap.sr & 1
+        self.tdo_sampled = tdo
+        target.edge(tdo, write, read_clear, tdo_write, **fifo_access)
+        was_active = client.active
+        if was_active: jtag_outputs = client.jtag_outputs()
+        if gate:
+            tap.clock(tms, tdi)
+            self.tcks += 1
+            pass
+        if client.active:
+            if was_active:
+                client.apb_edge(jtag_outputs)
+                pass
+            else:
+                client.apb_cycle += 1
+                pass
+            for i in range(self.apb_clocks_per_tck-1):
+                client.apb_edge(client.jtag_outputs())
+                pass
+            client.check_active()
+            pass
+        else:
+            client.apb_cycle += self.apb_clocks_per_tck
+            pass
+        self.cycle += 1
+        pass
+
+    #f bulk_fast_shift
+    def bulk_fast_shift(self, max_cycles=None):
+        """
+        If apb_target_jtag is in the second cycle of a bit of a fast
+        mode shift command, with the TAP in a shift state, perform
+        the rest of the command in bulk (if it takes at most
+        max_cycles) and return the number of cycles taken; else return 0
+        """
+        target = self.target
+        if not self.bulk: return 0
+        if not (target.busy and target.cycle and (target.num_bytes_valid>0)): return 0
+        b = target.bytes & 0xff
+        if (b & 0x82)!=0x82: return 0
+        tap = self.tap
+        if (tap.state not in self.shift_states) or self.client.active: return 0
+        if self.tck_enable or self.tms or self.tdi or target.tck_enable: return 0
+        m = target.bits_remaining+1
+        cycles = 2*m-1
+        if (max_cycles is not None) and (cycles>max_cycles): return 0
+        mask = (1<<m)-1
+        tdi = target.tdo_sr & mask
+        samples = tap.shift(m-1, tdi)
+        samples |= (tap.sr & 1) << (m-1)
+        self.tdo_sampled = (samples>>(m-1)) & 1
+        self.tcks += m-1
+        target.tdo_sr = (target.tdo_sr>>m) | (samples<<(32-m))
+        target.tms = 1 if ((b&3)==3) else 0
+        target.tdi = (tdi>>(m-1)) & 1
+        target.tck_enable = 1
+        target.tdo = self.tdo_sampled
+        target.bits_remaining = (target.bytes>>10) & 0x1f
+        target.bytes >>= 8
+        target.num_bytes_valid -= 1
+        target.cycle = 0
+        self.cycle += cycles
+        self.client.apb_cycle += self.apb_clocks_per_tck*cycles
+        return cycles
+
+    #f run
+    def run(self, n):
+        """
+        Run for n jtag_tck cycles with the current test harness pins
+        """
+        tap = self.tap
+        target = self.target
+        client = self.client
+        while n>0:
+            if target.busy or target.tck_enable or client.active or target.fifo_active() or not self.bulk:
+                cycles = self.bulk_fast_shift(n)
+                if cycles>0:
+                    n -= cycles
+                    continue
+                self.step()
+                n -= 1
+                continue
+            # apb_target_jtag idle and clock domain crossing inactive
+            if self.tck_enable:
+                state = tap.state
+                if (state in self.shift_states) and not self.tms:
+                    tdo = tap.shift(n, (1<<n)-1 if self.tdi else 0)
+                    self.tdo_sampled = (tdo>>(n-1)) & 1
+                    pass
+                elif ((state==TapState.idle) and not self.tms) or ((state==TapState.test_logic_reset) and self.tms):
+                    self.tdo_sampled = tap.sr & 1
+                    pass
+                else:
+                    self.step()
+                    n -= 1
+                    continue
+                self.tcks += n
+                pass
+            else:
+                self.tdo_sampled = tap.sr & 1
+                pass
+            target.tdo = tap.sr & 1
+            self.cycle += n
+            client.apb_cycle += self.apb_clocks_per_tck*n
+            n = 0
+            pass
+        pass
+
+    #f apb_stalled
+    def apb_stalled(self, address, pwrite):
+        """
+        Return True if apb_target_jtag stalls an APB access (while
+        busy, or for a FIFO mode shift in progress)
+        """
+        target = self.target
+        if target.busy: return True
+        if not target.fifo_active(): return False
+        if pwrite:
+            if self.address_data1<=address<=self.address_data4: return True
+            if address==self.address_fifo_command: return True
+            if address==self.address_fifo: return len(target.tdi_fifo)==target.fifo_depth
+            return False
+        if address==self.address_fifo: return target.fifo_capture and (len(target.tdo_fifo)==0)
+        return False
+
+    #f run_while_stalled
+    def run_while_stalled(self, address, pwrite):
+        """
+        Run until apb_target_jtag does not stall an APB access
+        """
+        while self.apb_stalled(address, pwrite):
+            if self.bulk_fast_shift()>0: continue
+            self.step()
+            pass
+        pass
+
+    #f apb_write
+    def apb_write(self, address, data):
+        """
+        Perform an APB write to apb_target_jtag (setup cycle, stall, access cycle)
+        """
+        self.apb_writes += 1
+        self.step()
+        self.run_while_stalled(address, True)
+        if address==self.address_tdo:
+            self.step(tdo_write=data & 0xffffffff)
+            pass
+        elif address==self.address_fifo_command:
+            self.step(fifo_command=data & 0xffffffff)
+            pass
+        elif address==self.address_fifo:
+            self.step(fifo_write=data & 0xffffffff)
+            pass
+        elif address>=self.address_data1:
+            self.step(write=(address-self.address_data1+1, data & 0xffffffff))
+            pass
+        else:
+            self.step()
+            pass
+        pass
+
+    #f apb_read
+    def apb_read(self, address):
+        """
+        Perform an APB read of apb_target_jtag (setup cycle, stall, access cycle)
+        """
+        self.apb_reads += 1
+        self.step()
+        self.run_while_stalled(address, False)
+        r = 0
+        read_clear = False
+        if address==self.address_fifo:
+            if len(self.target.tdo_fifo)>0: r = self.target.tdo_fifo[0]
+            self.step(fifo_read=True)
+            return r
+        if address==self.address_status:
+            r = self.target.status()
+            pass
+        elif address==self.address_tdo:
+            r = self.target.tdo_sr
+            pass
+        elif address==self.address_tdo_clear:
+            r = self.target.tdo_sr
+            read_clear = True
+            pass
+        self.step(read_clear=read_clear)
+        return r
+    pass
+
+#a Interfaces for JtagModule*
+#c JtagModelPin
+class JtagModelPin:
+    """
+    A test harness pin of a JtagApbTimerModel
+    """
+    #f __init__
+    def __init__(self, model, name):
+        self.model = model
+        self.name = name
+        pass
+
+    #f drive
+    def drive(self, value):
+        setattr(self.model, self.name, value)
+        pass
+
+    #f value
+    def value(self):
+        return getattr(self.model, self.name)
+    pass
+
+#c JtagModelTh
+class JtagModelTh:
+    """
+    The test harness interface of a JtagApbTimerModel, for JtagModule* classes
+    """
+    #f __init__
+    def __init__(self, model=None):
+        self.model = model
+        if model is None: self.model = JtagApbTimerModel()
+        self.tck_enable = JtagModelPin(self.model, "tck_enable")
+        self.jtag__tms  = JtagModelPin(self.model, "tms")
+        self.jtag__tdi  = JtagModelPin(self.model, "tdi")
+        self.tdo        = JtagModelPin(self.model, "tdo_sampled")
+        self.bfm_waits  = 0
+        pass
+
+    #f bfm_wait
+    def bfm_wait(self, n):
+        self.bfm_waits += 1
+        self.model.run(n)
+        pass
+
+    #f global_cycle
+    def global_cycle(self):
+        return self.model.cycle
+    pass
+
+#c JtagModelApbReg
+class JtagModelApbReg:
+    """
+    An apb_target_jtag register of a JtagApbTimerModel
+    """
+    #f __init__
+    def __init__(self, model, address):
+        self.model = model
+        self.address = address
+        pass
+
+    #f write
+    def write(self, data):
+        self.model.apb_write(self.address, data)
+        pass
+
+    #f read
+    def read(self):
+        return self.model.apb_read(self.address)
+    pass
+
+#c JtagModelApbBfm
+class JtagModelApbBfm:
+    """
+    The APB master interface of a JtagApbTimerModel, for JtagModuleApb* classes
+    """
+    #f __init__
+    def __init__(self, model):
+        self.model = model
+        pass
+
+    #f reg
+    def reg(self, address):
+        return JtagModelApbReg(self.model, address)
+    pass
+
+#c JtagModelMap
+class JtagModelMap:
+    """
+    The register addresses of apb_target_jtag, as used by JtagModuleApb*
+    """
+    status = 0
+    tdo    = 2
+    tdoc   = 3
+    data1  = 4
+    data2  = 5
+    data3  = 6
+    data4  = 7
+    fifo_command = 8
+    fifo   = 9
+    pass
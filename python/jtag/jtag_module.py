@@ -15,19 +15,33 @@
 # limitations under the License.
 #
 
-#a Useful functions
-def int_of_bits(bits):
-    l = len(bits)
-    m = 1<<(l-1)
-    v = 0
-    for b in bits:
-        v = (v>>1) | (m*b)
-        pass
-    return v
+#a Imports
+from .bits import BitVector
+from .tap_state import TapState, tap_follow_resets, tap_tms_path, tap_scan_path
+from .remote_bitbang import RemoteBitbangClient
 
 #a Classes
 #c JtagModuleBase
 class JtagModuleBase:
+    """
+    JTAG driven directly through TCK enable, TMS, TDI and TDO pins.
+
+    The state of the TAP state machine is tracked in tap_state; this
+    is None if it is not known other than being reset or idle (which
+    is the case before the first jtag_reset). Scans move to the shift
+    state along the shortest TMS path from the current state, and
+    move to end_state afterwards (normally idle).
+
+    Each bfm_wait is a round trip to the simulator, so TMS values are
+    driven in runs of equal values with a single bfm_wait for each
+    run; shifts sample TDO, and so need a bfm_wait for every bit,
+    unless the TDO is not captured (capture=False), when the TDI
+    values are driven in runs too.
+
+    Scans and shifts return the data shifted out; with capture=False
+    they return None, and backends avoid the cost of the TDO.
+    """
+    exported_methods = ("jtag_reset", "jtag_tms", "jtag_goto", "jtag_shift", "jtag_read_idcodes", "jtag_write_irs", "jtag_write_drs", "run_test_idle", "jtag_shift_stream", "jtag_write_drs_stream", "jtag_execute")
     #b __init__
     def __init__(self, bfm_wait, tcken, tms, tdi, tdo, mixin=None):
         self.bfm_wait = bfm_wait
@@ -35,14 +49,54 @@ class JtagModuleBase:
         self.jtag__tms = tms
         self.jtag__tdi = tdi
         self.tdo = tdo
-        if mixin is not None:
-            mixin.jtag_reset = self.jtag_reset
-            mixin.jtag_tms   = self.jtag_tms
-            mixin.jtag_shift = self.jtag_shift
-            mixin.jtag_reset = self.jtag_reset
-            mixin.jtag_read_idcodes = self.jtag_read_idcodes
-            mixin.jtag_write_irs = self.jtag_write_irs
-            mixin.jtag_write_drs = self.jtag_write_drs
+        self.tap_state = None
+        self.end_state = TapState.idle
+        self.num_resets = 0
+        self.mixin = mixin
+        self._export()
+        pass
+
+    #f _export
+    def _export(self):
+        """
+        Set the exported methods (as currently bound) on the mixin, if there is one
+        """
+        if self.mixin is None: return
+        for name in self.exported_methods:
+            setattr(self.mixin, name, getattr(self, name))
+            pass
+        pass
+
+    #f _tap_reset
+    def _tap_reset(self):
+        """
+        Record that the TAP has been reset (which also sets its IR to
+        IDCODE); num_resets lets users of the module (such as a
+        JtagApbMaster caching the IR) tell that a reset has happened
+        since they last looked, whatever the TAP state is now
+        """
+        self.tap_state = TapState.test_logic_reset
+        self.num_resets += 1
+        pass
+
+    #f _tap_follow
+    def _tap_follow(self, tms_values):
+        """
+        Update the tracked TAP state after the TMS values of BitVector
+        tms_values, counting a reset if they may have passed through
+        test_logic_reset (as jtag_goto(TapState.test_logic_reset) does)
+        """
+        (self.tap_state, reset) = tap_follow_resets(self.tap_state, tms_values)
+        if reset: self.num_resets += 1
+        pass
+
+    #f _tap_shifted
+    def _tap_shifted(self, last_tms):
+        """
+        Update the tracked TAP state after a shift, which has TMS low
+        for all bits except the last (which has TMS of last_tms)
+        """
+        if last_tms: self._tap_follow(BitVector(1,1))
         pass
 
     #f jtag_reset
@@ -57,44 +111,148 @@ class JtagModuleBase:
         self.jtag__tms.drive(1)
         self.jtag__tdi.drive(0)
         self.bfm_wait(5)
+        self._tap_reset()
         pass
 
     #f jtag_tms
     def jtag_tms(self, tms_values):
         """
         Scan in a number of TMS values, to move the state machine on
+
+        tms_values may be a list of bits or a BitVector
         """
-        for tms in tms_values:
+        tms_values = BitVector.of(tms_values)
+        for (tms, n) in tms_values.runs():
             self.jtag__tms.drive(tms)
-            self.bfm_wait(1)
+            self.bfm_wait(n)
             pass
+        self._tap_follow(tms_values)
+        pass
+
+    #f run_test_idle
+    def run_test_idle(self, n):
+        """
+        Move to idle (if not already there) and run n TCKs in idle
+        """
+        self.jtag_goto(TapState.idle)
+        self.jtag_tms(BitVector(n, 0))
+        pass
+
+    #f jtag_goto
+    def jtag_goto(self, state):
+        """
+        Move the TAP state machine to 'state' with the shortest sequence of TMS values
+        """
+        self.jtag_tms(tap_tms_path(self.tap_state, state))
         pass
 
     #f jtag_shift
-    def jtag_shift(self, tdi_values):
+    def jtag_shift(self, tdi_values, last_tms=1, capture=True):
         """
         Shift in data from tdi_values, and transition out of shift mode
-        Record the shifted out data and return it.
-        Leave the JTAG state machine in Exit1.
+        Record the shifted out data and return it (None if capture is False).
+        Leave the JTAG state machine in Exit1 (if last_tms is 1).
+
+        tdi_values should be a BitVector, and a BitVector of the
+        shifted out data is returned; for compatibility a list of bits
+        may be given instead, in which case a list of bits is returned.
+        """
+        if isinstance(tdi_values, BitVector):
+            return self.jtag_shift_vector(tdi_values, last_tms, capture)
+        tdo = self.jtag_shift_vector(BitVector.of_bits(tdi_values), last_tms, capture)
+        if tdo is None: return None
+        return tdo.bits()
+
+    #f jtag_shift_vector
+    def jtag_shift_vector(self, tdi, last_tms=1, capture=True):
+        """
+        Shift in data from BitVector tdi, and transition out of shift mode
+        Record the shifted out data and return it as a BitVector
+        (or return None if capture is False).
+        Leave the JTAG state machine in Exit1 (if last_tms is 1).
 
         This assumes the state machine is in a shift mode to start
         with.  It runs the JTAG with TMS low for all except the last
-        tdi_values bit.  Then it runs with TMS high so that the last
+        tdi bit.  Then it runs with TMS of last_tms so that the last
         bit is shifted in, and the state machine moves to exit1.
 
+        If TDO is not captured then TDI is driven for runs of equal
+        bits with a single bfm_wait each.
         """
-        bits = []
+        n = tdi.length
+        v = tdi.value
+        tdo = 0
         self.jtag__tms.drive(0)
-        for tdi in tdi_values[:-1]:
-            self.jtag__tdi.drive(tdi)
+        if not capture:
+            for (b, run) in BitVector(n-1, v).runs():
+                self.jtag__tdi.drive(b)
+                self.bfm_wait(run)
+                pass
+            self.jtag__tms.drive(last_tms)
+            self.jtag__tdi.drive((v>>(n-1))&1)
+            self.bfm_wait(1)
+            self._tap_shifted(last_tms)
+            return None
+        for i in range(n-1):
+            self.jtag__tdi.drive((v>>i)&1)
             self.bfm_wait(1)
-            bits.append(self.tdo.value())
+            tdo |= self.tdo.value()<<i
             pass
-        self.jtag__tms.drive(1)
-        self.jtag__tdi.drive(tdi_values[-1])
+        self.jtag__tms.drive(last_tms)
+        self.jtag__tdi.drive((v>>(n-1))&1)
         self.bfm_wait(1)
-        bits.append(self.tdo.value())
-        return bits
+        tdo |= self.tdo.value()<<(n-1)
+        self._tap_shifted(last_tms)
+        return BitVector(n, tdo)
+
+    #f jtag_shift_stream
+    def jtag_shift_stream(self, tdi_chunks, last_tms=1):
+        """
+        Shift in data from an iterable of chunks (each a BitVector,
+        bytes-like data, or a list of bits), generating a BitVector
+        of the data shifted out for each chunk as it is shifted.
+        Leave the JTAG state machine in Exit1 (if last_tms is 1)
+        after the last chunk.
+
+        This assumes the state machine is in a shift mode to start
+        with; it remains in the shift mode between chunks (one chunk
+        is read ahead, so that the last can be shifted with TMS of
+        last_tms), so only one chunk of data in and out is held at a
+        time whatever the length of the scan. Use vectors_of_bytes
+        for chunks of a large buffer or file.
+        """
+        pending = None
+        for chunk in tdi_chunks:
+            if isinstance(chunk, (bytes, bytearray, memoryview)):
+                chunk = BitVector.of_bytes(chunk)
+                pass
+            else:
+                chunk = BitVector.of(chunk)
+                pass
+            if chunk.length==0: continue
+            if pending is not None: yield self.jtag_shift_vector(pending, last_tms=0)
+            pending = chunk
+            pass
+        if pending is not None: yield self.jtag_shift_vector(pending, last_tms)
+        pass
+
+    #f jtag_write_drs_stream
+    def jtag_write_drs_stream(self, tdi_chunks, end_state=None):
+        """
+        Scan data in to the data register from an iterable of chunks,
+        as for jtag_write_drs, generating the data scanned out a
+        chunk at a time as for jtag_shift_stream; the move to
+        end_state is made once the last chunk has been generated.
+
+        There must be at least one bit of data.
+        """
+        if end_state is None: end_state=self.end_state
+        self.jtag_tms(tap_scan_path(self.tap_state, TapState.shift_dr))
+        for tdo in self.jtag_shift_stream(tdi_chunks):
+            yield tdo
+            pass
+        self.jtag_tms(tap_tms_path(TapState.exit1_dr, end_state))
+        pass
 
     #f jtag_read_idcodes
     def jtag_read_idcodes(self):
@@ -110,46 +268,124 @@ class JtagModuleBase:
         Leaves the state machine in shift-dr
         """
         self.jtag_reset()
-        self.jtag_tms([0,1,0,0]) # Put in to shift-dr
+        self.jtag_goto(TapState.shift_dr)
         idcodes = []
         while True:
-            bits = []
             self.bfm_wait(1)
-            bits.append(self.tdo.value())
-            if bits[0]==0: break
-            for i in range(31):
+            idcode = self.tdo.value()
+            if idcode==0: break
+            for i in range(1,32):
                 self.bfm_wait(1)
-                bits.append(self.tdo.value())
+                idcode |= self.tdo.value()<<i
                 pass
-            idcode = int_of_bits(bits)
             idcodes.append(idcode)
             pass
         return idcodes
 
-    #f jtag_write_irs
-    def jtag_write_irs(self,ir_bits):
+    #f jtag_scan
+    def jtag_scan(self, tms_pre, tdi_values, tms_post, capture=True):
+        """
+        Run a complete scan: clock in TMS values tms_pre (which must
+        leave the state machine in a shift state), shift in
+        tdi_values (leaving the state machine in Exit1), then clock in
+        TMS values tms_post. Return the data shifted out, as for jtag_shift.
+
+        This permits a backend to perform the whole scan as a single
+        operation, rather than a sequence of jtag_tms and jtag_shift
         """
-        Requires the JTAG state machine to be in reset or idle
+        self.jtag_tms(tms_pre)
+        data = self.jtag_shift(tdi_values, capture=capture) # Leaves it in Exit1
+        self.jtag_tms(tms_post)
+        return data
 
-        Move to shift-ir, and shift in the bits, then revert back to idle (not through reset!)
+    #f _tap_executed
+    def _tap_executed(self, cmds):
         """
-        self.jtag_tms([0,1,1,0,0]) # Put in Shift-IR
-        self.jtag_shift(ir_bits) # Leaves it in Exit1-IR
-        self.jtag_tms([1,0]) # Dump it back in to idle
+        Update the tracked TAP state after a list of commands, as for jtag_execute
+        """
+        for (op, n, value, capture) in cmds:
+            if op==0:
+                if n>=5: self._tap_reset()
+                else:    self._tap_follow(BitVector(n, -1))
+                pass
+            elif op==1: self._tap_follow(BitVector(n, value))
+            else:       self._tap_shifted(op==3)
+            pass
         pass
 
+    #f jtag_execute
+    def jtag_execute(self, cmds):
+        """
+        Execute a list of commands (op, n, value, capture), in the
+        same form as the fast mode commands of apb_target_jtag
+        (although n may be any length): op 0 is a reset of n clocks
+        of TMS high (at least 5, to reset the TAP),
+        op 1 is n clocks of TMS from the bits of value, op 2 is a
+        shift of n bits of value with TMS low, and op 3 is the same
+        with TMS high on the last bit.
+
+        Return a list with, for each command, its TDO data as an
+        integer (if capture is True) or 0.
+
+        This permits a backend to perform a whole sequence of scans
+        (such as that of a JtagQueue) as few operations as it can;
+        here each command is simply performed in turn.
+        """
+        results = [0] * len(cmds)
+        for (i, (op, n, value, capture)) in enumerate(cmds):
+            if op==0:
+                if n>=5:
+                    self.jtag_reset()
+                    n -= 5
+                    pass
+                if n>0: self.jtag_tms(BitVector(n, -1))
+                pass
+            elif op==1:
+                self.jtag_tms(BitVector(n, value))
+                pass
+            else:
+                tdo = self.jtag_shift_vector(BitVector(n, value), last_tms=(op==3), capture=capture)
+                if capture: results[i] = tdo.value
+                pass
+            pass
+        return results
+
+    #f jtag_write_irs
+    def jtag_write_irs(self, ir_bits, end_state=None, capture=True):
+        """
+        Move from the current state to shift-ir (through capture-ir),
+        shift in the bits, then move to end_state (if None, then
+        self.end_state - normally idle)
+
+        ir_bits should be a BitVector; the data scanned out is
+        returned, as for jtag_shift (None if capture is False)
+        """
+        if end_state is None: end_state=self.end_state
+        tms_pre  = tap_scan_path(self.tap_state, TapState.shift_ir)
+        tms_post = tap_tms_path(TapState.exit1_ir, end_state)
+        return self.jtag_scan(tms_pre, ir_bits, tms_post, capture)
+
     #f jtag_write_drs
-    def jtag_write_drs(self,dr_bits):
+    def jtag_write_drs(self, dr_bits, end_state=None, capture=True):
         """
         Scan data into the data register, and return data scanned out.
-        Requires the JTAG state machine to be in reset or idle.
 
-        Move to shift-dr, and shift in the bits, then revert back to idle (not through reset!)
+        Move from the current state to shift-dr (through capture-dr),
+        shift in the bits, then move to end_state (if None, then
+        self.end_state - normally idle).
+
+        An end_state of update_dr or update_ir permits back-to-back
+        scans with no return to idle, but note that the update is
+        then only performed by the first clock of the next operation.
+
+        dr_bits should be a BitVector, and a BitVector is returned
+        (None if capture is False); a list of bits may be used for
+        compatibility, as for jtag_shift
         """
-        self.jtag_tms([0,1,0,0]) # Put in Shift-DR
-        data = self.jtag_shift(dr_bits) # Leaves it in Exit1-DR
-        self.jtag_tms([1,0]) # Dump it back in to idle
-        return data
+        if end_state is None: end_state=self.end_state
+        tms_pre  = tap_scan_path(self.tap_state, TapState.shift_dr)
+        tms_post = tap_tms_path(TapState.exit1_dr, end_state)
+        return self.jtag_scan(tms_pre, dr_bits, tms_post, capture)
     pass
 #c JtagModule
 class JtagModule(JtagModuleBase):
@@ -157,13 +393,8 @@ class JtagModule(JtagModuleBase):
 #c JtagModuleApbBase
 class JtagModuleApbBase(JtagModuleBase):
     def __init__(self, th, apb_bfm, jtag_map):
-        th.jtag_reset = self.jtag_reset
-        th.jtag_tms   = self.jtag_tms
-        th.jtag_shift = self.jtag_shift
-        th.jtag_reset = self.jtag_reset
-        th.jtag_read_idcodes = self.jtag_read_idcodes
-        th.jtag_write_irs = self.jtag_write_irs
-        th.jtag_write_drs = self.jtag_write_drs
+        self.mixin = th
+        self._export()
         self.bfm_wait = th.bfm_wait
         self.apb_bfm = apb_bfm
         self.jtag_map = jtag_map
@@ -171,7 +402,30 @@ class JtagModuleApbBase(JtagModuleBase):
         self.jtag_tdo_reg   = self.apb_bfm.reg(self.jtag_map.tdo)
         self.jtag_tdocl_reg = self.apb_bfm.reg(self.jtag_map.tdoc)
         self.jtag_data1_reg = self.apb_bfm.reg(self.jtag_map.data1)
+        self.jtag_data2_reg = self.apb_bfm.reg(self.jtag_map.data2)
+        self.jtag_data3_reg = self.apb_bfm.reg(self.jtag_map.data3)
         self.jtag_data4_reg = self.apb_bfm.reg(self.jtag_map.data4)
+        self.jtag_data_regs = [self.jtag_data1_reg, self.jtag_data2_reg, self.jtag_data3_reg, self.jtag_data4_reg]
+        self.tap_state = None
+        self.end_state = TapState.idle
+        self.num_resets = 0
+        pass
+
+    #f _write_chars
+    def _write_chars(self, chars):
+        """
+        Write OpenOCD mode characters (bytes), four at a time with
+        data4, and any remaining one to three with data1 to data3
+        """
+        n = len(chars)
+        i = 0
+        while i+4<=n:
+            self.jtag_data4_reg.write(int.from_bytes(chars[i:i+4], "little"))
+            i += 4
+            pass
+        if i<n:
+            self.jtag_data_regs[n-i-1].write(int.from_bytes(chars[i:], "little"))
+            pass
         pass
 
     #f jtag_reset
@@ -181,56 +435,70 @@ class JtagModuleApbBase(JtagModuleBase):
 
         This leaves the JTAG state machine in reset
         """
-        self.jtag_data4_reg.write(0x36363636)
-        self.jtag_data1_reg.write(0x36)
+        self._write_chars(b"66666")
+        self._tap_reset()
         pass
 
     #f jtag_tms
     def jtag_tms(self, tms_values):
         """
         Scan in a number of TMS values, to move the state machine on
+
+        tms_values may be a list of bits or a BitVector
         """
-        for tms in tms_values:
-            self.jtag_data1_reg.write(0x34+(tms<<1))
-            pass
+        tms_values = BitVector.of(tms_values)
+        v = tms_values.value
+        self._write_chars(bytes([0x34+(((v>>i)&1)<<1) for i in range(tms_values.length)]))
+        self._tap_follow(tms_values)
         pass
 
-    #f jtag_shift
-    def jtag_shift(self, tdi_values, last_tms=1):
+    #f jtag_shift_vector
+    def jtag_shift_vector(self, tdi, last_tms=1, capture=True):
         """
-        Shift in data from tdi_values, and transition out of shift mode
-        Record the shifted out data and return it.
-        Leave the JTAG state machine in Exit1.
+        Shift in data from BitVector tdi, and transition out of shift mode
+        Record the shifted out data and return it as a BitVector
+        (or return None if capture is False).
+        Leave the JTAG state machine in Exit1 (if last_tms is 1).
 
         This assumes the state machine is in a shift mode to start
         with.  It runs the JTAG with TMS low for all except the last
-        tdi_values bit.  Then it runs with TMS high so that the last
+        tdi bit.  Then it runs with TMS of last_tms so that the last
         bit is shifted in, and the state machine moves to exit1.
 
+        Each bit is the characters 'R' (to shift TDO in) and '4' to
+        '7' (to clock with TMS and TDI), packed four characters to an
+        APB write. The TDO shift register is 32 bits, so it is read
+        (and cleared) every 32 bits and at the end of the shift.
+
+        If TDO is not captured then each bit is just '4' or '5' (and
+        '6' or '7' for the last bit), and the TDO register is not read.
         """
-        bits = []
-        n = 0
-        w=32
-        for tdi in tdi_values[:-1]:
-            self.jtag_data1_reg.write(0x52)
-            self.jtag_data1_reg.write(0x34 + (tdi&1))
-            n+=1
-            if n==w:
-                r = self.jtag_tdocl_reg.read()
-                for i in range(n):
-                    bits.append((r>>(w-n+i))&1)
-                    pass
-                n = 0
+        length = tdi.length
+        if not capture:
+            v = tdi.value
+            chars = bytearray(length)
+            for i in range(length):
+                chars[i] = 0x34 + ((v>>i)&1)
                 pass
+            chars[-1] |= last_tms<<1
+            self._write_chars(chars)
+            self._tap_shifted(last_tms)
+            return None
+        w = 32
+        tdo = 0
+        for (start, n, v) in tdi.chunks(w):
+            chars = bytearray(2*n)
+            for i in range(n):
+                chars[2*i]   = 0x52
+                chars[2*i+1] = 0x34 + ((v>>i)&1)
+                pass
+            if start+n==length: chars[-1] |= last_tms<<1
+            self._write_chars(chars)
+            r = self.jtag_tdocl_reg.read()
+            tdo |= (r>>(w-n)) << start
             pass
-        self.jtag_data1_reg.write(0x52)
-        self.jtag_data1_reg.write(0x34 + (last_tms<<1) + (tdi_values[-1]&1))
-        n+=1
-        r = self.jtag_tdocl_reg.read()
-        for i in range(n):
-            bits.append((r>>(w-n+i))&1)
-            pass
-        return bits
+        self._tap_shifted(last_tms)
+        return BitVector(length, tdo)
 
     #f jtag_read_idcodes
     def jtag_read_idcodes(self):
@@ -246,14 +514,13 @@ class JtagModuleApbBase(JtagModuleBase):
         Leaves the state machine in shift-dr
         """
         self.jtag_reset()
-        self.jtag_tms([0,1,0,0]) # Put in to shift-dr
+        self.jtag_goto(TapState.shift_dr)
         idcodes = []
         while True:
-            bits = self.jtag_shift([0]*1,last_tms=0)
-            if bits[0]==0: break
-            bits += self.jtag_shift([0]*31,last_tms=0)
-            idcode = int_of_bits(bits)
-            idcodes.append(idcode)
+            bits = self.jtag_shift_vector(BitVector(1),last_tms=0)
+            if bits.value==0: break
+            bits = bits.concat(self.jtag_shift_vector(BitVector(31),last_tms=0))
+            idcodes.append(bits.value)
             pass
         return idcodes
 
@@ -264,6 +531,97 @@ class JtagModuleApbSlow(JtagModuleApbBase):
     pass
 #c JtagModuleApbFast
 class JtagModuleApbFast(JtagModuleApbBase):
+    """
+    JTAG driven through apb_target_jtag using its fast mode commands.
+
+    A fast mode command is a byte of 0x80 | ((n-1)<<2) | op, which
+    clocks the JTAG n times (1 to 32); op is 0 for TMS high (reset),
+    1 for TMS from the TDO register, 2 for a shift of TDI from the TDO
+    register with TMS low, and 3 for the same with TMS high on the
+    last bit.
+
+    Each bit clocked takes the next bit of the TDO register (for TMS
+    or TDI) and shifts TDO in to its top. Up to four commands can be
+    written at once (with the data1 to data4 registers), so
+    consecutive commands are packed in to single writes provided
+    their total number of clocks is no more than 32; the TDO
+    register is then written once beforehand, and read once
+    afterwards if any of the commands needs its TDO.
+    """
+    #f _fast_groups
+    def _fast_groups(self, cmds):
+        """
+        Split a list of fast mode commands (op, n, tdi, capture), where
+        n may be any length, in to groups that can each be performed
+        with a single write of 1 to 4 commands.
+
+        Each group is a list of [commands, num_commands, num_bits, tdi, needs_tdi, captures]
+        where captures is a list of (cmd_index, cmd_start_bit, group_start_bit, n)
+        """
+        w = 32
+        groups = []
+        group = None
+        for i in range(len(cmds)):
+            (op, length, tdi, capture) = cmds[i]
+            start = 0
+            while start<length:
+                if (group is None) or (group[1]==4) or (group[2]==w):
+                    group = [0, 0, 0, 0, False, []]
+                    groups.append(group)
+                    pass
+                n = length-start
+                if n>w-group[2]: n=w-group[2]
+                cmd_op = op
+                if (op==3) and (start+n<length): cmd_op=2
+                group[0] |= (0x80 | ((n-1)<<2) | cmd_op) << (8*group[1])
+                if op!=0:
+                    group[3] |= ((tdi>>start) & ((1<<n)-1)) << group[2]
+                    group[4] = True
+                    pass
+                if capture:
+                    group[5].append((i, start, group[2], n))
+                    pass
+                group[1] += 1
+                group[2] += n
+                start += n
+                pass
+            pass
+        return groups
+
+    #f _fast_execute
+    def _fast_execute(self, cmds):
+        """
+        Execute a list of fast mode commands (op, n, tdi, capture)
+        where n may be any length (commands are split as required)
+
+        Return a list with, for each command, its TDO data (if capture is True) or 0
+        """
+        w = 32
+        results = [0] * len(cmds)
+        for (commands, num_commands, num_bits, tdi, needs_tdi, captures) in self._fast_groups(cmds):
+            if needs_tdi: self.jtag_tdo_reg.write(tdi)
+            self.jtag_data_regs[num_commands-1].write(commands)
+            if captures!=[]:
+                r = self.jtag_tdocl_reg.read() >> (w-num_bits)
+                for (i, cmd_start, group_start, n) in captures:
+                    results[i] |= ((r>>group_start) & ((1<<n)-1)) << cmd_start
+                    pass
+                pass
+            pass
+        return results
+
+    #f jtag_execute
+    def jtag_execute(self, cmds):
+        """
+        Execute a list of commands, as for JtagModuleBase.jtag_execute;
+        these are fast mode commands, so the whole list is packed
+        together, with the TDO register read only for those
+        writes that include a command whose TDO is captured
+        """
+        results = self._fast_execute(cmds)
+        self._tap_executed(cmds)
+        return results
+
     #f jtag_reset
     def jtag_reset(self):
         """
@@ -271,56 +629,346 @@ class JtagModuleApbFast(JtagModuleApbBase):
 
         This leaves the JTAG state machine in reset
         """
-        self.jtag_data1_reg.write(0x80 + ((4)<<2) )
+        self._fast_execute([(0,5,0,False)])
+        self._tap_reset()
         pass
 
     #f jtag_tms
     def jtag_tms(self, tms_values):
         """
         Scan in a number of TMS values, to move the state machine on
+
+        tms_values may be a list of bits or a BitVector
         """
-        x=0
-        for i in range(len(tms_values)):
-            x += tms_values[i]<<i
-            pass
-        self.jtag_tdo_reg.write(x)
-        self.jtag_data1_reg.write(0x81 + ((len(tms_values)-1)<<2))
+        tms_values = BitVector.of(tms_values)
+        self._fast_execute([(1,tms_values.length,tms_values.value,False)])
+        self._tap_follow(tms_values)
         pass
 
-    #f jtag_shift
-    def jtag_shift(self, tdi_values, last_tms=1):
+    #f jtag_shift_vector
+    def jtag_shift_vector(self, tdi, last_tms=1, capture=True):
         """
-        Shift in data from tdi_values, and transition out of shift mode
-        Record the shifted out data and return it.
-        Leave the JTAG state machine in Exit1.
+        Shift in data from BitVector tdi, and transition out of shift mode
+        Record the shifted out data and return it as a BitVector
+        (or return None if capture is False).
+        Leave the JTAG state machine in Exit1 (if last_tms is 1).
 
         This assumes the state machine is in a shift mode to start
-        with.  It runs the JTAG with TMS low for all except the last
-        tdi_values bit.  Then it runs with TMS high so that the last
-        bit is shifted in, and the state machine moves to exit1.
+        with.  The data is shifted in chunks of up to 32 bits, each
+        chunk being written to the TDO shift register and then shifted
+        with a single command; TMS is set on the last bit of the last
+        chunk if last_tms is 1. The TDO register is only read back if
+        capture is True.
+        """
+        op = 2
+        if last_tms: op=3
+        (tdo,) = self._fast_execute([(op,tdi.length,tdi.value,capture)])
+        self._tap_shifted(last_tms)
+        if not capture: return None
+        return BitVector(tdi.length, tdo)
+
+    #f jtag_scan
+    def jtag_scan(self, tms_pre, tdi_values, tms_post, capture=True):
+        """
+        Run a complete scan, as for JtagModuleBase.jtag_scan, packing
+        the TMS and shift commands together
+        """
+        if not isinstance(tdi_values, BitVector):
+            tdo = self.jtag_scan(tms_pre, BitVector.of_bits(tdi_values), tms_post, capture)
+            if tdo is None: return None
+            return tdo.bits()
+        tms_pre  = BitVector.of(tms_pre)
+        tms_post = BitVector.of(tms_post)
+        (_, tdo, _) = self._fast_execute([(1,tms_pre.length,tms_pre.value,False),
+                                          (3,tdi_values.length,tdi_values.value,capture),
+                                          (1,tms_post.length,tms_post.value,False),
+                                          ])
+        self._tap_follow(tms_pre)
+        self._tap_shifted(1)
+        self._tap_follow(tms_post)
+        if not capture: return None
+        return BitVector(tdi_values.length, tdo)
+
+    pass
 
+#c JtagModuleApbFifo
+class JtagModuleApbFifo(JtagModuleApbFast):
+    """
+    JTAG driven through apb_target_jtag using its fast mode commands,
+    and its FIFO mode for shifts of at least fifo_threshold bits.
+
+    A FIFO mode shift is started with a write of the FIFO command
+    register (the number of bits, last TMS and capture), and its TDI
+    is written to the TDI FIFO a word at a time; if TDO is captured
+    it is read a word at a time from the TDO FIFO. The TDI FIFO is
+    filled first, and then each TDO word read is followed by the
+    write of the next TDI word; the hardware stalls the APB until
+    TDO is available (or there is space for TDI), so the FIFO is
+    kept full and the JTAG is clocked continuously, with just one APB
+    access per 32 bits shifted (or two, if TDO is captured). A write
+    of the FIFO command register is stalled until any shift in
+    progress completes, so consecutive shifts may be started without
+    polling the status.
+
+    Shorter shifts, and TMS sequences, use fast mode commands (as
+    JtagModuleApbFast), which pack in to fewer APB accesses.
+    """
+    fifo_depth = 4
+    fifo_max_bits = (1<<24)-32
+    #f __init__
+    def __init__(self, th, apb_bfm, jtag_map, fifo_threshold=64):
+        super(JtagModuleApbFifo, self).__init__(th, apb_bfm, jtag_map)
+        self.jtag_fifo_command_reg = self.apb_bfm.reg(self.jtag_map.fifo_command)
+        self.jtag_fifo_reg         = self.apb_bfm.reg(self.jtag_map.fifo)
+        self.fifo_threshold = fifo_threshold
+        pass
+
+    #f _fifo_shift
+    def _fifo_shift(self, n, tdi, last_tms, capture):
+        """
+        Shift n bits of tdi (an integer) in FIFO mode, with TMS of
+        last_tms on the last bit; return the TDO (if capture) or 0
         """
-        bits = []
-        n = 0
         w = 32
-        total = len(tdi_values)
-        i = 0
-        while i<total:
-            n = total-i
-            if n>32: n=32
-            set_last_tms = 0
-            if last_tms and ((i+n)==total): set_last_tms=1
-            x = 0
-            for b in range(n):
-                x += tdi_values[i+b]<<b
+        mask = (1<<w)-1
+        tdo = 0
+        start = 0
+        while start<n:
+            length = min(n-start, self.fifo_max_bits)
+            last = last_tms if (start+length==n) else 0
+            num_words = (length+w-1)//w
+            v = tdi>>start
+            self.jtag_fifo_command_reg.write(length | (last<<24) | (capture<<25))
+            for i in range(min(self.fifo_depth, num_words)):
+                self.jtag_fifo_reg.write((v>>(w*i)) & mask)
                 pass
-            self.jtag_tdo_reg.write(x)
-            self.jtag_data1_reg.write(0x82 + set_last_tms + ((n-1)<<2))
-            i += n
-            r = self.jtag_tdocl_reg.read()
-            for b in range(n):
-                bits.append((r>>(w-n+b))&1)
+            for i in range(num_words):
+                if capture:
+                    bits = min(w, length-w*i)
+                    tdo |= (self.jtag_fifo_reg.read() >> (w-bits)) << (start+w*i)
+                    pass
+                if i+self.fifo_depth<num_words:
+                    self.jtag_fifo_reg.write((v>>(w*(i+self.fifo_depth))) & mask)
+                    pass
                 pass
+            start += length
+            pass
+        return tdo
+
+    #f _fast_execute
+    def _fast_execute(self, cmds):
+        """
+        Execute a list of fast mode commands (op, n, tdi, capture) as
+        JtagModuleApbFast does, except that shifts of at least
+        fifo_threshold bits are performed in FIFO mode
+        """
+        results = [0] * len(cmds)
+        start = 0
+        for i in range(len(cmds)):
+            (op, n, tdi, capture) = cmds[i]
+            if (op<2) or (n<self.fifo_threshold): continue
+            if start<i:
+                results[start:i] = super(JtagModuleApbFifo, self)._fast_execute(cmds[start:i])
+                pass
+            results[i] = self._fifo_shift(n, tdi, int(op==3), int(bool(capture)))
+            start = i+1
+            pass
+        if start<len(cmds):
+            results[start:] = super(JtagModuleApbFifo, self)._fast_execute(cmds[start:])
             pass
-        return bits
+        return results
+
+    pass
+
+#c JtagModuleRemoteBitbang
+# Translations of '0'/'1' bits to the remote_bitbang characters with TCK low and high
+_bitbang_tms_low   = bytes.maketrans(b"01", b"02")
+_bitbang_tms_high  = bytes.maketrans(b"01", b"46")
+_bitbang_tdi_high  = bytes.maketrans(b"01", b"45")
+class JtagModuleRemoteBitbang(JtagModuleBase):
+    """
+    JTAG driven through a TCP or Unix socket with the OpenOCD
+    remote_bitbang protocol, such as to an OpenocdServer.
+
+    Each TCK is two characters, '0' to '3' (TCK low with TMS and
+    TDI) and '4' to '7' (TCK high); an 'R' is inserted before the
+    rising edge of TCK only for shifts whose TDO is captured, and the
+    server responds with a '0' or '1' for each.
+
+    The characters for a whole operation (a scan is its TMS path,
+    shift and TMS path out; a jtag_execute is all of its commands)
+    are built at once, sent with a single send, and the response
+    received and converted to integers at once; each operation is
+    then a single round trip, of two bytes per TCK (three if TDO is
+    captured).
+
+    Counts of the bytes sent and received, the TCKs and the round
+    trips are kept, for benchmarking.
+    """
+    #f __init__
+    def __init__(self, host="127.0.0.1", port=None, path=None, client=None, mixin=None):
+        """
+        Connect to host and port (or the Unix socket path), unless
+        client (a connected RemoteBitbangClient) is given
+        """
+        if client is None: client = RemoteBitbangClient(host=host, port=port, path=path)
+        self.client = client
+        self.tap_state = None
+        self.end_state = TapState.idle
+        self.num_resets = 0
+        self.mixin = mixin
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.tcks = 0
+        self.transfers = 0
+        self._export()
+        pass
+
+    #f close
+    def close(self):
+        """
+        Quit the remote_bitbang session and close the socket
+        """
+        self.client.close()
+        pass
+
+    #f _bitbang_encode
+    def _bitbang_encode(self, cmds):
+        """
+        Return the remote_bitbang characters for a list of commands
+        (op, n, value, capture), as for jtag_execute
+        """
+        data = bytearray()
+        for (op, n, value, capture) in cmds:
+            if n==0: continue
+            if op==0: value = -1
+            bits = format(value & ((1<<n)-1), "0%db"%n).encode("ascii")[::-1]
+            if op<2:
+                chars = bytearray(2*n)
+                chars[0::2] = bits.translate(_bitbang_tms_low)
+                chars[1::2] = bits.translate(_bitbang_tms_high)
+                pass
+            else:
+                k = 2
+                if capture: k = 3
+                chars = bytearray(k*n)
+                chars[0::k] = bits
+                if capture: chars[1::3] = b"R"*n
+                chars[k-1::k] = bits.translate(_bitbang_tdi_high)
+                if op==3:
+                    chars[-k] |= 2
+                    chars[-1] |= 2
+                    pass
+                pass
+            data += chars
+            pass
+        return data
+
+    #f jtag_execute
+    def jtag_execute(self, cmds):
+        """
+        Execute a list of commands, as for JtagModuleBase.jtag_execute,
+        as a single round trip to the server
+        """
+        data = self._bitbang_encode(cmds)
+        if len(data)==0: return [0] * len(cmds)
+        response = self.client.transfer(data)
+        self.bytes_sent += len(data)
+        self.bytes_received += len(response)
+        self.transfers += 1
+        results = [0] * len(cmds)
+        start = 0
+        for (i, (op, n, value, capture)) in enumerate(cmds):
+            self.tcks += n
+            if capture and (op>=2):
+                results[i] = int(bytes(response[start:start+n][::-1]), 2)
+                start += n
+                pass
+            pass
+        self._tap_executed(cmds)
+        return results
+
+    #f jtag_reset
+    def jtag_reset(self):
+        """
+        Reset the jtag - this requires 5 clocks with TMS high.
+
+        This leaves the JTAG state machine in reset
+        """
+        self.jtag_execute([(0,5,0,False)])
+        pass
+
+    #f jtag_tms
+    def jtag_tms(self, tms_values):
+        """
+        Scan in a number of TMS values, to move the state machine on
+
+        tms_values may be a list of bits or a BitVector
+        """
+        tms_values = BitVector.of(tms_values)
+        self.jtag_execute([(1,tms_values.length,tms_values.value,False)])
+        pass
+
+    #f jtag_shift_vector
+    def jtag_shift_vector(self, tdi, last_tms=1, capture=True):
+        """
+        Shift in data from BitVector tdi, and transition out of shift mode
+        Record the shifted out data and return it as a BitVector
+        (or return None if capture is False).
+        Leave the JTAG state machine in Exit1 (if last_tms is 1).
+
+        This assumes the state machine is in a shift mode to start
+        with; the whole shift is a single round trip to the server,
+        with an 'R' for each bit only if capture is True.
+        """
+        op = 2
+        if last_tms: op=3
+        (tdo,) = self.jtag_execute([(op,tdi.length,tdi.value,capture)])
+        if not capture: return None
+        return BitVector(tdi.length, tdo)
+
+    #f jtag_scan
+    def jtag_scan(self, tms_pre, tdi_values, tms_post, capture=True):
+        """
+        Run a complete scan, as for JtagModuleBase.jtag_scan, as a
+        single round trip to the server
+        """
+        if not isinstance(tdi_values, BitVector):
+            tdo = self.jtag_scan(tms_pre, BitVector.of_bits(tdi_values), tms_post, capture)
+            if tdo is None: return None
+            return tdo.bits()
+        tms_pre  = BitVector.of(tms_pre)
+        tms_post = BitVector.of(tms_post)
+        (_, tdo, _) = self.jtag_execute([(1,tms_pre.length,tms_pre.value,False),
+                                         (3,tdi_values.length,tdi_values.value,capture),
+                                         (1,tms_post.length,tms_post.value,False),
+                                         ])
+        if not capture: return None
+        return BitVector(tdi_values.length, tdo)
+
+    #f jtag_read_idcodes
+    def jtag_read_idcodes(self):
+        """
+        Read the JTAG idcodes on the scan chain. Return a list of 32-bit integer IDCODEs.
+
+        This resets the JTAG state machine, and then enters shift-dr.
+        In reset the JTAG TAP controllers should set the IR for IDCODE reading.
+        IDCODEs are guaranteed to be 32 bits, with a bottom bit set.
+
+        Hence one can scan out 32-bit values from the chain while the first bit out is set.
+
+        Leaves the state machine in shift-dr
+        """
+        self.jtag_reset()
+        self.jtag_goto(TapState.shift_dr)
+        idcodes = []
+        while True:
+            bits = self.jtag_shift_vector(BitVector(1),last_tms=0)
+            if bits.value==0: break
+            bits = bits.concat(self.jtag_shift_vector(BitVector(31),last_tms=0))
+            idcodes.append(bits.value)
+            pass
+        return idcodes
+
+    pass
 
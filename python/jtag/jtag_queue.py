@@ -0,0 +1,261 @@
+#a Copyright
+#
+#  This file 'jtag_queue.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+A deferred queue of JTAG operations for a JtagModule*, in the manner
+of the OpenOCD JTAG queue.
+
+Operations (resets, TMS sequences, run-test-idle clocks, and IR and
+DR scans) are added to a JtagQueue, which compiles them to a list of
+commands (op, n, value, capture) for jtag_execute of the module; none
+are performed until execute() is called. The TAP state is followed
+as the operations are added, so each scan moves from the state the
+previous operation left.
+
+A scan added with capture=True returns a JtagQueueResult, whose value
+(a BitVector of the data scanned out) is available once the queue
+has been executed (reading it executes the queue if required); a
+scan with capture=False returns None, and its data is discarded.
+
+JtagModuleApbFast executes a whole queue as fast mode commands,
+packing the commands of successive operations into the same APB
+writes and reading the TDO register only for writes that include a
+captured scan; a long scripted sequence of (say) IR writes and DR
+writes then takes a fraction of the APB transactions it would as
+individual jtag_write_irs and jtag_write_drs calls. Other backends
+perform the commands in turn.
+
+For example:
+
+  with JtagQueue(jtag_module) as q:
+      q.add_reset()
+      q.add_ir_scan(BitVector(5, 0x11))
+      status = q.add_dr_scan(BitVector(36, 0))
+      pass
+  print(status.value)
+"""
+
+#a Imports
+from .bits import BitVector
+from .tap_state import TapState, tap_follow, tap_tms_path, tap_scan_path
+
+#a Exceptions
+class JtagQueueError(Exception): pass
+
+#a Classes
+#c JtagQueueResult
+class JtagQueueResult:
+    """
+    The data scanned out by a queued scan, available after the queue is executed
+    """
+    #f __init__
+    def __init__(self, queue, length):
+        self.queue = queue
+        self.length = length
+        self.data = None
+        pass
+
+    #f ready
+    def ready(self):
+        """
+        Return True if the scan has been performed
+        """
+        return self.data is not None
+
+    #f value
+    @property
+    def value(self):
+        """
+        The BitVector scanned out; the queue is executed if it has not been
+        """
+        if self.data is None: self.queue.execute()
+        if self.data is None: raise JtagQueueError("Result of a JTAG queue that was discarded")
+        return self.data
+
+    #f __repr__
+    def __repr__(self):
+        return "JtagQueueResult(%s)"%(repr(self.data) if self.data is not None else "pending")
+    pass
+
+#c JtagQueue
+class JtagQueue:
+    """
+    A queue of JTAG operations for a JtagModule*, performed by execute()
+    """
+    #f __init__
+    def __init__(self, jtag_module, end_state=None):
+        """
+        Scans end in end_state unless given otherwise (default that of the module)
+        """
+        self.jtag_module = jtag_module
+        self.end_state = end_state
+        if end_state is None: self.end_state = jtag_module.end_state
+        self.num_executes = 0
+        self.num_operations = 0
+        self.discard()
+        pass
+
+    #f discard
+    def discard(self):
+        """
+        Remove all the queued operations without performing them
+        """
+        self.cmds = []
+        self.results = []
+        self.tap_state = None
+        pass
+
+    #f __len__
+    def __len__(self):
+        return len(self.cmds)
+
+    #f __enter__
+    def __enter__(self):
+        return self
+
+    #f __exit__
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Execute the queue, unless an exception was raised (when the queue is discarded)
+        """
+        if exc_type is None:
+            self.execute()
+            pass
+        else:
+            self.discard()
+            pass
+        pass
+
+    #f _state
+    def _state(self):
+        """
+        Return the TAP state at the end of the queue
+        """
+        if len(self.cmds)==0: return self.jtag_module.tap_state
+        return self.tap_state
+
+    #f _add
+    def _add(self, op, n, value, capture=False):
+        """
+        Add a command, merging TMS commands with a preceding TMS
+        command of the same op; return its index
+        """
+        if n==0: return None
+        if (op<2) and (len(self.cmds)>0):
+            (last_op, last_n, last_value, _) = self.cmds[-1]
+            if last_op==op:
+                self.cmds[-1] = (op, last_n+n, last_value | (value<<last_n), False)
+                return len(self.cmds)-1
+            pass
+        self.cmds.append((op, n, value, capture))
+        return len(self.cmds)-1
+
+    #f add_reset
+    def add_reset(self):
+        """
+        Add a JTAG reset (five TCKs with TMS high)
+        """
+        self.num_operations += 1
+        self._add(0, 5, 0)
+        self.tap_state = TapState.test_logic_reset
+        pass
+
+    #f add_tms
+    def add_tms(self, tms_values):
+        """
+        Add a sequence of TMS values (a BitVector or list of bits)
+        """
+        tms_values = BitVector.of(tms_values)
+        state = self._state()
+        self.num_operations += 1
+        self._add(1, tms_values.length, tms_values.value)
+        self.tap_state = tap_follow(state, tms_values)
+        pass
+
+    #f add_goto
+    def add_goto(self, state):
+        """
+        Add the shortest sequence of TMS values to move to 'state'
+        """
+        self.add_tms(tap_tms_path(self._state(), state))
+        pass
+
+    #f add_runtest
+    def add_runtest(self, n):
+        """
+        Move to idle (if not already there) and run n TCKs in idle
+        """
+        tms_values = tap_tms_path(self._state(), TapState.idle).concat(BitVector(n, 0))
+        self.add_tms(tms_values)
+        pass
+
+    #f _add_scan
+    def _add_scan(self, shift_state, exit1_state, bits, capture, end_state):
+        """
+        Add a scan through shift_state of bits, ending in end_state
+        """
+        bits = BitVector.of(bits)
+        if end_state is None: end_state = self.end_state
+        if bits.length==0: raise JtagQueueError("JTAG scan of no bits")
+        state = self._state()
+        tms_pre  = tap_scan_path(state, shift_state)
+        tms_post = tap_tms_path(exit1_state, end_state)
+        self.num_operations += 1
+        self._add(1, tms_pre.length, tms_pre.value)
+        index = self._add(3, bits.length, bits.value, capture)
+        self._add(1, tms_post.length, tms_post.value)
+        self.tap_state = tap_follow(exit1_state, tms_post)
+        if not capture: return None
+        result = JtagQueueResult(self, bits.length)
+        self.results.append((index, result))
+        return result
+
+    #f add_ir_scan
+    def add_ir_scan(self, ir_bits, capture=False, end_state=None):
+        """
+        Add a scan of ir_bits in to the IR (as for jtag_write_irs);
+        if capture is True, return a JtagQueueResult of the data
+        scanned out, else return None (the data is discarded)
+        """
+        return self._add_scan(TapState.shift_ir, TapState.exit1_ir, ir_bits, capture, end_state)
+
+    #f add_dr_scan
+    def add_dr_scan(self, dr_bits, capture=True, end_state=None):
+        """
+        Add a scan of dr_bits in to the DR (as for jtag_write_drs);
+        if capture is True, return a JtagQueueResult of the data
+        scanned out, else return None (the data is discarded)
+        """
+        return self._add_scan(TapState.shift_dr, TapState.exit1_dr, dr_bits, capture, end_state)
+
+    #f execute
+    def execute(self):
+        """
+        Perform the queued operations with the module, and set the
+        results of the captured scans; the queue is then empty
+        """
+        if len(self.cmds)==0: return
+        (cmds, results) = (self.cmds, self.results)
+        self.discard()
+        self.num_executes += 1
+        tdo = self.jtag_module.jtag_execute(cmds)
+        for (index, result) in results:
+            result.data = BitVector(result.length, tdo[index])
+            pass
+        pass
+    pass
@@ -1,6 +1,6 @@
 #a Copyright
-#  
-#  This file 'jtag_module.py' copyright Gavin J Stark 2018
+#
+#  This file 'openocd_server.py' copyright Gavin J Stark 2018-2020
 #
 # Licensed under the Apache License, Version 2.0 (the "License");
 # you may not use this file except in compliance with the License.
@@ -15,49 +15,902 @@
 # limitations under the License.
 #
 
+#a Documentation
+"""
+A server for the OpenOCD remote_bitbang protocol.
+
+OpenOCD (with 'adapter driver remote_bitbang') connects to a TCP or
+Unix socket and sends single characters:
+
+  '0'-'7' : set TDI to bit 0, TMS to bit 1, and TCK to bit 2
+  'R'     : read TDO; the server responds with '0' or '1'
+  'B','b' : blink an LED on or off (ignored)
+  'r'-'u' : set TRST and SRST (ignored)
+  'Q'     : quit
+
+A rising edge of TCK (a character with bit 2 set) clocks the JTAG
+chain; TDO is read before the rising edge.
+
+The server runs an asyncio event loop in its own thread. Received
+data is read directly in to a bytearray (with asyncio.BufferedProtocol),
+and each wakeup hands the whole batch of characters received from
+the client with the current scheduling slot to a BitbangTarget:
+
+  * if the server is given a target then the batch is handled in
+    the event loop, and the response written back immediately
+
+  * otherwise the batch is queued, and another thread (such as a
+    simulation test harness, which must itself drive the JTAG pins)
+    drains all the queued batches of a client at once with receive(),
+    and responds with send(); serve(target) does this in a loop
+
+Several clients (such as an OpenOCD session and a Python test script
+with a JtagModuleRemoteBitbang) may share the one target. The TAP
+state of the chain is followed through the characters (by a
+BitbangTapTracker), and the scheduling slot moves between clients
+with data waiting only at JTAG transaction boundaries, with the TAP
+in Reset or Idle; data of the other clients is held and handed over
+as a single batch when they are scheduled. See OpenocdServer for
+the scheduling rules.
+
+Throughput and queue-depth counters are kept in an OpenocdServerStats,
+with latency and throughput counters for each client in an
+OpenocdClientStats.
+"""
+
 #a Imports
-import Queue
-import socket
-import select
-import simple_tb
-
-#a Useful functions
-def int_of_bits(bits):
-    l = len(bits)
-    m = 1<<(l-1)
-    v = 0
-    for b in bits:
-        v = (v>>1) | (m*b)
-        pass
-    return v
-
-def bits_of_n(nbits, n):
-    bits = []
-    for i in range(nbits):
-        bits.append(n&1)
-        n >>= 1
-        pass
-    return bits
-
-#a Classes
-#c openocd_server
-class openocd_server(simple_tb.base_th.tcp_server_thread):
-    def __init__(self, **kwargs):
-        simple_tb.base_th.tcp_server_thread.__init__(self, **kwargs)
-        self.queue_recvd   = Queue.Queue()
-        self.queue_to_send = Queue.Queue()
-        self.data_to_send = ""
-        pass
-    def update_data_to_send(self):
-        while not self.queue_to_send.empty():
-            self.data_to_send += self.queue_to_send.get()
-            pass
-        return self.data_to_send
-    def did_send_data(self, n):
-        self.data_to_send = self.data_to_send[n:]
-        pass
-    def received_data(self, data):
-        self.queue_recvd.put(data)
-        pass
-    pass
-        
+import asyncio
+import queue
+import re
+import threading
+import time
+from .bits import BitVector
+from .tap_state import TapState, tap_next_state, tap_tms_path
+from .remote_bitbang import RemoteBitbangClient
+
+#a Bitbang targets
+#c BitbangTarget
+class BitbangTarget:
+    """
+    Base class for a target of remote_bitbang characters
+    """
+    #f bitbang
+    def bitbang(self, data):
+        """
+        Handle a batch of remote_bitbang characters (bytes, bytearray
+        or memoryview), and return a bytes-like response with a '0'
+        or '1' for each 'R'
+        """
+        raise NotImplementedError
+
+    #f quit
+    def quit(self):
+        """
+        Invoked when the last client quits or disconnects
+        """
+        pass
+    pass
+
+#c BitbangLoopbackTarget
+class BitbangLoopbackTarget(BitbangTarget):
+    """
+    A stand-in target that behaves as a single 1-bit BYPASS register:
+    TDO is the TDI at the last rising edge of TCK
+    """
+    #f __init__
+    def __init__(self):
+        self.tck = 0
+        self.tdi = 0
+        self.tdo = 0
+        self.tcks = 0
+        pass
+
+    #f bitbang
+    def bitbang(self, data):
+        response = bytearray()
+        for c in data:
+            if (c&0xf8)==0x30:
+                tck = (c>>2)&1
+                if tck and not self.tck:
+                    self.tdo = self.tdi
+                    self.tcks += 1
+                    pass
+                self.tck = tck
+                self.tdi = c&1
+                pass
+            elif c==0x52: # 'R'
+                response.append(0x30+self.tdo)
+                pass
+            pass
+        return response
+    pass
+
+#c BitbangJtagPinsTarget
+class BitbangJtagPinsTarget(BitbangTarget):
+    """
+    A target that drives JTAG pins in a simulation (as JtagModule does)
+
+    A rising edge of TCK enables the JTAG clock for one cycle; an 'R'
+    waits for one cycle with the clock disabled and samples TDO.
+    This must be used from the simulation test harness thread.
+    """
+    #f __init__
+    def __init__(self, bfm_wait, tcken, tms, tdi, tdo):
+        self.bfm_wait = bfm_wait
+        self.tck_enable = tcken
+        self.jtag__tms = tms
+        self.jtag__tdi = tdi
+        self.tdo = tdo
+        self.tck = 0
+        self.tck_enable.drive(0)
+        pass
+
+    #f bitbang
+    def bitbang(self, data):
+        response = bytearray()
+        for c in data:
+            if (c&0xf8)==0x30:
+                tck = (c>>2)&1
+                self.jtag__tdi.drive(c&1)
+                self.jtag__tms.drive((c>>1)&1)
+                if tck and not self.tck:
+                    self.tck_enable.drive(1)
+                    self.bfm_wait(1)
+                    self.tck_enable.drive(0)
+                    pass
+                self.tck = tck
+                pass
+            elif c==0x52: # 'R'
+                self.bfm_wait(1)
+                response.append(0x30+self.tdo.value())
+                pass
+            pass
+        return response
+    pass
+
+#a Server
+_non_pin_chars = bytes([c for c in range(256) if (c&0xf8)!=0x30])
+_rising_edge   = re.compile(rb"[0-3]([4-7])")
+_tms_of_char   = bytes.maketrans(b"4567", b"0011")
+
+#c BitbangTapTracker
+class BitbangTapTracker:
+    """
+    Follows the TCK level, last pin character and TAP state of the
+    chain of an OpenocdServer through the characters that drive it
+
+    The TAP state is None until it is known (after five TMS=1 clocks)
+    """
+    boundary_states = (TapState.test_logic_reset, TapState.idle)
+    #f __init__
+    def __init__(self):
+        self.tck = 0
+        self.last_char = None
+        self.tap_state = None
+        self.tms_ones = 0
+        self.clocks = 0
+        pass
+
+    #f at_boundary
+    def at_boundary(self):
+        """
+        Return True if the chain is between JTAG transactions (in Reset or Idle)
+        """
+        return self.tap_state in self.boundary_states
+
+    #f follow
+    def follow(self, data, stop_at_boundary=False):
+        """
+        Follow the characters of data; if stop_at_boundary is True
+        then stop before the first character at which the chain is
+        in Reset or Idle. Return the number of characters followed.
+
+        Unless stopping at a boundary, the rising edges of TCK are
+        found with a regular expression over the pin characters, and
+        the TAP state is followed through runs of TMS values.
+        """
+        if stop_at_boundary: return self.follow_to_boundary(data)
+        chars = bytes(data).translate(None, _non_pin_chars)
+        if len(chars)==0: return len(data)
+        edges = _rising_edge.findall((b"4" if self.tck else b"0") + chars)
+        self.last_char = chars[-1]
+        self.tck = self.last_char&4
+        n = len(edges)
+        if n==0: return len(data)
+        self.clocks += n
+        tms = BitVector(n, int(b"".join(edges).translate(_tms_of_char)[::-1], 2))
+        state = self.tap_state
+        ones = self.tms_ones
+        for (t, run) in tms.runs():
+            ones = (ones+run) if t else 0
+            if state is None:
+                if ones>=5: state = TapState.test_logic_reset
+                continue
+            for i in range(run):
+                next_state = tap_next_state[state][t]
+                if next_state==state: break
+                state = next_state
+                pass
+            pass
+        self.tap_state = state
+        self.tms_ones = ones
+        return len(data)
+
+    #f follow_to_boundary
+    def follow_to_boundary(self, data):
+        """
+        Follow the characters of data a character at a time, stopping
+        before the first at which the chain is in Reset or Idle;
+        return the number of characters followed
+        """
+        tck = self.tck
+        last_char = self.last_char
+        state = self.tap_state
+        ones = self.tms_ones
+        clocks = 0
+        n = len(data)
+        for i in range(n):
+            if state in self.boundary_states:
+                n = i
+                break
+            c = data[i]
+            if (c&0xf8)==0x30:
+                if (c&4) and not tck:
+                    t = (c>>1)&1
+                    ones = (ones+1) if t else 0
+                    if state is not None:
+                        state = tap_next_state[state][t]
+                        pass
+                    elif ones>=5:
+                        state = TapState.test_logic_reset
+                        pass
+                    clocks += 1
+                    pass
+                tck = c&4
+                last_char = c
+                pass
+            pass
+        self.tck = tck
+        self.last_char = last_char
+        self.tap_state = state
+        self.tms_ones = ones
+        self.clocks += clocks
+        return n
+
+    #f restore
+    def restore(self, last_char, tap_state):
+        """
+        Return characters that return the chain to a client's TAP
+        state and pins (as it left them), without a rising edge of
+        TCK other than those to move the TAP state; a last_char of
+        None is a client that has not yet driven the chain
+        """
+        data = bytearray()
+        if last_char is None: return data
+        if (tap_state is not None) and (self.tap_state!=tap_state):
+            from_state = self.tap_state
+            if from_state is None: from_state = TapState.unknown
+            tms_values = tap_tms_path(from_state, tap_state)
+            for i in range(tms_values.length):
+                tms = tms_values.bit(i)<<1
+                data += bytes((0x30|tms, 0x34|tms))
+                pass
+            pass
+        tck = self.tck
+        if len(data)>0: tck = 4
+        data.append(last_char & (0xfb|tck))
+        return data
+    pass
+
+#c OpenocdClientStats
+class OpenocdClientStats:
+    """
+    Counters for one client of an OpenocdServer
+
+    The latency of a batch is the time from its receipt to its
+    dispatch to the target (the time waiting for the chain)
+    """
+    #f __init__
+    def __init__(self, number):
+        self.number = number
+        self.connect_time = time.time()
+        self.disconnect_time = None
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.batches = 0
+        self.dispatches = 0
+        self.slots = 0
+        self.total_latency = 0.
+        self.max_latency = 0.
+        pass
+
+    #f elapsed
+    def elapsed(self):
+        end = self.disconnect_time
+        if end is None: end = time.time()
+        return end - self.connect_time
+
+    #f dispatched
+    def dispatched(self, latency):
+        self.dispatches += 1
+        self.total_latency += latency
+        if latency>self.max_latency: self.max_latency=latency
+        pass
+
+    #f as_dict
+    def as_dict(self):
+        elapsed = self.elapsed()
+        if elapsed<=0: elapsed=1E-9
+        mean_latency = 0.
+        if self.dispatches>0: mean_latency = self.total_latency/self.dispatches
+        return {"number":self.number,
+                "elapsed":elapsed,
+                "connected":self.disconnect_time is None,
+                "batches":self.batches,
+                "dispatches":self.dispatches,
+                "slots":self.slots,
+                "bytes_received":self.bytes_received,
+                "bytes_sent":self.bytes_sent,
+                "mean_latency":mean_latency,
+                "max_latency":self.max_latency,
+                "rx_bytes_per_second":self.bytes_received/elapsed,
+                "tx_bytes_per_second":self.bytes_sent/elapsed,
+                }
+
+    #f __str__
+    def __str__(self):
+        d = self.as_dict()
+        return ("client %d: %d bytes received in %d batches, %d dispatches in %d slots, %d bytes sent, in %.3fs: %.0f rx bytes/s; latency mean %.6fs max %.6fs"%
+                (d["number"], d["bytes_received"], d["batches"], d["dispatches"], d["slots"], d["bytes_sent"], d["elapsed"],
+                 d["rx_bytes_per_second"], d["mean_latency"], d["max_latency"]))
+    pass
+
+#c OpenocdServerStats
+class OpenocdServerStats:
+    """
+    Counters for an OpenocdServer, with an OpenocdClientStats for each client
+    """
+    #f __init__
+    def __init__(self):
+        self.start_time = time.time()
+        self.connections = 0
+        self.batches = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.max_batch = 0
+        self.slots = 0
+        self.rx_queue_depth = 0
+        self.max_rx_queue_depth = 0
+        self.max_tx_queue_depth = 0
+        self.clients = []
+        pass
+
+    #f elapsed
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    #f as_dict
+    def as_dict(self):
+        elapsed = self.elapsed()
+        if elapsed<=0: elapsed=1E-9
+        return {"elapsed":elapsed,
+                "connections":self.connections,
+                "batches":self.batches,
+                "bytes_received":self.bytes_received,
+                "bytes_sent":self.bytes_sent,
+                "max_batch":self.max_batch,
+                "slots":self.slots,
+                "rx_queue_depth":self.rx_queue_depth,
+                "max_rx_queue_depth":self.max_rx_queue_depth,
+                "max_tx_queue_depth":self.max_tx_queue_depth,
+                "rx_bytes_per_second":self.bytes_received/elapsed,
+                "tx_bytes_per_second":self.bytes_sent/elapsed,
+                "clients":[c.as_dict() for c in self.clients],
+                }
+
+    #f __str__
+    def __str__(self):
+        d = self.as_dict()
+        return ("%d bytes received in %d batches (max %d), %d bytes sent, in %.3fs: %.0f rx bytes/s; %d clients in %d slots; max rx queue %d, max tx queue %d"%
+                (d["bytes_received"], d["batches"], d["max_batch"], d["bytes_sent"], d["elapsed"],
+                 d["rx_bytes_per_second"], d["connections"], d["slots"], d["max_rx_queue_depth"], d["max_tx_queue_depth"]))
+    pass
+
+#c RemoteBitbangProtocol
+class RemoteBitbangProtocol(asyncio.BufferedProtocol):
+    """
+    asyncio protocol for one connection to an OpenocdServer; data is
+    received directly in to a bytearray, and each batch is passed to
+    the server as a memoryview of it
+
+    Data received while another client has the chain is held in
+    pending until this client is scheduled; last_char and tap_state
+    are the pins and TAP state it left the chain in when it was last
+    descheduled.
+    """
+    #f __init__
+    def __init__(self, server):
+        self.server = server
+        self.rx_buffer = bytearray(server.buffer_size)
+        self.rx_view = memoryview(self.rx_buffer)
+        self.transport = None
+        self.stats = None
+        self.pending = bytearray()
+        self.pending_time = None
+        self.last_char = None
+        self.tap_state = None
+        pass
+
+    #f connection_made
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connection_made(self)
+        pass
+
+    #f get_buffer
+    def get_buffer(self, sizehint):
+        return self.rx_view
+
+    #f buffer_updated
+    def buffer_updated(self, nbytes):
+        self.server.received(self, self.rx_view[:nbytes])
+        pass
+
+    #f connection_lost
+    def connection_lost(self, exc):
+        self.server.connection_lost(self)
+        pass
+    pass
+
+#c OpenocdServer
+class OpenocdServer:
+    """
+    OpenOCD remote_bitbang server on a TCP port (port of 0 picks a
+    free port) or, if path is given, a Unix socket
+
+    The server accepts any number of clients, which share the one
+    target (and JTAG chain) in scheduling slots. The client with the
+    slot has its data passed on as it arrives; data from the others
+    is held (as one batch per client) until they are scheduled.
+
+    The TAP state of the chain is followed through the data, and the
+    slot moves on (round robin to the next client with data) only at
+    a JTAG transaction boundary, with the TAP in Reset or Idle, when
+    another client is waiting and either:
+
+      * the client with the slot has had it for slot_time seconds, or
+
+      * it has had no data to send for hold_time seconds
+
+    If the client with the slot has no data to send for stall_timeout
+    seconds while another client is waiting then it loses the slot
+    whatever the TAP state, so that a stalled client does not block
+    the others for long; its transaction is then likely to be
+    corrupted by the other clients.
+
+    When a client is scheduled again the chain is first returned to
+    the TAP state it left it in (with the shortest TMS path), and its
+    TCK, TMS and TDI restored. The registers of the chain (the IR in
+    particular) may have been changed by other clients in between, so
+    each transaction should set up the IR it requires; an IR scan
+    that ends in Update-IR (rather than Idle) followed by a DR scan
+    is a single transaction.
+
+    Per-client counters (including the latency of data waiting for
+    a slot) are kept in the OpenocdClientStats of each client.
+    """
+    buffer_size = 65536
+    #f __init__
+    def __init__(self, target=None, host="127.0.0.1", port=0, path=None, slot_time=0.01, hold_time=0.002, stall_timeout=1.0):
+        self.target = target
+        self.host = host
+        self.port = port
+        self.path = path
+        self.slot_time = slot_time
+        self.hold_time = hold_time
+        self.stall_timeout = stall_timeout
+        self.stats = OpenocdServerStats()
+        self.tracker = BitbangTapTracker()
+        self.rx_queue = queue.Queue()
+        self.rx_lock = threading.Lock()
+        self.rx_next = None
+        self.rx_connection = None
+        self.clients = []
+        self.owner = None
+        self.last_owner = None
+        self.slot_start = 0.
+        self.last_dispatch = 0.
+        self.timer = None
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.started = threading.Event()
+        pass
+
+    #f start
+    def start(self):
+        """
+        Start the server's event loop in a background thread; return when it is listening
+        """
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        return self
+
+    #f run_loop
+    def run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.start_server())
+        self.started.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.close_clients())
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        pass
+
+    #f start_server
+    async def start_server(self):
+        """
+        Start listening, in the current event loop
+        """
+        factory = lambda: RemoteBitbangProtocol(self)
+        if self.path is not None:
+            self.server = await asyncio.get_event_loop().create_unix_server(factory, path=self.path)
+            pass
+        else:
+            self.server = await asyncio.get_event_loop().create_server(factory, host=self.host, port=self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+            pass
+        pass
+
+    #f close_clients
+    async def close_clients(self):
+        """
+        Close the connections of all the clients, and wait for them to
+        be lost; those whose data is not all written within the stall
+        timeout are aborted
+        """
+        for connection in list(self.clients): connection.transport.close()
+        deadline = time.time() + self.stall_timeout
+        while len(self.clients)>0:
+            if time.time()>deadline:
+                for connection in list(self.clients): connection.transport.abort()
+                pass
+            await asyncio.sleep(0.001)
+            pass
+        pass
+
+    #f stop
+    def stop(self):
+        """
+        Stop the server thread, closing the connections of any clients
+        (whose pending reads then fail)
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+            pass
+        pass
+
+    #f connection_made
+    def connection_made(self, connection):
+        self.stats.connections += 1
+        connection.stats = OpenocdClientStats(self.stats.connections)
+        self.stats.clients.append(connection.stats)
+        self.clients.append(connection)
+        pass
+
+    #f connection_lost
+    def connection_lost(self, connection):
+        if connection not in self.clients: return
+        connection.stats.disconnect_time = time.time()
+        if self.owner is connection: self.release()
+        self.clients.remove(connection)
+        if self.last_owner is connection: self.last_owner = None
+        if len(self.clients)==0:
+            if self.target is not None: self.target.quit()
+            self.rx_queue.put(None)
+            pass
+        self.schedule()
+        pass
+
+    #f received
+    def received(self, connection, data):
+        """
+        Handle a batch of data (a memoryview of the connection's receive buffer)
+        """
+        n = len(data)
+        quit = False
+        q = data.tobytes().find(b"Q") if (b"Q"[0] in data) else -1
+        if q>=0:
+            data = data[:q]
+            quit = True
+            pass
+        self.stats.batches += 1
+        self.stats.bytes_received += n
+        if n>self.stats.max_batch: self.stats.max_batch=n
+        connection.stats.batches += 1
+        connection.stats.bytes_received += n
+        if len(data)>0:
+            if (self.owner is connection) and (len(connection.pending)==0) and not self.slot_ending():
+                self.dispatch(connection, data, 0.)
+                pass
+            else:
+                if len(connection.pending)==0: connection.pending_time = time.time()
+                connection.pending += data
+                self.schedule()
+                pass
+            pass
+        if quit: connection.transport.close()
+        pass
+
+    #f waiting
+    def waiting(self):
+        """
+        Return True if a client other than the owner of the slot has data waiting
+        """
+        for c in self.clients:
+            if (c is not self.owner) and (len(c.pending)>0): return True
+            pass
+        return False
+
+    #f slot_ending
+    def slot_ending(self):
+        """
+        Return True if the slot should end at the next transaction boundary
+        """
+        return ((time.time()-self.slot_start)>=self.slot_time) and self.waiting()
+
+    #f grant
+    def grant(self, connection):
+        """
+        Give the slot to a client, restoring the chain to the state it left it in
+        """
+        self.owner = connection
+        self.last_owner = connection
+        self.slot_start = time.time()
+        self.last_dispatch = self.slot_start
+        self.stats.slots += 1
+        connection.stats.slots += 1
+        restore = self.tracker.restore(connection.last_char, connection.tap_state)
+        if len(restore)>0: connection.pending[0:0] = restore
+        pass
+
+    #f release
+    def release(self):
+        """
+        End the slot of the current owner, recording the state it leaves the chain in
+        """
+        connection = self.owner
+        connection.last_char = self.tracker.last_char
+        connection.tap_state = self.tracker.tap_state
+        self.owner = None
+        pass
+
+    #f next_client
+    def next_client(self):
+        """
+        Return the next client with data waiting (round robin), or None
+        """
+        n = len(self.clients)
+        start = 0
+        if self.last_owner in self.clients: start = self.clients.index(self.last_owner)+1
+        for i in range(n):
+            c = self.clients[(start+i)%n]
+            if len(c.pending)>0: return c
+            pass
+        return None
+
+    #f schedule
+    def schedule(self):
+        """
+        Dispatch the data of the owner of the slot, moving the slot
+        to another client at a transaction boundary if required
+        (in the event loop)
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+            pass
+        while True:
+            if self.owner is None:
+                connection = self.next_client()
+                if connection is None: return
+                self.grant(connection)
+                pass
+            owner = self.owner
+            if len(owner.pending)>0:
+                data = owner.pending
+                (owner.pending, owner.pending_time, pending_time) = (bytearray(), None, owner.pending_time)
+                if self.slot_ending():
+                    n = self.tracker.follow(data, stop_at_boundary=True)
+                    if n<len(data):
+                        owner.pending = data[n:]
+                        owner.pending_time = pending_time
+                        pass
+                    if n>0: self.dispatch(owner, data[:n], time.time()-pending_time, followed=True)
+                    pass
+                else:
+                    self.dispatch(owner, data, time.time()-pending_time)
+                    pass
+                if len(owner.pending)>0:
+                    self.release()
+                    continue
+                pass
+            if not self.waiting(): return
+            now = time.time()
+            idle = now - self.last_dispatch
+            if idle>=self.stall_timeout:
+                self.release()
+                continue
+            if self.tracker.at_boundary():
+                if (idle>=self.hold_time) or ((now-self.slot_start)>=self.slot_time):
+                    self.release()
+                    continue
+                delay = min(self.hold_time-idle, self.slot_time-(now-self.slot_start))
+                pass
+            else:
+                delay = self.stall_timeout-idle
+                pass
+            self.timer = self.loop.call_later(delay, self.schedule)
+            return
+        pass
+
+    #f dispatch
+    def dispatch(self, connection, data, latency, followed=False):
+        """
+        Pass a batch of data from the owner of the slot to the target, or queue it for receive()
+        """
+        if not followed: self.tracker.follow(data)
+        self.last_dispatch = time.time()
+        connection.stats.dispatched(latency)
+        if self.target is not None:
+            response = self.target.bitbang(data)
+            if len(response)>0: self.write(connection, response)
+            return
+        with self.rx_lock:
+            self.stats.rx_queue_depth += len(data)
+            if self.stats.rx_queue_depth>self.stats.max_rx_queue_depth:
+                self.stats.max_rx_queue_depth = self.stats.rx_queue_depth
+                pass
+            pass
+        self.rx_queue.put((connection, bytes(data)))
+        pass
+
+    #f write
+    def write(self, connection, data):
+        """
+        Write data to a connection (in the event loop)
+        """
+        if connection.transport is None or connection.transport.is_closing(): return
+        connection.transport.write(data)
+        self.stats.bytes_sent += len(data)
+        connection.stats.bytes_sent += len(data)
+        depth = connection.transport.get_write_buffer_size()
+        if depth>self.stats.max_tx_queue_depth: self.stats.max_tx_queue_depth=depth
+        pass
+
+    #f receive
+    def receive(self, timeout=None):
+        """
+        Wait for data (from another thread), and return all the data
+        received so far from one client as a single bytearray; return
+        None if all the clients have disconnected, or an empty
+        bytearray on timeout. A response to the data should then be
+        given with send().
+        """
+        data = bytearray()
+        batch = self.rx_next
+        self.rx_next = None
+        if batch is None:
+            try:
+                batch = self.rx_queue.get(timeout=timeout)
+                pass
+            except queue.Empty:
+                return data
+            pass
+        if batch is None: return None
+        (connection, batch_data) = batch
+        self.rx_connection = connection
+        while True:
+            data += batch_data
+            try:
+                batch = self.rx_queue.get_nowait()
+                pass
+            except queue.Empty:
+                break
+            if batch is None:
+                self.rx_queue.put(None)
+                break
+            if batch[0] is not connection:
+                self.rx_next = batch
+                break
+            batch_data = batch[1]
+            pass
+        with self.rx_lock:
+            self.stats.rx_queue_depth -= len(data)
+            pass
+        return data
+
+    #f send
+    def send(self, data):
+        """
+        Send data (from another thread) to the client whose data was last returned by receive()
+        """
+        connection = self.rx_connection
+        if connection is None or len(data)==0: return
+        self.loop.call_soon_threadsafe(self.write, connection, bytes(data))
+        pass
+
+    #f serve
+    def serve(self, target, timeout=None):
+        """
+        Serve clients from the current thread using target, until they have all quit
+        """
+        while True:
+            data = self.receive(timeout=timeout)
+            if data is None: break
+            if len(data)>0: self.send(target.bitbang(data))
+            pass
+        target.quit()
+        pass
+    pass
+
+#a Benchmark
+#f benchmark_scan
+def benchmark_scan(chunk_bits):
+    """
+    Return the characters of a DR scan from Idle back to Idle of
+    chunk_bits bits, as OpenOCD would send it ('0'/'1' with TCK low,
+    'R', '4'/'5' with TCK high per bit)
+    """
+    chars = bytearray()
+    for tms in (1,0,0): # to Shift-DR
+        chars += bytes([0x30+2*tms, 0x34+2*tms])
+        pass
+    for i in range(chunk_bits):
+        tdi = (i*7>>2)&1
+        tms = 2*(i==chunk_bits-1)
+        chars += bytes([0x30+tms+tdi, 0x52, 0x34+tms+tdi])
+        pass
+    for tms in (1,0): # to Idle
+        chars += bytes([0x30+2*tms, 0x34+2*tms])
+        pass
+    return bytes(chars)
+
+#f benchmark
+def benchmark(num_bits=1<<20, chunk_bits=4096, num_clients=1):
+    """
+    Benchmark the server with a loopback target and num_clients
+    stand-in clients (each in its own thread), each resetting the
+    chain and then shifting num_bits bits through it in DR scans of
+    chunk_bits; return the server statistics
+    """
+    server = OpenocdServer(target=BitbangLoopbackTarget()).start()
+    scan = benchmark_scan(chunk_bits)
+    def run_client():
+        client = RemoteBitbangClient(port=server.port)
+        client.transfer(b"2626262626" + b"0404") # Reset, then Idle
+        for i in range(num_bits//chunk_bits):
+            client.transfer(scan)
+            pass
+        client.close()
+        pass
+    threads = [threading.Thread(target=run_client) for i in range(num_clients)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    stats = server.stats
+    server.stop()
+    return stats
+
+#a Toplevel
+if __name__ == "__main__":
+    for num_clients in (1, 2, 4):
+        stats = benchmark(num_clients=num_clients)
+        print(stats)
+        for client_stats in stats.clients: print("  %s"%str(client_stats))
+        pass
+    pass
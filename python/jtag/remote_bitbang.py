@@ -0,0 +1,76 @@
+#a Copyright
+#
+#  This file 'remote_bitbang.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+A minimal blocking client of the OpenOCD remote_bitbang protocol (see
+openocd_server.py for the protocol), as used by a
+JtagModuleRemoteBitbang and by the server benchmark as a stand-in for
+OpenOCD.
+
+This uses only blocking sockets, so that a JtagModuleRemoteBitbang
+does not require asyncio or the server itself.
+"""
+
+#a Imports
+import socket
+
+#a Classes
+#c RemoteBitbangClient
+class RemoteBitbangClient:
+    """
+    A minimal blocking remote_bitbang client, as a stand-in for OpenOCD
+    """
+    #f __init__
+    def __init__(self, host="127.0.0.1", port=None, path=None):
+        if path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(path)
+            pass
+        else:
+            self.socket = socket.create_connection((host, port))
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            pass
+        pass
+
+    #f transfer
+    def transfer(self, data):
+        """
+        Send data and return the response (one byte for each 'R' in data)
+
+        Raises ConnectionError if the server closes the connection
+        before the whole response is received.
+        """
+        n = data.count(b"R")
+        self.socket.sendall(data)
+        response = bytearray(n)
+        view = memoryview(response)
+        got = 0
+        while got<n:
+            r = self.socket.recv_into(view[got:], n-got)
+            if r==0:
+                raise ConnectionError("remote_bitbang server closed the connection with %d of %d response bytes received"%(got, n))
+            got += r
+            pass
+        return response
+
+    #f close
+    def close(self):
+        self.socket.sendall(b"Q")
+        self.socket.close()
+        pass
+    pass
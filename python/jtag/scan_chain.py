@@ -0,0 +1,402 @@
+#a Copyright
+#
+#  This file 'scan_chain.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+A model of a JTAG scan chain with more than one TAP.
+
+Devices are numbered from the TDO end of the chain; device 0 is the
+device whose IDCODE is shifted out first (the first IDCODE returned
+by jtag_read_idcodes), and it receives the first of the bits shifted in.
+
+Hence, when device 'n' is addressed, the bits of a scan are (first
+shifted first):
+
+  IR: the IRs of devices 0..n-1, the IR of device n, the IRs of devices n+1..
+
+  DR: one BYPASS bit for each of devices 0..n-1, the DR of device n,
+      one BYPASS bit for each of devices n+1..
+
+and the same positions hold in the data shifted out.
+
+All the devices not addressed are given the BYPASS instruction (all
+ones, unless a device is described otherwise) when the IR is
+written; hence DR scans require the IR of the chain to have been
+written for the addressed device. The padding for each device is
+computed once and cached.
+
+ScanChain.discover() finds the devices in a single pass: after a
+reset every device has IDCODE (or BYPASS, if it has no IDCODE)
+selected, so shifting ones through the DR produces, for each device,
+either a 32-bit IDCODE (with a bottom bit of 1) or a single 0 bit,
+followed by 32 ones once the whole chain has been passed. The DR is
+shifted in chunks (in one visit to shift-dr) until that end is seen.
+The total IR length is then measured with one IR scan of zeros
+followed by ones (which leaves every device in BYPASS); the IR
+lengths of the devices are taken from those given (by IDCODE or
+position), with at most one unknown device taking the rest.
+
+The IDCODEs (None for a device with no IDCODE) are the signature of
+the chain, and the IR lengths found are cached against it in a
+ScanChainCache (by default, scan_chain_cache), so connecting to the
+same chain again needs only the DR pass. The cache can be saved to and
+loaded from a JSON file.
+"""
+
+#a Imports
+import json
+from .bits import BitVector
+from .tap_state import TapState
+
+#a Exceptions
+#c ScanChainError
+class ScanChainError(Exception):
+    pass
+
+#a Classes
+#c ScanChainDevice
+class ScanChainDevice:
+    """
+    A device (TAP) on a scan chain, with its IR length and (optional) IDCODE
+    """
+    #f __init__
+    def __init__(self, ir_length, idcode=None, bypass=None, name=None):
+        self.ir_length = ir_length
+        self.idcode = idcode
+        self.bypass = bypass
+        if bypass is None: self.bypass = (1<<ir_length)-1
+        self.name = name
+        if name is None:
+            self.name = "tap"
+            if idcode is not None: self.name = "tap_%08x"%idcode
+            pass
+        pass
+
+    #f __repr__
+    def __repr__(self):
+        return "ScanChainDevice(%s, ir_length=%d)"%(self.name, self.ir_length)
+    pass
+
+#c ScanChainPadding
+class ScanChainPadding:
+    """
+    The padding required to address one device on a scan chain
+    """
+    #f __init__
+    def __init__(self, devices, index):
+        self.ir_pre_length  = 0
+        self.ir_pre_value   = 0
+        self.ir_post_length = 0
+        self.ir_post_value  = 0
+        for d in devices[:index]:
+            self.ir_pre_value |= d.bypass << self.ir_pre_length
+            self.ir_pre_length += d.ir_length
+            pass
+        for d in devices[index+1:]:
+            self.ir_post_value |= d.bypass << self.ir_post_length
+            self.ir_post_length += d.ir_length
+            pass
+        self.dr_pre_length  = index
+        self.dr_post_length = len(devices)-index-1
+        pass
+
+    #f pad_ir
+    def pad_ir(self, ir_bits):
+        """
+        Return a BitVector for the whole chain's IR, given the BitVector ir_bits for the device
+        """
+        return BitVector(self.ir_pre_length + ir_bits.length + self.ir_post_length,
+                         self.ir_pre_value |
+                         (ir_bits.value << self.ir_pre_length) |
+                         (self.ir_post_value << (self.ir_pre_length+ir_bits.length)) )
+
+    #f pad_dr
+    def pad_dr(self, dr_bits):
+        """
+        Return a BitVector for the whole chain's DR (with devices in BYPASS), given the BitVector dr_bits for the device
+        """
+        return BitVector(self.dr_pre_length + dr_bits.length + self.dr_post_length,
+                         dr_bits.value << self.dr_pre_length)
+    pass
+
+#c ScanChainCache
+class ScanChainCache:
+    """
+    A cache of the IR lengths of scan chains, keyed by the signature
+    of the chain (a tuple of the IDCODEs of the devices, with None for
+    devices with no IDCODE)
+    """
+    #f __init__
+    def __init__(self):
+        self.ir_lengths = {}
+        self.hits = 0
+        self.misses = 0
+        pass
+
+    #f signature_key - staticmethod
+    @staticmethod
+    def signature_key(signature):
+        """
+        Return a string for a signature, for example 'abcde6e3,-'
+        """
+        return ",".join([("-" if idcode is None else "%08x"%idcode) for idcode in signature])
+
+    #f lookup
+    def lookup(self, signature):
+        """
+        Return the list of IR lengths of a chain with the signature, or None if not cached
+        """
+        ir_lengths = self.ir_lengths.get(self.signature_key(signature))
+        if ir_lengths is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return ir_lengths
+
+    #f add
+    def add(self, signature, ir_lengths):
+        self.ir_lengths[self.signature_key(signature)] = list(ir_lengths)
+        pass
+
+    #f save
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.ir_lengths, f, indent=1)
+            pass
+        pass
+
+    #f load
+    def load(self, path):
+        """
+        Add the chains from a JSON file written by save()
+        """
+        with open(path) as f:
+            self.ir_lengths.update(json.load(f))
+            pass
+        pass
+    pass
+
+scan_chain_cache = ScanChainCache()
+
+#c ScanChain
+class ScanChain:
+    """
+    A scan chain of devices driven by a JtagModule* object
+    """
+    #f __init__
+    def __init__(self, jtag_module, devices):
+        self.jtag_module = jtag_module
+        self.devices = list(devices)
+        self.padding_cache = {}
+        pass
+
+    #f of_idcodes - classmethod
+    @classmethod
+    def of_idcodes(cls, jtag_module, idcodes, ir_lengths):
+        """
+        Create a ScanChain from a list of IDCODEs (as returned by
+        jtag_read_idcodes); ir_lengths is either a list of IR lengths
+        (one per device) or a dictionary mapping IDCODE to IR length
+        """
+        devices = []
+        for i in range(len(idcodes)):
+            if isinstance(ir_lengths, dict):
+                ir_length = ir_lengths[idcodes[i]]
+                pass
+            else:
+                ir_length = ir_lengths[i]
+                pass
+            devices.append(ScanChainDevice(ir_length=ir_length, idcode=idcodes[i]))
+            pass
+        return cls(jtag_module, devices)
+
+    #f read_signature - staticmethod
+    @staticmethod
+    def read_signature(jtag_module, max_devices=32, chunk=64):
+        """
+        Reset the chain and shift ones through the DR (chunk bits at a
+        time) until the end of the chain is seen; return the
+        signature of the chain, a list of the IDCODEs of the devices
+        (None for a device in BYPASS), and leave the TAP in idle
+        """
+        jtag_module.jtag_reset()
+        jtag_module.jtag_goto(TapState.shift_dr)
+        signature = []
+        tdo = 0
+        num_bits = 0
+        pos = 0
+        while True:
+            while pos<num_bits:
+                if ((tdo>>pos)&1)==0:
+                    signature.append(None)
+                    pos += 1
+                    continue
+                if pos+32>num_bits: break
+                idcode = (tdo>>pos) & 0xffffffff
+                if idcode==0xffffffff:
+                    jtag_module.jtag_goto(TapState.idle)
+                    return signature
+                signature.append(idcode)
+                pos += 32
+                pass
+            if len(signature)>max_devices:
+                raise ScanChainError("More than %d devices found on the scan chain"%max_devices)
+            data = jtag_module.jtag_shift_vector(BitVector(chunk, (1<<chunk)-1), last_tms=0)
+            tdo |= data.value << num_bits
+            num_bits += chunk
+            pass
+        pass
+
+    #f measure_ir_length - staticmethod
+    @staticmethod
+    def measure_ir_length(jtag_module, max_ir_length):
+        """
+        Measure the total IR length of the chain (which must be less
+        than max_ir_length), by scanning max_ir_length zeros followed
+        by max_ir_length ones through the IR; the ones start to come
+        out after the total IR length plus max_ir_length bits. This
+        leaves all the devices in BYPASS.
+
+        If no ones come out (with a total IR length from max_ir_length
+        to twice that every bit after the captured IRs is a zero) or
+        if the last zero is too early, a ScanChainError is raised.
+        """
+        n = max_ir_length
+        tdo = jtag_module.jtag_write_irs(BitVector(2*n, ((1<<n)-1)<<n)).value
+        last_zero = ((~tdo) & ((1<<(2*n))-1)).bit_length()
+        if (last_zero<=n) or (last_zero>=2*n):
+            raise ScanChainError("Could not measure the IR length of the scan chain (broken chain or IR length of %d or more?)"%max_ir_length)
+        return last_zero - n
+
+    #f discover - classmethod
+    @classmethod
+    def discover(cls, jtag_module, ir_lengths=None, cache=scan_chain_cache, max_devices=32, max_device_ir_length=32):
+        """
+        Create a ScanChain by reading the signature of the chain in a
+        single pass, and finding the IR lengths of its devices - from
+        the cache, if the chain has been seen before, or else by
+        measuring the total IR length.
+
+        ir_lengths is None, a list of IR lengths (one per device, or
+        None for unknown), or a dictionary mapping IDCODE to IR
+        length; at most one device may have an unknown IR length.
+        """
+        signature = cls.read_signature(jtag_module, max_devices)
+        if signature==[]:
+            raise ScanChainError("No devices found on the scan chain")
+        device_ir_lengths = None
+        if cache is not None: device_ir_lengths = cache.lookup(signature)
+        if device_ir_lengths is None:
+            device_ir_lengths = [None] * len(signature)
+            for i in range(len(signature)):
+                if isinstance(ir_lengths, dict):
+                    device_ir_lengths[i] = ir_lengths.get(signature[i])
+                    pass
+                elif ir_lengths is not None:
+                    device_ir_lengths[i] = ir_lengths[i]
+                    pass
+                pass
+            total = cls.measure_ir_length(jtag_module, max_device_ir_length*max(1,len(signature)))
+            unknown = [i for i in range(len(signature)) if device_ir_lengths[i] is None]
+            remainder = total - sum([l for l in device_ir_lengths if l is not None])
+            if len(unknown)>1:
+                raise ScanChainError("Cannot determine the IR lengths of %d devices from a total IR length of %d"%(len(unknown), total))
+            if len(unknown)==1:
+                device_ir_lengths[unknown[0]] = remainder
+                remainder = 0
+                pass
+            if (remainder!=0) or (min(device_ir_lengths+[1])<1):
+                raise ScanChainError("IR lengths %s do not match the measured total IR length of %d"%(str(device_ir_lengths), total))
+            if cache is not None: cache.add(signature, device_ir_lengths)
+            pass
+        devices = []
+        for i in range(len(signature)):
+            devices.append(ScanChainDevice(ir_length=device_ir_lengths[i], idcode=signature[i]))
+            pass
+        return cls(jtag_module, devices)
+
+    #f padding
+    def padding(self, index):
+        """
+        Get the (cached) ScanChainPadding for device 'index'
+        """
+        if index not in self.padding_cache:
+            self.padding_cache[index] = ScanChainPadding(self.devices, index)
+            pass
+        return self.padding_cache[index]
+
+    #f ir_length
+    def ir_length(self):
+        """
+        Return the total length of the IRs of the chain
+        """
+        return sum([d.ir_length for d in self.devices])
+
+    #f write_irs
+    def write_irs(self, index, ir_bits, end_state=None, capture=True):
+        """
+        Write the IR of device 'index' with ir_bits, putting all the other devices in BYPASS
+
+        Return the data shifted out of the device's IR (None if capture is False)
+        """
+        ir_bits = BitVector.of(ir_bits)
+        padding = self.padding(index)
+        data = self.jtag_module.jtag_write_irs(padding.pad_ir(ir_bits), end_state=end_state, capture=capture)
+        if data is None: return None
+        return data.slice(padding.ir_pre_length, ir_bits.length)
+
+    #f write_drs
+    def write_drs(self, index, dr_bits, end_state=None, capture=True):
+        """
+        Scan dr_bits in to the DR of device 'index', with all the other devices in BYPASS
+
+        Return the data shifted out of the device's DR (None if capture is False)
+        """
+        dr_bits = BitVector.of(dr_bits)
+        padding = self.padding(index)
+        data = self.jtag_module.jtag_write_drs(padding.pad_dr(dr_bits), end_state=end_state, capture=capture)
+        if data is None: return None
+        return data.slice(padding.dr_pre_length, dr_bits.length)
+
+    #f tap
+    def tap(self, index):
+        """
+        Return a ScanChainTap to address device 'index' as if it were the only device
+        """
+        return ScanChainTap(self, index)
+    pass
+
+#c ScanChainTap
+class ScanChainTap:
+    """
+    A single device on a ScanChain, with jtag_write_irs and jtag_write_drs methods as for a JtagModule*
+    """
+    #f __init__
+    def __init__(self, chain, index):
+        self.chain = chain
+        self.index = index
+        self.device = chain.devices[index]
+        pass
+
+    #f jtag_write_irs
+    def jtag_write_irs(self, ir_bits, end_state=None, capture=True):
+        return self.chain.write_irs(self.index, ir_bits, end_state=end_state, capture=capture)
+
+    #f jtag_write_drs
+    def jtag_write_drs(self, dr_bits, end_state=None, capture=True):
+        return self.chain.write_drs(self.index, dr_bits, end_state=end_state, capture=capture)
+    pass
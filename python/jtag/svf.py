@@ -0,0 +1,396 @@
+#a Copyright
+#
+#  This file 'svf.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+Playing of SVF (serial vector format) files through a JtagModule*.
+
+The file is read a line at a time and split in to statements by
+svf_statements(), a generator, so only one statement (which may be
+spread over many lines) is held in memory at once.
+
+The statements supported are:
+
+  SIR, SDR       : scans, performed with jtag_write_irs and
+                   jtag_write_drs (ending in the ENDIR/ENDDR state)
+  HIR, HDR,
+  TIR, TDR       : header and trailer bits for the scans (the header is
+                   shifted in first, as the bottom bits of the scan)
+  ENDIR, ENDDR   : the end state of subsequent scans
+  RUNTEST        : clocks in the run state, then a move to the end state
+  STATE          : moves through a path of states (with jtag_goto;
+                   RESET uses jtag_reset)
+  FREQUENCY      : the TCK frequency for RUNTEST times
+  TRST           : ignored (there is no TRST)
+
+The TDI, MASK and SMASK of a scan are kept for the next scan of the
+same kind if its length is unchanged; TDO is only checked if given.
+The check is a single integer comparison of (TDO ^ expected) & MASK
+over the whole scan (header, data and trailer); a scan with no TDO
+to check is performed without capturing its TDO.
+
+Consecutive RUNTEST clocks in the same run state (normally IDLE)
+are accumulated and performed as a single run_test_idle (or
+jtag_tms, for other run states) when the next statement that clocks
+the JTAG is reached (or at the end of the file). RUNTEST times are converted to clocks with the FREQUENCY (or
+tck_frequency if there has been no FREQUENCY); SCK counts are
+treated as TCKs.
+
+A mismatch raises an SvfError if stop_on_mismatch is set (the
+default); otherwise it is recorded in the player's mismatches and
+the file continues.
+
+For example:
+
+  player = SvfPlayer(self.jtag_module)
+  player.play_file("flash.svf")
+"""
+
+#a Imports
+import math
+from .bits import BitVector
+from .tap_state import TapState
+
+#a Exceptions
+#c SvfError
+class SvfError(Exception):
+    pass
+
+#a Constants
+svf_states = {"RESET":     TapState.test_logic_reset,
+              "IDLE":      TapState.idle,
+              "DRSELECT":  TapState.select_dr_scan,
+              "DRCAPTURE": TapState.capture_dr,
+              "DRSHIFT":   TapState.shift_dr,
+              "DREXIT1":   TapState.exit1_dr,
+              "DRPAUSE":   TapState.pause_dr,
+              "DREXIT2":   TapState.exit2_dr,
+              "DRUPDATE":  TapState.update_dr,
+              "IRSELECT":  TapState.select_ir_scan,
+              "IRCAPTURE": TapState.capture_ir,
+              "IRSHIFT":   TapState.shift_ir,
+              "IREXIT1":   TapState.exit1_ir,
+              "IRPAUSE":   TapState.pause_ir,
+              "IREXIT2":   TapState.exit2_ir,
+              "IRUPDATE":  TapState.update_ir,
+              }
+svf_stable_states = (TapState.test_logic_reset, TapState.idle, TapState.pause_dr, TapState.pause_ir)
+
+#a Parsing
+#f svf_statements
+def svf_statements(lines):
+    """
+    Generate the statements of an SVF file from an iterable of lines
+    (such as a file), as lists of upper-case tokens with brackets as
+    separate tokens; comments (from '!' or '//') are removed
+    """
+    pieces = []
+    for line in lines:
+        for comment in ("!", "//"):
+            i = line.find(comment)
+            if i>=0: line = line[:i]
+            pass
+        while True:
+            i = line.find(";")
+            if i<0:
+                pieces.append(line)
+                break
+            pieces.append(line[:i])
+            statement = " ".join(pieces).upper().replace("(", " ( ").replace(")", " ) ").split()
+            if statement!=[]: yield statement
+            pieces = []
+            line = line[i+1:]
+            pass
+        pass
+    if " ".join(pieces).strip()!="":
+        raise SvfError("SVF file ends without a ';'")
+    pass
+
+#f svf_state
+def svf_state(name, stable=False):
+    """
+    Return the TapState of an SVF state name
+    """
+    if name not in svf_states:
+        raise SvfError("Unknown SVF state '%s'"%name)
+    state = svf_states[name]
+    if stable and (state not in svf_stable_states):
+        raise SvfError("SVF state '%s' is not a stable state"%name)
+    return state
+
+#a Classes
+#c SvfScan
+class SvfScan:
+    """
+    The parameters of one kind of scan (SIR, SDR, HIR, HDR, TIR or TDR)
+    """
+    #f __init__
+    def __init__(self):
+        self.length = 0
+        self.tdi = 0
+        self.tdo = None
+        self.mask = 0
+        self.smask = 0
+        pass
+
+    #f update
+    def update(self, tokens):
+        """
+        Update from the tokens of a scan statement: length [TDI (hex)] [TDO (hex)] [MASK (hex)] [SMASK (hex)]
+        """
+        length = int(tokens[1])
+        fields = {}
+        i = 2
+        while i<len(tokens):
+            if (i+1>=len(tokens)) or (tokens[i+1]!="(") or (")" not in tokens[i+2:]):
+                raise SvfError("Bad parameters in %s statement"%tokens[0])
+            j = tokens.index(")", i+2)
+            fields[tokens[i]] = int("".join(tokens[i+2:j]) or "0", 16)
+            i = j+1
+            pass
+        all_ones = (1<<length)-1
+        if length!=self.length:
+            self.tdi = 0
+            self.mask = all_ones
+            self.smask = all_ones
+            pass
+        self.length = length
+        self.tdi   = fields.get("TDI",   self.tdi)
+        self.mask  = fields.get("MASK",  self.mask)
+        self.smask = fields.get("SMASK", self.smask)
+        self.tdo   = fields.get("TDO")
+        pass
+    pass
+
+#c SvfMismatch
+class SvfMismatch:
+    """
+    A TDO mismatch in a scan statement (of the whole scan, including header and trailer)
+    """
+    #f __init__
+    def __init__(self, statement, command, length, tdo, expected, mask):
+        self.statement = statement
+        self.command = command
+        self.length = length
+        self.tdo = tdo
+        self.expected = expected
+        self.mask = mask
+        pass
+
+    #f __str__
+    def __str__(self):
+        return "SVF statement %d (%s) TDO mismatch: got %x expected %x mask %x"%(self.statement, self.command, self.tdo, self.expected, self.mask)
+    pass
+
+#c SvfPlayer
+class SvfPlayer:
+    """
+    Player of SVF statements through a JtagModule*
+    """
+    #f __init__
+    def __init__(self, jtag_module, tck_frequency=1.0e6, stop_on_mismatch=True):
+        self.jtag_module = jtag_module
+        self.tck_frequency = tck_frequency
+        self.stop_on_mismatch = stop_on_mismatch
+        self.frequency = None
+        self.scans = {}
+        for kind in ("SIR", "SDR", "HIR", "HDR", "TIR", "TDR"):
+            self.scans[kind] = SvfScan()
+            pass
+        self.end_ir = TapState.idle
+        self.end_dr = TapState.idle
+        self.run_state = TapState.idle
+        self.run_end_state = TapState.idle
+        self.pending_state = None
+        self.pending_clocks = 0
+        self.num_statements = 0
+        self.mismatches = []
+        pass
+
+    #f play_file
+    def play_file(self, path):
+        """
+        Play an SVF file, returning the list of SvfMismatch
+        """
+        with open(path) as f:
+            return self.play(f)
+        pass
+
+    #f play
+    def play(self, lines):
+        """
+        Play SVF from an iterable of lines, returning the list of SvfMismatch
+        """
+        for statement in svf_statements(lines):
+            self.execute(statement)
+            pass
+        self.flush_clocks()
+        return self.mismatches
+
+    #f flush_clocks
+    def flush_clocks(self):
+        """
+        Perform the accumulated RUNTEST clocks
+        """
+        n = self.pending_clocks
+        if n==0: return
+        if self.pending_state==TapState.idle:
+            self.jtag_module.run_test_idle(n)
+            pass
+        else:
+            tms = 0
+            if self.pending_state==TapState.test_logic_reset: tms = (1<<n)-1
+            self.jtag_module.jtag_tms(BitVector(n, tms))
+            pass
+        self.pending_clocks = 0
+        pass
+
+    #f goto
+    def goto(self, state):
+        if state==TapState.test_logic_reset:
+            self.jtag_module.jtag_reset()
+            pass
+        elif self.jtag_module.tap_state!=state:
+            self.jtag_module.jtag_goto(state)
+            pass
+        pass
+
+    #f execute
+    def execute(self, tokens):
+        """
+        Execute a single statement given as a list of tokens
+        """
+        self.num_statements += 1
+        command = tokens[0]
+        if command in ("HIR", "HDR", "TIR", "TDR"):
+            self.scans[command].update(tokens)
+            pass
+        elif command=="SIR":
+            self.scan(command, tokens, self.scans["HIR"], self.scans["TIR"], self.jtag_module.jtag_write_irs, self.end_ir)
+            pass
+        elif command=="SDR":
+            self.scan(command, tokens, self.scans["HDR"], self.scans["TDR"], self.jtag_module.jtag_write_drs, self.end_dr)
+            pass
+        elif command=="ENDIR":
+            self.end_ir = svf_state(tokens[1], stable=True)
+            pass
+        elif command=="ENDDR":
+            self.end_dr = svf_state(tokens[1], stable=True)
+            pass
+        elif command=="RUNTEST":
+            self.run_test(tokens)
+            pass
+        elif command=="STATE":
+            self.flush_clocks()
+            for name in tokens[1:]:
+                self.goto(svf_state(name))
+                pass
+            pass
+        elif command=="FREQUENCY":
+            self.frequency = None
+            if len(tokens)>1: self.frequency = float(tokens[1])
+            pass
+        elif command=="TRST":
+            pass
+        else:
+            raise SvfError("Unsupported SVF statement %s"%command)
+        pass
+
+    #f scan
+    def scan(self, command, tokens, header, trailer, write_fn, end_state):
+        """
+        Perform an SIR or SDR with its header and trailer, checking the TDO if expected
+        """
+        data = self.scans[command]
+        data.update(tokens)
+        length = 0
+        tdi = 0
+        expected = 0
+        mask = 0
+        for s in (header, data, trailer):
+            tdi |= s.tdi << length
+            if s.tdo is not None:
+                expected |= s.tdo << length
+                mask |= s.mask << length
+                pass
+            length += s.length
+            pass
+        if length==0: return
+        self.flush_clocks()
+        if mask==0:
+            write_fn(BitVector(length, tdi), end_state=end_state, capture=False)
+            return
+        tdo = write_fn(BitVector(length, tdi), end_state=end_state).value
+        if (tdo ^ expected) & mask:
+            mismatch = SvfMismatch(self.num_statements, command, length, tdo, expected, mask)
+            self.mismatches.append(mismatch)
+            if self.stop_on_mismatch: raise SvfError(str(mismatch))
+            pass
+        pass
+
+    #f run_test
+    def run_test(self, tokens):
+        """
+        RUNTEST [run_state] (count TCK|SCK [min_time SEC] | min_time SEC) [MAXIMUM max_time SEC] [ENDSTATE end_state]
+
+        The run state and end state persist; if a run state is given
+        without an end state, the end state is the run state.
+        """
+        i = 1
+        if tokens[i] in svf_states:
+            self.run_state = svf_state(tokens[i], stable=True)
+            self.run_end_state = self.run_state
+            i += 1
+            pass
+        clocks = 0
+        min_time = 0.
+        if tokens[i+1] in ("TCK", "SCK"):
+            clocks = int(float(tokens[i]))
+            i += 2
+            if (i+1<len(tokens)) and (tokens[i+1]=="SEC"):
+                min_time = float(tokens[i])
+                i += 2
+                pass
+            pass
+        elif tokens[i+1]=="SEC":
+            min_time = float(tokens[i])
+            i += 2
+            pass
+        else:
+            raise SvfError("Bad RUNTEST statement")
+        if (i<len(tokens)) and (tokens[i]=="MAXIMUM"):
+            i += 3
+            pass
+        if (i<len(tokens)) and (tokens[i]=="ENDSTATE"):
+            self.run_end_state = svf_state(tokens[i+1], stable=True)
+            pass
+        frequency = self.frequency
+        if frequency is None: frequency = self.tck_frequency
+        clocks = max(clocks, int(math.ceil(min_time * frequency)))
+
+        if (self.pending_clocks>0) and (self.pending_state!=self.run_state): self.flush_clocks()
+        if self.pending_clocks==0:
+            self.goto(self.run_state)
+            self.pending_state = self.run_state
+            pass
+        self.pending_clocks += clocks
+        if self.run_end_state!=self.run_state:
+            self.flush_clocks()
+            self.goto(self.run_end_state)
+            pass
+        pass
+    pass
@@ -0,0 +1,196 @@
+#a Copyright
+#
+#  This file 'tap_state.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+The JTAG TAP state machine, as implemented in jtag_tap.cdl
+
+The states are numbered as in the t_jtag_fsm of jtag_tap.cdl.
+
+tap_next_state[state] is a tuple of the next state for TMS of 0 and 1.
+
+tap_tms_paths[from_state][to_state] is the shortest sequence of TMS
+values (as a BitVector) that moves the state machine from one state
+to the other; these are precomputed for all 16x16 state pairs.
+
+Where a state is tracked, None indicates that the TAP is either in
+test_logic_reset or idle (as after power-on), and TapState.unknown
+that it may be in any state.
+"""
+
+#a Imports
+from .bits import BitVector
+
+#a TAP states
+#c TapState
+class TapState:
+    test_logic_reset = 0
+    idle             = 1
+    select_dr_scan   = 2
+    select_ir_scan   = 3
+    capture_dr       = 4
+    shift_dr         = 5
+    exit1_dr         = 6
+    pause_dr         = 7
+    exit2_dr         = 8
+    update_dr        = 9
+    capture_ir       = 10
+    shift_ir         = 11
+    exit1_ir         = 12
+    pause_ir         = 13
+    exit2_ir         = 14
+    update_ir        = 15
+    unknown          = 16 # Not a state of the TAP; any of the above
+    names = ["test_logic_reset", "idle", "select_dr_scan", "select_ir_scan",
+             "capture_dr", "shift_dr", "exit1_dr", "pause_dr", "exit2_dr", "update_dr",
+             "capture_ir", "shift_ir", "exit1_ir", "pause_ir", "exit2_ir", "update_ir",
+             "unknown",
+             ]
+    pass
+
+#a Transition tables
+S = TapState
+tap_next_state = [ (S.idle,           S.test_logic_reset), # test_logic_reset
+                   (S.idle,           S.select_dr_scan),   # idle
+                   (S.capture_dr,     S.select_ir_scan),   # select_dr_scan
+                   (S.capture_ir,     S.test_logic_reset), # select_ir_scan
+                   (S.shift_dr,       S.exit1_dr),         # capture_dr
+                   (S.shift_dr,       S.exit1_dr),         # shift_dr
+                   (S.pause_dr,       S.update_dr),        # exit1_dr
+                   (S.pause_dr,       S.exit2_dr),         # pause_dr
+                   (S.shift_dr,       S.update_dr),        # exit2_dr
+                   (S.idle,           S.select_dr_scan),   # update_dr
+                   (S.shift_ir,       S.exit1_ir),         # capture_ir
+                   (S.shift_ir,       S.exit1_ir),         # shift_ir
+                   (S.pause_ir,       S.update_ir),        # exit1_ir
+                   (S.pause_ir,       S.exit2_ir),         # pause_ir
+                   (S.shift_ir,       S.update_ir),        # exit2_ir
+                   (S.idle,           S.select_dr_scan),   # update_ir
+                   ]
+del S
+
+#f tap_shortest_paths
+def tap_shortest_paths(from_state):
+    """
+    Breadth-first search from from_state; return a list of BitVectors
+    of TMS values, one for each destination state
+    """
+    paths = [None] * 16
+    paths[from_state] = BitVector(0)
+    pending = [from_state]
+    while pending!=[]:
+        next_pending = []
+        for s in pending:
+            for tms in (0,1):
+                n = tap_next_state[s][tms]
+                if paths[n] is None:
+                    paths[n] = paths[s].concat(BitVector(1,tms))
+                    next_pending.append(n)
+                    pass
+                pass
+            pass
+        pending = next_pending
+        pass
+    return paths
+
+tap_tms_paths = [tap_shortest_paths(s) for s in range(16)]
+
+#a Following TMS values
+# Sets of possible states are bit masks, with bit n set for state n
+_reset_or_idle_states = (1<<TapState.test_logic_reset) | (1<<TapState.idle)
+_all_states = (1<<16)-1
+
+#f tap_next_states
+def tap_next_states(states, tms):
+    """
+    Return the set (as a bit mask) of states reached from the set
+    'states' with a TMS value of tms
+    """
+    if (states & (states-1))==0: return 1<<tap_next_state[states.bit_length()-1][tms]
+    next_states = 0
+    for s in range(16):
+        if (states>>s)&1: next_states |= 1<<tap_next_state[s][tms]
+        pass
+    return next_states
+
+#f tap_follow_resets
+def tap_follow_resets(state, tms):
+    """
+    Return (state, reset) after following the TMS values of
+    BitVector tms from 'state', as for tap_follow; reset is True if
+    the TAP may have entered test_logic_reset from another state
+    (which sets the IR to IDCODE) on the way
+    """
+    states = _all_states
+    if state is None: states = _reset_or_idle_states
+    elif state!=TapState.unknown: states = 1<<state
+    reset = False
+    for (t, n) in tms.runs():
+        for i in range(n):
+            # Reset is entered only from select_ir_scan, with TMS of 1
+            if t and ((states>>TapState.select_ir_scan)&1): reset = True
+            next_states = tap_next_states(states, t)
+            if next_states==states: break
+            states = next_states
+            pass
+        pass
+    if (states & (states-1))==0: return (states.bit_length()-1, reset)
+    if states==_reset_or_idle_states: return (None, reset)
+    return (TapState.unknown, reset)
+
+#f tap_follow
+def tap_follow(state, tms):
+    """
+    Return the state reached from 'state' after the TMS values of BitVector tms
+
+    The state may be None (test_logic_reset or idle) or
+    TapState.unknown. The set of possible states is followed through
+    the TMS values, so (for example) a TMS of 0 from None reaches
+    idle, three TMS of 1 from None reach test_logic_reset, and five
+    always do. If the TAP may still be in more than one state at the
+    end then None is returned if those are test_logic_reset and idle,
+    and TapState.unknown otherwise.
+
+    The TMS values are followed a run at a time, and the rest of a
+    run is skipped once the set of states no longer changes, so long
+    runs (such as idle clocks) are cheap.
+    """
+    return tap_follow_resets(state, tms)[0]
+
+#f tap_tms_path
+def tap_tms_path(from_state, to_state):
+    """
+    Return a BitVector of TMS values that move the state machine from
+    from_state (which may be None, for reset or idle, or
+    TapState.unknown, which requires a reset first) to to_state
+    """
+    if from_state is None:
+        if to_state==TapState.test_logic_reset: return BitVector(5,0x1f)
+        return BitVector(1,0).concat(tap_tms_paths[TapState.idle][to_state])
+    if from_state==TapState.unknown:
+        return BitVector(5,0x1f).concat(tap_tms_paths[TapState.test_logic_reset][to_state])
+    return tap_tms_paths[from_state][to_state]
+
+#f tap_scan_path
+def tap_scan_path(from_state, shift_state):
+    """
+    Return a BitVector of TMS values that move the state machine from
+    from_state to shift_state (shift_dr or shift_ir) through the
+    corresponding capture state, so that the register is freshly captured
+    """
+    capture_state = shift_state-1 # capture_dr/capture_ir immediately precede shift_dr/shift_ir
+    return tap_tms_path(from_state, capture_state).concat(BitVector(1,0))
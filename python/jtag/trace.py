@@ -0,0 +1,514 @@
+#a Copyright
+#
+#  This file 'trace.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+Binary traces of the TMS, TDI and TDO of a JtagModule* backend.
+
+A JtagTraceRecorder attached to a JtagModule* (JtagModule,
+JtagModuleApbSlow or JtagModuleApbFast) records every TCK the module
+performs, as records of:
+
+  reset : a JTAG reset (five TCKs with TMS high)
+  tms   : a sequence of TMS values (TDO not recorded)
+  shift : a shift of TDI values with TMS low except (possibly) the
+          last bit, with the TDO values (unless a jtag_execute
+          command did not capture them)
+
+Each record has the operation index (a count of the public
+operations of the module - so the TMS and shift records of a single
+jtag_write_drs have the same index). As the backends are equivalent,
+traces of the same operations with different backends are identical
+(except for TDO data that depends on timing, such as a timer value
+read over APB).
+
+The file is a header (magic and version), then records of a 12-byte
+header:
+
+  operation index (32 bits), number of bits (32 bits), kind (8 bits),
+  flags (8 bits; bit 0 set if TDO is valid), 2 bytes of padding
+
+followed by three bit-planes (TMS, TDI, TDO) of the number of bits
+rounded up to bytes, little-endian (first TCK in bit 0 of the first byte).
+
+Records are buffered in memory up to buffer_size bytes before being
+written, so memory use is bounded, and a shift of many bits costs
+only its integer-to-bytes conversions.
+
+JtagTrace reads a trace file through mmap, decoding records only as
+they are iterated over; replay() performs a trace with a JtagModule*
+(or a simulation through one) and compares its TDO, and diff()
+compares two traces, comparing the raw bytes of the records before
+decoding any that differ.
+"""
+
+#a Imports
+import mmap
+import struct
+from .bits import BitVector
+
+#a Constants
+trace_magic = b"JTAGTRC1"
+trace_record = struct.Struct("<IIBBxx")
+kind_reset = 0
+kind_tms   = 1
+kind_shift = 2
+kind_names = {kind_reset:"reset", kind_tms:"tms", kind_shift:"shift"}
+flag_tdo_valid = 1
+
+#a Recording
+#c JtagTraceRecorder
+class JtagTraceRecorder:
+    """
+    Recorder of a trace of a JtagModule* to a file
+    """
+    wrapped_methods = ("jtag_reset", "jtag_tms", "jtag_shift_vector", "jtag_scan", "jtag_execute", "jtag_read_idcodes")
+    #f __init__
+    def __init__(self, path, jtag_module=None, buffer_size=1<<20):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = bytearray(trace_magic)
+        self.file = open(path, "wb")
+        self.operation_index = 0
+        self.depth = 0
+        self.num_records = 0
+        self.suppress_shifts = 0
+        self.num_bits = 0
+        self.jtag_module = None
+        self.saved = {}
+        if jtag_module is not None: self.attach(jtag_module)
+        pass
+
+    #f record
+    def record(self, kind, n, tms=0, tdi=0, tdo=None):
+        """
+        Add a record of n TCKs, with TMS, TDI and TDO values as integers (TDO may be None)
+        """
+        nbytes = (n+7)//8
+        flags = 0
+        if tdo is not None: flags |= flag_tdo_valid
+        else: tdo = 0
+        buffer = self.buffer
+        buffer += trace_record.pack(self.operation_index, n, kind, flags)
+        buffer += tms.to_bytes(nbytes, "little")
+        buffer += tdi.to_bytes(nbytes, "little")
+        buffer += tdo.to_bytes(nbytes, "little")
+        self.num_records += 1
+        self.num_bits += n
+        if len(buffer)>=self.buffer_size: self.flush()
+        pass
+
+    #f flush
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+        self.file.flush()
+        pass
+
+    #f close
+    def close(self):
+        """
+        Detach from the module (if attached), and write out and close the trace
+        """
+        self.detach()
+        if self.file is None: return
+        self.flush()
+        self.file.close()
+        self.file = None
+        pass
+
+    #f _operation
+    def _operation(self, fn, record_fn):
+        """
+        Wrap a method of the module; record_fn(args, kwargs, result)
+        records it, and is only invoked if no inner method has
+        recorded anything
+        """
+        def wrapped(*args, **kwargs):
+            before = self.num_records
+            self.depth += 1
+            try:
+                r = fn(*args, **kwargs)
+                pass
+            finally:
+                self.depth -= 1
+                pass
+            if self.num_records==before: record_fn(args, kwargs, r)
+            if self.depth==0: self.operation_index += 1
+            return r
+        return wrapped
+
+    #f _record_reset
+    def _record_reset(self, args, kwargs, r):
+        self.record(kind_reset, 5, 0x1f)
+        pass
+
+    #f _record_tms
+    def _record_tms(self, args, kwargs, r):
+        tms = BitVector.of(args[0])
+        if tms.length>0: self.record(kind_tms, tms.length, tms.value)
+        pass
+
+    #f _record_shift
+    def _record_shift(self, args, kwargs, r):
+        if self.suppress_shifts>0: return
+        tdi = args[0]
+        last_tms = kwargs.get("last_tms", args[1] if len(args)>1 else 1)
+        tdo = None
+        if r is not None: tdo = r.value
+        self.record(kind_shift, tdi.length, last_tms<<(tdi.length-1), tdi.value, tdo)
+        pass
+
+    #f _record_scan
+    def _record_scan(self, args, kwargs, r):
+        (tms_pre, tdi, tms_post) = args[:3]
+        if not isinstance(tdi, BitVector):
+            tdi = BitVector.of_bits(tdi)
+            if r is not None: r = BitVector.of_bits(r)
+            pass
+        self._record_tms((tms_pre,), {}, None)
+        self._record_shift((tdi, 1), {}, r)
+        self._record_tms((tms_post,), {}, None)
+        pass
+
+    #f _record_execute
+    def _record_execute(self, args, kwargs, r):
+        for ((op, n, value, capture), tdo) in zip(args[0], r):
+            if op==0:
+                if n>=5:
+                    self._record_reset((), {}, None)
+                    n -= 5
+                    pass
+                self._record_tms((BitVector(n, -1),), {}, None)
+                pass
+            elif op==1:
+                self._record_tms((BitVector(n, value),), {}, None)
+                pass
+            else:
+                if not capture: tdo = None
+                self.record(kind_shift, n, (op&1)<<(n-1), value, tdo)
+                pass
+            pass
+        pass
+
+    #f _read_idcodes
+    def _read_idcodes(self, fn):
+        """
+        Wrap jtag_read_idcodes; its shift is recorded as a single
+        shift record of the IDCODEs and a final 0 bit, whatever the
+        backend does (the reset and move to shift-dr are recorded by
+        the inner methods)
+        """
+        def wrapped():
+            self.depth += 1
+            self.suppress_shifts += 1
+            try:
+                r = fn()
+                pass
+            finally:
+                self.depth -= 1
+                self.suppress_shifts -= 1
+                pass
+            tdo = 0
+            for i in range(len(r)): tdo |= r[i] << (32*i)
+            self.record(kind_shift, 32*len(r)+1, 0, 0, tdo)
+            if self.depth==0: self.operation_index += 1
+            return r
+        return wrapped
+
+    #f attach
+    def attach(self, jtag_module):
+        """
+        Install the recording wrappers in a module
+        """
+        self.detach()
+        self.jtag_module = jtag_module
+        record_fns = {"jtag_reset":        self._record_reset,
+                      "jtag_tms":          self._record_tms,
+                      "jtag_shift_vector": self._record_shift,
+                      "jtag_scan":         self._record_scan,
+                      "jtag_execute":      self._record_execute,
+                      }
+        for name in self.wrapped_methods:
+            self.saved[name] = jtag_module.__dict__.get(name)
+            if name=="jtag_read_idcodes":
+                wrapped = self._read_idcodes(getattr(jtag_module, name))
+                pass
+            else:
+                wrapped = self._operation(getattr(jtag_module, name), record_fns[name])
+                pass
+            setattr(jtag_module, name, wrapped)
+            pass
+        jtag_module._export()
+        pass
+
+    #f detach
+    def detach(self):
+        """
+        Remove the recording wrappers from the module
+        """
+        if self.jtag_module is None: return
+        for (name, value) in self.saved.items():
+            if value is None:
+                delattr(self.jtag_module, name)
+                pass
+            else:
+                setattr(self.jtag_module, name, value)
+                pass
+            pass
+        self.jtag_module._export()
+        self.saved = {}
+        self.jtag_module = None
+        pass
+    pass
+
+#a Reading
+#c JtagTraceRecord
+class JtagTraceRecord:
+    """
+    A record of a trace, with TMS, TDI and TDO as integers (TDO is None if not valid)
+    """
+    #f __init__
+    def __init__(self, operation_index, kind, n, tms, tdi, tdo, first_tck):
+        self.operation_index = operation_index
+        self.kind = kind
+        self.n = n
+        self.tms = tms
+        self.tdi = tdi
+        self.tdo = tdo
+        self.first_tck = first_tck
+        pass
+
+    #f __repr__
+    def __repr__(self):
+        tdo = "-"
+        if self.tdo is not None: tdo = "%x"%self.tdo
+        return "JtagTraceRecord(op %d, %s, tck %d, %d bits, tms %x, tdi %x, tdo %s)"%(self.operation_index, kind_names[self.kind], self.first_tck, self.n, self.tms, self.tdi, tdo)
+    pass
+
+#c JtagTrace
+class JtagTrace:
+    """
+    A trace file, read through mmap
+    """
+    #f __init__
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = b""
+        self.mmap = None
+        if self.file.seek(0, 2)>0:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = self.mmap
+            pass
+        if self.data[:len(trace_magic)]!=trace_magic:
+            self.close()
+            raise Exception("File '%s' is not a JTAG trace"%path)
+        pass
+
+    #f close
+    def close(self):
+        if self.mmap is not None: self.mmap.close()
+        self.mmap = None
+        self.data = b""
+        self.file.close()
+        pass
+
+    #f __enter__
+    def __enter__(self):
+        return self
+
+    #f __exit__
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        pass
+
+    #f extents
+    def extents(self):
+        """
+        Iterate over the records as (offset, end, operation_index, n, kind, flags, first_tck), without decoding their bits
+        """
+        data = self.data
+        offset = len(trace_magic)
+        end_of_data = len(data)
+        first_tck = 0
+        header_size = trace_record.size
+        unpack_from = trace_record.unpack_from
+        while offset<end_of_data:
+            (operation_index, n, kind, flags) = unpack_from(data, offset)
+            end = offset + header_size + 3*((n+7)//8)
+            yield (offset, end, operation_index, n, kind, flags, first_tck)
+            first_tck += n
+            offset = end
+            pass
+        pass
+
+    #f decode
+    def decode(self, extent):
+        """
+        Decode a record from its extent
+        """
+        (offset, end, operation_index, n, kind, flags, first_tck) = extent
+        nbytes = (n+7)//8
+        data = self.data
+        start = offset + trace_record.size
+        tms = int.from_bytes(data[start:start+nbytes], "little")
+        tdi = int.from_bytes(data[start+nbytes:start+2*nbytes], "little")
+        tdo = None
+        if flags & flag_tdo_valid:
+            tdo = int.from_bytes(data[start+2*nbytes:end], "little")
+            pass
+        return JtagTraceRecord(operation_index, kind, n, tms, tdi, tdo, first_tck)
+
+    #f records
+    def records(self):
+        """
+        Iterate over the records of the trace
+        """
+        for extent in self.extents():
+            yield self.decode(extent)
+            pass
+        pass
+
+    #f num_tcks
+    def num_tcks(self):
+        n = 0
+        for extent in self.extents(): n += extent[3]
+        return n
+    pass
+
+#a Replay and diff
+#c JtagTraceDifference
+class JtagTraceDifference:
+    """
+    A difference between two traces (or between a trace and a replay of it)
+
+    record is the index of the record; field is 'tms', 'tdi', 'tdo',
+    'kind', 'length' or 'end'; tck is the index of the first TCK that
+    differs (for tms, tdi and tdo), from the start of the trace
+    """
+    #f __init__
+    def __init__(self, record, operation_index, field, tck=None, a=None, b=None):
+        self.record = record
+        self.operation_index = operation_index
+        self.field = field
+        self.tck = tck
+        self.a = a
+        self.b = b
+        pass
+
+    #f __repr__
+    def __repr__(self):
+        return "JtagTraceDifference(record %d, op %d, %s, tck %s, %r, %r)"%(self.record, self.operation_index, self.field, str(self.tck), self.a, self.b)
+    pass
+
+#f first_difference
+def first_difference(a, b):
+    """
+    Return the index of the lowest bit that differs in two integers
+    """
+    x = a ^ b
+    return (x & -x).bit_length() - 1
+
+#f same_bytes
+def same_bytes(a, b, chunk_size=1<<24):
+    """
+    Return True if two buffers (e.g. mmaps) are identical, comparing
+    them in chunks to bound the memory used
+    """
+    if len(a)!=len(b): return False
+    for i in range(0, len(a), chunk_size):
+        if a[i:i+chunk_size]!=b[i:i+chunk_size]: return False
+        pass
+    return True
+
+#f diff_records
+def diff_records(index, ra, rb):
+    """
+    Return a list of JtagTraceDifference between two JtagTraceRecord
+    """
+    if ra.kind!=rb.kind:
+        return [JtagTraceDifference(index, ra.operation_index, "kind", ra.first_tck, kind_names[ra.kind], kind_names[rb.kind])]
+    if ra.n!=rb.n:
+        return [JtagTraceDifference(index, ra.operation_index, "length", ra.first_tck, ra.n, rb.n)]
+    differences = []
+    for field in ("tms", "tdi", "tdo"):
+        va = getattr(ra, field)
+        vb = getattr(rb, field)
+        if (va is None) or (vb is None) or (va==vb): continue
+        bit = first_difference(va, vb)
+        differences.append(JtagTraceDifference(index, ra.operation_index, field, ra.first_tck+bit, (va>>bit)&1, (vb>>bit)&1))
+        pass
+    return differences
+
+#f diff
+def diff(trace_a, trace_b, max_differences=16):
+    """
+    Compare two JtagTrace, returning a list of (up to
+    max_differences) JtagTraceDifference; TDO is only compared if it
+    is valid in both
+
+    The records are compared as bytes, and only decoded if these differ
+    """
+    if same_bytes(trace_a.data, trace_b.data): return []
+    differences = []
+    extents_b = trace_b.extents()
+    index = 0
+    for ea in trace_a.extents():
+        eb = next(extents_b, None)
+        if eb is None:
+            differences.append(JtagTraceDifference(index, ea[2], "end", ea[6], "record", None))
+            return differences
+        if trace_a.data[ea[0]:ea[1]]!=trace_b.data[eb[0]:eb[1]]:
+            differences += diff_records(index, trace_a.decode(ea), trace_b.decode(eb))
+            if len(differences)>=max_differences: return differences[:max_differences]
+            pass
+        index += 1
+        pass
+    eb = next(extents_b, None)
+    if eb is not None:
+        differences.append(JtagTraceDifference(index, eb[2], "end", eb[6], None, "record"))
+        pass
+    return differences
+
+#f replay
+def replay(trace, jtag_module, max_differences=16):
+    """
+    Perform the records of a JtagTrace with a JtagModule*, returning
+    a list of (up to max_differences) JtagTraceDifference of the TDO
+    """
+    differences = []
+    index = 0
+    for r in trace.records():
+        if r.kind==kind_reset:
+            jtag_module.jtag_reset()
+            pass
+        elif r.kind==kind_tms:
+            jtag_module.jtag_tms(BitVector(r.n, r.tms))
+            pass
+        else:
+            last_tms = (r.tms>>(r.n-1)) & 1
+            tdo = jtag_module.jtag_shift_vector(BitVector(r.n, r.tdi), last_tms, capture=(r.tdo is not None))
+            if (r.tdo is not None) and (tdo.value!=r.tdo):
+                bit = first_difference(r.tdo, tdo.value)
+                differences.append(JtagTraceDifference(index, r.operation_index, "tdo", r.first_tck+bit, (r.tdo>>bit)&1, (tdo.value>>bit)&1))
+                if len(differences)>=max_differences: return differences
+                pass
+            pass
+        index += 1
+        pass
+    return differences
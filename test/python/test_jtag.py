@@ -25,33 +25,31 @@ Only a single configuration of the JTAG TAP is tested.
 """
 
 #a Imports
+import os
+import tempfile
+import threading
+import time
+from array import array
 from regress.apb.structs import t_apb_request, t_apb_response
 from regress.apb.bfm     import ApbMaster
 from regress.jtag import apb_target_jtag
-from regress.jtag.jtag_module import JtagModule, JtagModuleApbSlow, JtagModuleApbFast
+from regress.jtag.jtag_module import JtagModule, JtagModuleApbSlow, JtagModuleApbFast, JtagModuleApbFifo, JtagModuleRemoteBitbang
+from regress.jtag.bits import BitVector, int_of_bits, bits_of_n, vectors_of_bytes
+from regress.jtag.tap_state import TapState
+from regress.jtag.scan_chain import ScanChain, ScanChainCache, ScanChainError
+from regress.jtag.jtag_apb import JtagApbMaster
+from regress.jtag.bitbang_compiler import BitbangFastTarget, bitbang_encode
+from regress.jtag.openocd_server import OpenocdServer, BitbangJtagPinsTarget
+from regress.jtag.instrument import JtagInstrumentation
+from regress.jtag import trace
+from regress.jtag.svf import SvfPlayer
+from regress.jtag.jtag_async import run_chains
+from regress.jtag.jtag_queue import JtagQueue
 from cdl.sim     import ThExecFile
 from cdl.sim     import HardwareThDut
 from cdl.sim     import TestCase
 from cdl.utils   import csr
 
-#a Useful functions
-def int_of_bits(bits):
-    l = len(bits)
-    m = 1<<(l-1)
-    v = 0
-    for b in bits:
-        v = (v>>1) | (m*b)
-        pass
-    return v
-
-def bits_of_n(nbits, n):
-    bits = []
-    for i in range(nbits):
-        bits.append(n&1)
-        n >>= 1
-        pass
-    return bits
-
 #a Test classes
 #c ApbAddressMap
 class ApbAddressMap(csr.Map):
@@ -69,8 +67,10 @@ class c_jtag_apb_time_test_base(ThExecFile):
     Base methods for JTAG interaction, really
     """
     #f __init__
-    def __init__(self, use_apb_target_jtag=0, **kwargs):
+    def __init__(self, use_apb_target_jtag=0, instrument=False, **kwargs):
         self.use_apb_target_jtag = use_apb_target_jtag
+        self.instrument = instrument
+        self.jtag_instrumentation = None
         super(c_jtag_apb_time_test_base,self).__init__(**kwargs)
         pass
     #f run__init - invoked by submodules
@@ -80,7 +80,10 @@ class c_jtag_apb_time_test_base(ThExecFile):
             self.apb = ApbMaster(self, "apb_request",  "apb_response")
             self.apb_map = ApbAddressMap()
             self.jtag_map  = self.apb_map.jtag # This is an ApbAddressMap()
-            if self.use_apb_target_jtag==2:
+            if self.use_apb_target_jtag==3:
+                self.jtag_module = JtagModuleApbFifo(self, self.apb, self.jtag_map)
+                pass
+            elif self.use_apb_target_jtag==2:
                 self.jtag_module = JtagModuleApbFast(self, self.apb, self.jtag_map)
                 pass
             else:
@@ -90,6 +93,9 @@ class c_jtag_apb_time_test_base(ThExecFile):
         else:
             self.jtag_module = JtagModule(self.bfm_wait, self.tck_enable, self.jtag__tms, self.jtag__tdi, self.tdo, self)
             pass
+        if self.instrument:
+            self.jtag_instrumentation = JtagInstrumentation(self.jtag_module)
+            pass
         pass
 
     #f apb_write
@@ -97,14 +103,14 @@ class c_jtag_apb_time_test_base(ThExecFile):
         """
         Requires the JTAG state machine to be in reset or idle.
 
-        Writes the IR to be 'access' if required, then does the appropriate write access.
+        Writes the IR to be 'access' if required, then does the appropriate write access (without capturing TDO).
         """
         if write_ir:
-            self.jtag_write_irs(ir_bits = bits_of_n(5,0x11)) # Send in 0x11 (apb_access)
+            self.jtag_write_irs(ir_bits = BitVector(5,0x11), capture=False) # Send in 0x11 (apb_access)
             pass
         if self.use_apb_target_jtag: self.jtag_tms([0,0,0,0,0,0])
-        data = self.jtag_write_drs(dr_bits = bits_of_n(50,((address&0xffff)<<34)|((data&0xffffffff)<<2)|(2)))
-        return data
+        self.jtag_write_drs(dr_bits = BitVector(50,((address&0xffff)<<34)|((data&0xffffffff)<<2)|(2)), capture=False)
+        pass
 
     #f apb_read_slow
     def apb_read_slow(self, address, write_ir=False):
@@ -114,14 +120,14 @@ class c_jtag_apb_time_test_base(ThExecFile):
         Writes the IR to be 'access' if required, then does the appropriate read access; it then waits and does another operation to get the data back
         """
         if write_ir:
-            self.jtag_write_irs(ir_bits = bits_of_n(5,0x11)) # Send in 0x11 (apb_access)
+            self.jtag_write_irs(ir_bits = BitVector(5,0x11), capture=False) # Send in 0x11 (apb_access)
             pass
         if self.use_apb_target_jtag: self.jtag_tms([0,0,0,0,0,0])
-        data = self.jtag_write_drs(dr_bits = bits_of_n(50,((address&0xffff)<<34)|(0<<2)|(1)))
+        self.jtag_write_drs(dr_bits = BitVector(50,((address&0xffff)<<34)|(0<<2)|(1)), capture=False)
         self.bfm_wait(100)
         if self.use_apb_target_jtag: self.jtag_tms([0,0,0,0,0,0])
-        data = self.jtag_write_drs(dr_bits = bits_of_n(50,0))
-        return int_of_bits(data)
+        data = self.jtag_write_drs(dr_bits = BitVector(50,0))
+        return data.value
 
     #f apb_read_pipelined
     def apb_read_pipelined(self, address):
@@ -131,8 +137,8 @@ class c_jtag_apb_time_test_base(ThExecFile):
         Peforms the appropriate read access and returns the last data
         """
         if self.use_apb_target_jtag: self.jtag_tms([0,0,0,0,0,0])
-        data = self.jtag_write_drs(dr_bits = bits_of_n(50,((address&0xffff)<<34)|(0<<2)|(1)))
-        return int_of_bits(data)
+        data = self.jtag_write_drs(dr_bits = BitVector(50,((address&0xffff)<<34)|(0<<2)|(1)))
+        return data.value
 
     #f run
     def run(self):
@@ -141,6 +147,9 @@ class c_jtag_apb_time_test_base(ThExecFile):
     #f run__finalize
     def run__finalize(self):
         # self.verbose.error("%s"%(self.global_cycle()))
+        if self.jtag_instrumentation is not None:
+            for l in self.jtag_instrumentation.report(): self.verbose.info(l)
+            pass
         pass
 
 #c c_jtag_apb_time_test_idcode
@@ -175,7 +184,7 @@ class c_jtag_apb_time_test_bypass(c_jtag_apb_time_test_base):
     #f run
     def run(self):
         self.jtag_reset()
-        self.jtag_write_irs(ir_bits = bits_of_n(5,self.ir_value)) # bypass mode
+        self.jtag_write_irs(ir_bits = BitVector(5,self.ir_value)) # bypass mode
 
         for test_data in [0x0,
                           0x8000000000000000,                          
@@ -183,9 +192,9 @@ class c_jtag_apb_time_test_bypass(c_jtag_apb_time_test_base):
                           0x123456789abcdef0,
                           0xdeadbeefcafefeed,
                           ]:
-            pattern_bits = bits_of_n(64,test_data) + [0]
+            pattern_bits = BitVector(65,test_data) # 64 bits of data and a final 0
             data = self.jtag_write_drs(dr_bits = pattern_bits)
-            check_value = int_of_bits(data)>>1 # Lose the first bit that is in the Bypass 1-bit shift register
+            check_value = data.value>>1 # Lose the first bit that is in the Bypass 1-bit shift register
             self.compare_expected("Expected bypass to be a 1-bit shift register",check_value,test_data)
             self.verbose.info("Received back %016x when in bypass - put in %016x - so these should match"%(check_value, test_data))
             pass
@@ -204,6 +213,362 @@ class c_jtag_apb_time_test_bypass2(c_jtag_apb_time_test_bypass):
     ir_value = 0
     pass
 
+#c c_jtag_apb_time_test_bypass_list
+class c_jtag_apb_time_test_bypass_list(c_jtag_apb_time_test_base):
+    """
+    Test the TAP controller in bypass using lists of bits rather than BitVectors
+
+    This checks the compatibility wrappers for lists of bits in jtag_shift
+    """
+    #f run
+    def run(self):
+        self.jtag_reset()
+        self.jtag_write_irs(ir_bits = bits_of_n(5,0x1f)) # bypass mode
+
+        for test_data in [0x0,
+                          0x123456789abcdef0,
+                          ]:
+            pattern_bits = bits_of_n(64,test_data) + [0]
+            data = self.jtag_write_drs(dr_bits = pattern_bits)
+            self.compare_expected("Expected a list of bits back",len(data),65)
+            check_value = int_of_bits(data)>>1 # Lose the first bit that is in the Bypass 1-bit shift register
+            self.compare_expected("Expected bypass to be a 1-bit shift register",check_value,test_data)
+            pass
+
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_bypass_chained
+class c_jtag_apb_time_test_bypass_chained(c_jtag_apb_time_test_base):
+    """
+    Test the TAP state tracking, by starting scans from shift-dr
+    (after reading IDCODEs) and by running back-to-back bypass DR
+    scans that do not return to idle between them
+    """
+    #f run
+    def run(self):
+        self.jtag_read_idcodes() # Leaves the TAP in shift-dr
+        self.jtag_write_irs(ir_bits = BitVector(5,0x1f)) # bypass mode
+
+        for test_data in [0x0,
+                          0x123456789abcdef0,
+                          0xdeadbeefcafefeed,
+                          ]:
+            data = self.jtag_write_drs(dr_bits = BitVector(65,test_data), end_state=TapState.update_dr)
+            check_value = data.value>>1 # Lose the first bit that is in the Bypass 1-bit shift register
+            self.compare_expected("Expected bypass to be a 1-bit shift register",check_value,test_data)
+            pass
+        self.jtag_goto(TapState.idle)
+
+        self.jtag_write_irs(ir_bits = BitVector(5,1)) # IDCODE
+        data = self.jtag_write_drs(dr_bits = BitVector(32,0))
+        self.compare_expected("Expected IDCODE after bypass scans",data.value,0xabcde6e3)
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_bypass_stream
+class c_jtag_apb_time_test_bypass_stream(c_jtag_apb_time_test_base):
+    """
+    Test a streamed DR scan through bypass, in chunks of 128 bits from a buffer
+    """
+    #f run
+    def run(self):
+        self.jtag_reset()
+        self.jtag_write_irs(ir_bits = BitVector(5,0x1f)) # bypass mode
+        data = bytes([(i*37+11)&0xff for i in range(128)])
+        tdo = 0
+        length = 0
+        for chunk in self.jtag_write_drs_stream(vectors_of_bytes(data, chunk_bits=128)):
+            self.compare_expected("Expected TDO chunks of 128 bits",chunk.length,128)
+            tdo |= chunk.value << length
+            length += chunk.length
+            pass
+        self.compare_expected("Expected 1024 bits scanned",length,1024)
+        check_value = tdo>>1 # Lose the first bit that is in the Bypass 1-bit shift register
+        self.compare_expected("Expected bypass to be a 1-bit shift register",check_value,int.from_bytes(data,"little") & ((1<<1023)-1))
+        self.compare_expected("Expected TAP in idle",self.jtag_module.tap_state,TapState.idle)
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_tap_unknown
+class c_jtag_apb_time_test_tap_unknown(c_jtag_apb_time_test_base):
+    """
+    Test that TMS values that leave the TAP in an unknown state are followed by a reset before the next scan
+    """
+    #f run
+    def run(self):
+        self.jtag_reset()
+        self.jtag_tms([0])
+        self.jtag_module.tap_state = None # Known only to be reset or idle (it is idle)
+        self.jtag_tms([1,0,0]) # To shift-dr (from idle) or idle (from reset)
+        self.compare_expected("Expected TAP state to be unknown",self.jtag_module.tap_state,TapState.unknown)
+        self.jtag_write_irs(ir_bits = BitVector(5,1), capture=False) # IDCODE
+        data = self.jtag_write_drs(dr_bits = BitVector(32,0))
+        self.compare_expected("Expected IDCODE after a scan from an unknown state",data.value,0xabcde6e3)
+        self.compare_expected("Expected TAP in idle",self.jtag_module.tap_state,TapState.idle)
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_write_only
+class c_jtag_apb_time_test_write_only(c_jtag_apb_time_test_base):
+    """
+    Test scans that do not capture TDO, checking their effect with captured scans
+    """
+    #f run
+    def run(self):
+        self.jtag_reset()
+        data = self.jtag_write_irs(ir_bits = BitVector(5,0x1f), capture=False) # bypass mode
+        self.compare_expected("Expected no data from a write-only scan",data,None)
+        for test_data in [0x0,
+                          0x123456789abcdef0,
+                          0xdeadbeefcafefeed,
+                          ]:
+            data = self.jtag_write_drs(dr_bits = BitVector(65,test_data), capture=False)
+            self.compare_expected("Expected no data from a write-only scan",data,None)
+            data = self.jtag_write_drs(dr_bits = BitVector(65,test_data))
+            check_value = data.value>>1 # Lose the first bit that is in the Bypass 1-bit shift register
+            self.compare_expected("Expected bypass to be a 1-bit shift register",check_value,test_data)
+            pass
+        data = self.jtag_write_drs(dr_bits = bits_of_n(65,0x123), capture=False)
+        self.compare_expected("Expected no data from a write-only scan of a list of bits",data,None)
+
+        self.jtag_write_irs(ir_bits = BitVector(5,1), capture=False) # IDCODE
+        data = self.jtag_write_drs(dr_bits = BitVector(32,0))
+        self.compare_expected("Expected IDCODE after write-only IR scan",data.value,0xabcde6e3)
+        self.compare_expected("Expected TAP in idle",self.jtag_module.tap_state,TapState.idle)
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_fifo
+class c_jtag_apb_time_test_fifo(c_jtag_apb_time_test_base):
+    """
+    Test long bypass scans (captured and write-only) in FIFO mode, and the FIFO status
+    """
+    #f run
+    def run(self):
+        self.jtag_reset()
+        self.jtag_write_irs(ir_bits = BitVector(5,0x1f), capture=False) # bypass mode
+        pattern = int.from_bytes(bytes([(i*37+11)&0xff for i in range(129)]), "little")
+        for length in [64, 100, 1024]:
+            test_data = pattern & ((1<<length)-1)
+            data = self.jtag_write_drs(dr_bits = BitVector(length+1,test_data), capture=False)
+            self.compare_expected("Expected no data from a write-only scan",data,None)
+            data = self.jtag_write_drs(dr_bits = BitVector(length+1,test_data))
+            check_value = data.value>>1 # Lose the first bit that is in the Bypass 1-bit shift register
+            self.compare_expected("Expected bypass to be a 1-bit shift register",check_value,test_data)
+            pass
+        # Two consecutive long write-only shifts - the second FIFO command must wait for the first shift to complete
+        if self.jtag_instrumentation is not None: tcks = self.jtag_instrumentation.tcks
+        tdi_a = pattern & ((1<<200)-1)
+        tdi_b = (pattern>>200) | (1<<199)
+        tdi_c = pattern>>400
+        results = self.jtag_execute([(1,3,0b001,False), # To shift-dr
+                                     (2,200,tdi_a,False),
+                                     (2,200,tdi_b,False),
+                                     (3,40,tdi_c,True),
+                                     (1,2,0b01,False), # To idle
+                                     ])
+        check_value = ((tdi_c<<1) | (tdi_b>>199)) & ((1<<40)-1) # The last bit of tdi_b is in the Bypass 1-bit shift register
+        self.compare_expected("Expected consecutive write-only FIFO mode shifts to complete in turn",results[3],check_value)
+        if self.jtag_instrumentation is not None:
+            self.compare_expected("Expected TCKs of consecutive FIFO mode shifts (3 to shift-dr, 440 shifted, 2 to idle)",self.jtag_instrumentation.tcks-tcks,445)
+            pass
+        status = self.jtag_module.jtag_status_reg.read()
+        self.compare_expected("Expected FIFO mode idle with empty FIFOs",(status>>16)&0xff,0)
+        if self.jtag_instrumentation is not None:
+            tcks = self.jtag_instrumentation.tcks
+            self.jtag_write_drs(dr_bits = BitVector(1025,pattern), capture=False)
+            self.compare_expected("Expected TCKs of a FIFO mode scan to be counted (3 to shift-dr, 1025 shifted, 2 to idle)",self.jtag_instrumentation.tcks-tcks,1030)
+            pass
+
+        self.jtag_write_irs(ir_bits = BitVector(5,1), capture=False) # IDCODE
+        data = self.jtag_write_drs(dr_bits = BitVector(32,0))
+        self.compare_expected("Expected IDCODE after FIFO mode scans",data.value,0xabcde6e3)
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_queue
+class c_jtag_apb_time_test_queue(c_jtag_apb_time_test_base):
+    """
+    Test a deferred JtagQueue of bypass scans and an IDCODE read, executed at once
+    """
+    #f run
+    def run(self):
+        q = JtagQueue(self.jtag_module)
+        q.add_reset()
+        q.add_ir_scan(BitVector(5,0x1f)) # bypass mode
+        test_data = [0x0, 0x123456789abcdef0, 0xdeadbeefcafefeed]
+        results = []
+        for d in test_data:
+            results.append(q.add_dr_scan(BitVector(65,d)))
+            pass
+        discarded = q.add_dr_scan(BitVector(65,0), capture=False)
+        q.add_ir_scan(BitVector(5,1)) # IDCODE
+        idcode = q.add_dr_scan(BitVector(32,0))
+        q.add_runtest(10)
+        self.compare_expected("Expected nothing performed until execute",results[0].ready(),False)
+        self.compare_expected("Expected no result of a scan without capture",discarded,None)
+        q.execute()
+        for (d, r) in zip(test_data, results):
+            check_value = r.value.value>>1 # Lose the first bit that is in the Bypass 1-bit shift register
+            self.compare_expected("Expected bypass to be a 1-bit shift register",check_value,d)
+            pass
+        self.compare_expected("Expected IDCODE after bypass scans",idcode.value.value,0xabcde6e3)
+        self.compare_expected("Expected TAP in idle",self.jtag_module.tap_state,TapState.idle)
+
+        with JtagQueue(self.jtag_module) as q:
+            q.add_ir_scan(BitVector(5,0x1f)) # bypass mode
+            r = q.add_dr_scan(BitVector(33,0x1deadbeef))
+            pass
+        self.compare_expected("Expected bypass to be a 1-bit shift register",r.value.value>>1,0xdeadbeef)
+        self.compare_expected("Expected one execute of each queue",q.num_executes,1)
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_scan_chain
+class c_jtag_apb_time_test_scan_chain(c_jtag_apb_time_test_base):
+    """
+    Test the scan chain model on the (single TAP) chain, reading the IDCODE and using bypass through it
+    """
+    #f run
+    def run(self):
+        chain = ScanChain.discover(self.jtag_module, ir_lengths={0xabcde6e3:5}, cache=None) # Not the global cache, so later discoveries measure too
+        self.compare_expected("Expected a single device on the chain",len(chain.devices),1)
+        tap = chain.tap(0)
+        tap.jtag_write_irs(ir_bits = BitVector(5,1)) # IDCODE
+        data = tap.jtag_write_drs(dr_bits = BitVector(32,0))
+        self.compare_expected("Expected IDCODE through the scan chain",data.value,0xabcde6e3)
+        tap.jtag_write_irs(ir_bits = BitVector(5,0x1f)) # bypass mode
+        data = tap.jtag_write_drs(dr_bits = BitVector(33,0x123456789))
+        self.compare_expected("Expected bypass to be a 1-bit shift register",data.value>>1,0x23456789)
+
+        cache = ScanChainCache()
+        chain = ScanChain.discover(self.jtag_module, cache=cache)
+        self.compare_expected("Expected IDCODE from discovery",chain.devices[0].idcode,0xabcde6e3)
+        self.compare_expected("Expected measured IR length",chain.devices[0].ir_length,5)
+        chain = ScanChain.discover(self.jtag_module, cache=cache)
+        self.compare_expected("Expected second discovery to use the cache",cache.hits,1)
+        self.compare_expected("Expected cached IR length",chain.devices[0].ir_length,5)
+
+        for max_device_ir_length in (3, 4, 5): # Total IR length of 5 is not less than 3, 4 or 5
+            try:
+                ScanChain.discover(self.jtag_module, cache=ScanChainCache(), max_device_ir_length=max_device_ir_length)
+                self.failtest("Expected discovery with a maximum device IR length of %d to fail"%max_device_ir_length)
+                pass
+            except ScanChainError:
+                pass
+            pass
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_trace
+class c_jtag_apb_time_test_trace(c_jtag_apb_time_test_base):
+    """
+    Test trace recording: record IDCODE and bypass operations, then
+    replay the trace (recording the replay), expecting the same TDO
+    and identical traces
+    """
+    #f run
+    def run(self):
+        with tempfile.TemporaryDirectory() as d:
+            paths = [os.path.join(d, "trace%d.bin"%i) for i in range(2)]
+            recorder = trace.JtagTraceRecorder(paths[0], self.jtag_module)
+            self.jtag_read_idcodes()
+            self.jtag_write_irs(ir_bits = BitVector(5,0x1f)) # bypass mode
+            data = self.jtag_write_drs(dr_bits = BitVector(65,0x123456789abcdef0))
+            self.compare_expected("Expected bypass to be a 1-bit shift register",data.value>>1,0x123456789abcdef0)
+            recorder.close()
+
+            recorder = trace.JtagTraceRecorder(paths[1], self.jtag_module)
+            with trace.JtagTrace(paths[0]) as t:
+                differences = trace.replay(t, self.jtag_module)
+                pass
+            recorder.close()
+            self.compare_expected("Expected replay TDO to match the trace",differences,[])
+
+            with trace.JtagTrace(paths[0]) as t0:
+                with trace.JtagTrace(paths[1]) as t1:
+                    self.compare_expected("Expected replay trace to be the same length",t1.num_tcks(),t0.num_tcks())
+                    differences = trace.diff(t0, t1)
+                    pass
+                pass
+            self.compare_expected("Expected replay trace to match",differences,[])
+            pass
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_svf
+class c_jtag_apb_time_test_svf(c_jtag_apb_time_test_base):
+    """
+    Test the SVF player with the IDCODE and bypass (with a header) of
+    the TAP, with RUNTEST clocks, and a deliberate TDO mismatch
+    """
+    svf = """
+    ! IDCODE and bypass through the TAP
+    TRST OFF;
+    ENDIR IDLE; ENDDR IDLE;
+    STATE RESET;
+    SIR 5 TDI (01);
+    SDR 32 TDI (00000000) TDO (abcde6e3) MASK (ffffffff);
+    SIR 5 TDI (1f);
+    RUNTEST 10 TCK;
+    RUNTEST IDLE 5 TCK ENDSTATE IDLE;
+    RUNTEST 2E-6 SEC; // 2 TCKs at the default frequency
+    HDR 4 TDI (0);
+    SDR 16 TDI (1234) TDO (2468);
+    ENDDR DRPAUSE;
+    SDR 16 TDI (ffff)
+           TDO (fffe) MASK (fffe);
+    STATE IDLE;
+    """
+    #f run
+    def run(self):
+        player = SvfPlayer(self.jtag_module)
+        mismatches = player.play(self.svf.split("\n"))
+        self.compare_expected("Expected no SVF mismatches",len(mismatches),0)
+        self.compare_expected("Expected TAP in idle",self.jtag_module.tap_state,TapState.idle)
+
+        player = SvfPlayer(self.jtag_module, stop_on_mismatch=False)
+        mismatches = player.play(["SIR 5 TDI (1f);", "SDR 8 TDI (5a) TDO (5a);"])
+        self.compare_expected("Expected one SVF mismatch",len(mismatches),1)
+        self.compare_expected("Expected SVF mismatch TDO to be bypassed data",mismatches[0].tdo,0xb4)
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_async
+class c_jtag_apb_time_test_async(c_jtag_apb_time_test_base):
+    """
+    Test the asyncio interface (without threads, as the simulation is
+    single-threaded) with the IDCODE, bypass, and APB accesses
+    """
+    #f chain_operations
+    async def chain_operations(self, chain):
+        idcodes = await chain.read_idcodes()
+        await chain.write_irs(BitVector(5,0x1f))
+        data = await chain.write_drs(BitVector(65,0x123456789abcdef0))
+        apb = JtagApbMaster(chain.jtag_module)
+        await chain.call(apb.write, 0x1204, 0x12345)
+        comparator = await chain.call(apb.read, 0x1204)
+        return (idcodes, data.value>>1, comparator & 0x7fffffff)
+
+    #f run
+    def run(self):
+        (result,) = run_chains([self.jtag_module], self.chain_operations, threaded=False)
+        self.compare_expected("Expected async operations to return IDCODE, bypass and comparator", result, ([0xabcde6e3], 0x123456789abcdef0, 0x12345))
+        self.passtest("Test completed")
+        pass
+    pass
+
 #c c_jtag_apb_time_test_time_slow
 class c_jtag_apb_time_test_time_slow(c_jtag_apb_time_test_base):
     """
@@ -212,8 +577,8 @@ class c_jtag_apb_time_test_time_slow(c_jtag_apb_time_test_base):
     #f run
     def run(self):
         self.jtag_reset()
-        self.jtag_write_irs(ir_bits = bits_of_n(5,0x10)) # Send in 0x10 (apb_control)
-        self.jtag_write_drs(dr_bits = bits_of_n(32,0))   # write apb_control of 0
+        self.jtag_write_irs(ir_bits = BitVector(5,0x10), capture=False) # Send in 0x10 (apb_control)
+        self.jtag_write_drs(dr_bits = BitVector(32,0), capture=False)   # write apb_control of 0
 
         timer_readings = []
         for i in range(5):
@@ -247,15 +612,15 @@ class c_jtag_apb_time_test_time_fast(c_jtag_apb_time_test_base):
     #f run
     def run(self):
         self.jtag_reset()
-        self.jtag_write_irs(ir_bits = bits_of_n(5,0x10)) # Send in 0x10 (apb_control)
-        self.jtag_write_drs(dr_bits = bits_of_n(32,0))   # write apb_control of 0
-        self.jtag_write_irs(ir_bits = bits_of_n(5,0x11)) # Send in 0x11 (apb_access)
+        self.jtag_write_irs(ir_bits = BitVector(5,0x10), capture=False) # Send in 0x10 (apb_control)
+        self.jtag_write_drs(dr_bits = BitVector(32,0), capture=False)   # write apb_control of 0
+        self.jtag_write_irs(ir_bits = BitVector(5,0x11), capture=False) # Send in 0x11 (apb_access)
 
         timer_readings = []
         for i in range(10):
             timer_readings.append(self.apb_read_pipelined(0x1200))
             self.jtag_tms([0,0,0,0,0,0]) # 6 TMS ticks for JTAG TCK sync
-            self.jtag_tms([0,0]) # 2 TMS ticks for APB clocks
+            self.jtag_tms([0,0,0]) # 3 TMS ticks for APB clocks (the scan path from idle to shift-dr no longer starts with an idle tick)
             self.verbose.info("APB timer read returned address/data/status of %016x"%(timer_readings[-1]<<2))
             self.compare_expected("Expected APB op to have succeeded", timer_readings[-1]&3, 0)
             pass
@@ -290,9 +655,9 @@ class c_jtag_apb_time_test_time_fast2(c_jtag_apb_time_test_base):
     #f run
     def run(self):
         self.jtag_reset()
-        self.jtag_write_irs(ir_bits = bits_of_n(5,0x10)) # Send in 0x10 (apb_control)
-        self.jtag_write_drs(dr_bits = bits_of_n(32,0))   # write apb_control of 0
-        self.jtag_write_irs(ir_bits = bits_of_n(5,0x11)) # Send in 0x11 (apb_access)
+        self.jtag_write_irs(ir_bits = BitVector(5,0x10), capture=False) # Send in 0x10 (apb_control)
+        self.jtag_write_drs(dr_bits = BitVector(32,0), capture=False)   # write apb_control of 0
+        self.jtag_write_irs(ir_bits = BitVector(5,0x11), capture=False) # Send in 0x11 (apb_access)
 
         timer_readings = []
         for i in range(10):
@@ -332,9 +697,9 @@ class c_jtag_apb_time_test_time_fast3(c_jtag_apb_time_test_base):
     #f run
     def run(self):
         self.jtag_reset()
-        self.jtag_write_irs(ir_bits = bits_of_n(5,0x10)) # Send in 0x10 (apb_control)
-        self.jtag_write_drs(dr_bits = bits_of_n(32,0))   # write apb_control of 0
-        self.jtag_write_irs(ir_bits = bits_of_n(5,0x11)) # Send in 0x11 (apb_access)
+        self.jtag_write_irs(ir_bits = BitVector(5,0x10), capture=False) # Send in 0x10 (apb_control)
+        self.jtag_write_drs(dr_bits = BitVector(32,0), capture=False)   # write apb_control of 0
+        self.jtag_write_irs(ir_bits = BitVector(5,0x11), capture=False) # Send in 0x11 (apb_access)
 
         timer_readings = []
         for i in range(10):
@@ -385,9 +750,9 @@ class c_jtag_apb_time_test_comparator(c_jtag_apb_time_test_base):
     #f run
     def run(self):
         self.jtag_reset()
-        self.jtag_write_irs(ir_bits = bits_of_n(5,0x10)) # Send in 0x10 (apb_control)
-        self.jtag_write_drs(dr_bits = bits_of_n(32,0))   # write apb_control of 0
-        self.jtag_write_irs(ir_bits = bits_of_n(5,0x11)) # Send in 0x11 (apb_access)
+        self.jtag_write_irs(ir_bits = BitVector(5,0x10), capture=False) # Send in 0x10 (apb_control)
+        self.jtag_write_drs(dr_bits = BitVector(32,0), capture=False)   # write apb_control of 0
+        self.jtag_write_irs(ir_bits = BitVector(5,0x11), capture=False) # Send in 0x11 (apb_access)
 
         self.apb_read_pipelined(0x1200)
         self.bfm_wait(20)
@@ -412,6 +777,273 @@ class c_jtag_apb_time_test_comparator(c_jtag_apb_time_test_base):
         pass
     pass
 
+#c c_jtag_apb_time_test_apb_master
+class c_jtag_apb_time_test_apb_master(c_jtag_apb_time_test_base):
+    """
+    Test the pipelined APB master over JTAG, with writes and reads of the timer comparator and reads of the timer
+    """
+    #f run
+    def run(self):
+        self.jtag_reset()
+        apb = JtagApbMaster(self.jtag_module)
+        apb.write(0x1204, 0x40000000)
+        comparator = apb.read(0x1204) & 0x7fffffff
+        self.compare_expected("Expected comparator to read back as written", comparator, 0x40000000)
+
+        num_scans = apb.num_scans
+        timer_readings = apb.read_many([0x1200]*8)
+        self.compare_expected("Expected N+1 DR scans for N pipelined reads", apb.num_scans-num_scans, 9)
+        self.compare_expected("Expected 8 readings", len(timer_readings), 8)
+        for i in range(len(timer_readings)-1):
+            if timer_readings[i+1]<=timer_readings[i]:
+                self.failtest("Expected timer readings to increase (%s)"%(str(timer_readings)))
+                pass
+            pass
+        self.verbose.info("Timer readings %s"%(str(timer_readings)))
+
+        self.jtag_reset()
+        self.jtag_tms([0]) # Reset sets the IR to IDCODE; leave reset before the next access
+        comparator = apb.read(0x1204) & 0x7fffffff
+        self.compare_expected("Expected comparator to read back after a reset and idle", comparator, 0x40000000)
+
+        self.jtag_goto(TapState.test_logic_reset) # Three TMS of 1 from idle, which also resets the IR
+        self.jtag_goto(TapState.idle)
+        comparator = apb.read(0x1204) & 0x7fffffff
+        self.compare_expected("Expected comparator to read back after moving through reset", comparator, 0x40000000)
+        q = JtagQueue(self.jtag_module)
+        q.add_tms([1,1,1,1,1,0])
+        q.execute()
+        comparator = apb.read(0x1204) & 0x7fffffff
+        self.compare_expected("Expected comparator to read back after queued TMS through reset", comparator, 0x40000000)
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_apb_calibrate
+class c_jtag_apb_time_test_apb_calibrate(c_jtag_apb_time_test_base):
+    """
+    Test calibration of the pipelined APB master read pacing (and
+    the measurement of the clock ratio with the timer), and its back
+    off from too few idle TCKs
+    """
+    #f run
+    def run(self):
+        self.jtag_reset()
+        apb = JtagApbMaster(self.jtag_module)
+        idle_cycles = apb.calibrate(0x1204, timer_address=0x1200)
+        self.verbose.info("Calibrated read idle TCKs %d, APB clocks per TCK %f"%(idle_cycles, apb.apb_clocks_per_tck))
+        if apb.apb_clocks_per_tck<=0:
+            self.failtest("Expected a positive APB clocks per TCK (%f)"%(apb.apb_clocks_per_tck))
+            pass
+        timer_readings = apb.read_many([0x1200]*8)
+        for i in range(len(timer_readings)-1):
+            if timer_readings[i+1]<=timer_readings[i]:
+                self.failtest("Expected timer readings to increase (%s)"%(str(timer_readings)))
+                pass
+            pass
+        self.compare_expected("Expected no back off after calibration", apb.num_backoffs, 0)
+
+        apb = JtagApbMaster(self.jtag_module, read_idle_cycles=0)
+        apb.write(0x1204, 0x40000000)
+        data = apb.read_many([0x1200, 0x1204])
+        self.compare_expected("Expected comparator to read back as written", data[1] & 0x7fffffff, 0x40000000)
+        if apb.num_backoffs==0:
+            self.failtest("Expected reads with no idle TCKs to back off")
+            pass
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_apb_block
+class c_jtag_apb_time_test_apb_block(c_jtag_apb_time_test_base):
+    """
+    Test block and streamed writes and reads of the timer comparators through the pipelined APB master
+    """
+    #f run
+    def run(self):
+        self.jtag_reset()
+        apb = JtagApbMaster(self.jtag_module)
+        apb.write_block(0x1204, array("I", [0x1234, 0x2345, 0x3456]))
+        data = apb.read_block(0x1204, 3)
+        self.compare_expected("Expected comparators to read back as written", [d & 0x7fffffff for d in data], [0x1234, 0x2345, 0x3456])
+
+        num_scans = apb.num_scans
+        apb.write_stream(0x1204, [bytes([1,0,0,0, 2,0,0,0]), memoryview(bytes([3,0,0,0]))])
+        self.compare_expected("Expected N DR scans for N streamed writes", apb.num_scans-num_scans, 3)
+        num_scans = apb.num_scans
+        data = []
+        for chunk in apb.read_stream(0x1204, 3, chunk_words=2):
+            data += [d & 0x7fffffff for d in chunk]
+            pass
+        self.compare_expected("Expected comparators to read back as streamed", data, [1, 2, 3])
+        self.compare_expected("Expected N+1 DR scans for N streamed reads in two chunks", apb.num_scans-num_scans, 4)
+        self.verbose.info("Block transfers at %f words per second"%(apb.words_per_second()))
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_bitbang_compiler
+class c_jtag_apb_time_test_bitbang_compiler(c_jtag_apb_time_test_base):
+    """
+    Test OpenOCD remote_bitbang streams compiled to fast mode commands, reading the IDCODE and using bypass
+    """
+    #f tdo_of_response
+    def tdo_of_response(self, response):
+        return int(bytes(response[::-1]),2)
+
+    #f run
+    def run(self):
+        target = BitbangFastTarget(self.jtag_module)
+        stream  = bitbang_encode(BitVector(5,0x1f))  # reset
+        stream += bitbang_encode(BitVector(4,0b0010)) # to shift-dr
+        stream += bitbang_encode(BitVector(32,1<<31), BitVector(32,0), read=True) # shift out to exit1-dr
+        stream += bitbang_encode(BitVector(2,0b01))   # to idle
+        response = target.bitbang(stream)
+        self.compare_expected("Expected IDCODE from bitbang stream",self.tdo_of_response(response),0xabcde6e3)
+        self.compare_expected("Expected bitbang stream to compile to 2 fast mode commands",target.num_cmds,2)
+
+        stream  = bitbang_encode(BitVector(4,0b0011)) # to shift-ir
+        stream += bitbang_encode(BitVector(5,0x10), BitVector(5,0x1f)) # bypass mode
+        stream += bitbang_encode(BitVector(4,0b0011)) # to shift-dr
+        stream += bitbang_encode(BitVector(33,1<<32), BitVector(33,0x123456789), read=True)
+        stream += bitbang_encode(BitVector(2,0b01))   # to idle
+        split = stream.index(b"R", len(stream)//2)+1 # end the first batch with a read before its clock
+        response  = target.bitbang(stream[:split])
+        response += target.bitbang(stream[split:])
+        self.compare_expected("Expected bypass to be a 1-bit shift register",self.tdo_of_response(response)>>1,0x23456789)
+        self.compare_expected("Expected TAP state to be tracked",self.jtag_module.tap_state,TapState.idle)
+
+        num_resets = self.jtag_module.num_resets
+        target.bitbang(bitbang_encode(BitVector(4,0b0111))) # through reset (from idle) and back to idle
+        self.compare_expected("Expected a reset to be counted for TMS through reset",self.jtag_module.num_resets,num_resets+1)
+        self.compare_expected("Expected TAP state to be tracked",self.jtag_module.tap_state,TapState.idle)
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_remote_bitbang
+class c_jtag_apb_time_test_remote_bitbang(c_jtag_apb_time_test_base):
+    """
+    Test a JtagModuleRemoteBitbang, in another thread, driving the JTAG through an OpenocdServer served by this test
+    """
+    #f client
+    def client(self, port, results):
+        jtag_module = JtagModuleRemoteBitbang(port=port)
+        results["idcodes"] = jtag_module.jtag_read_idcodes()
+        jtag_module.jtag_reset()
+        jtag_module.jtag_write_irs(BitVector(5,0x1f), capture=False) # bypass
+        jtag_module.jtag_write_drs(BitVector(64,0), capture=False)
+        results["bypass"] = jtag_module.jtag_write_drs(BitVector(33,0x123456789))
+        results["tap_state"] = jtag_module.tap_state
+        results["transfers"] = jtag_module.transfers
+        jtag_module.close()
+        pass
+
+    #f bitbang_target
+    def bitbang_target(self):
+        if self.use_apb_target_jtag:
+            return BitbangFastTarget(self.jtag_module)
+        return BitbangJtagPinsTarget(self.bfm_wait, self.tck_enable, self.jtag__tms, self.jtag__tdi, self.tdo)
+
+    #f run
+    def run(self):
+        target = self.bitbang_target()
+        server = OpenocdServer().start()
+        results = {}
+        thread = threading.Thread(target=self.client, args=(server.port, results))
+        thread.start()
+        server.serve(target)
+        thread.join()
+        server.stop()
+        self.compare_expected("Expected IDCODEs through remote_bitbang",results.get("idcodes"),[0xabcde6e3])
+        self.compare_expected("Expected bypass to be a 1-bit shift register",results["bypass"].value>>1,0x23456789)
+        self.compare_expected("Expected TAP state to be tracked",results["tap_state"],TapState.idle)
+        self.compare_expected("Expected one round trip per operation",results["transfers"],9)
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_remote_bitbang_clients
+class c_jtag_apb_time_test_remote_bitbang_clients(c_jtag_apb_time_test_remote_bitbang):
+    """
+    Test two JtagModuleRemoteBitbang clients sharing the JTAG through one OpenocdServer, switching at every transaction boundary
+    """
+    num_clients = 2
+    num_scans = 6
+    #f client
+    def client(self, jtag_module, number, results):
+        jtag_module.jtag_reset()
+        tdo = []
+        for i in range(self.num_scans):
+            data = BitVector(33, 0x5a5a0000 + (number<<8) + i)
+            with JtagQueue(jtag_module) as q:
+                q.add_ir_scan(BitVector(5,0x1f), end_state=TapState.update_ir) # bypass, with no return to idle within the transaction
+                r = q.add_dr_scan(data)
+                pass
+            tdo.append((data.value & 0xffffffff, r.value.value>>1))
+            pass
+        results.append(tdo)
+        jtag_module.close()
+        pass
+
+    #f run
+    def run(self):
+        target = self.bitbang_target()
+        server = OpenocdServer(slot_time=0.).start()
+        results = []
+        jtag_modules = [JtagModuleRemoteBitbang(port=server.port) for i in range(self.num_clients)]
+        while server.stats.connections<self.num_clients: time.sleep(0.001) # so that the server does not see all clients disconnected early
+        threads = [threading.Thread(target=self.client, args=(jtag_modules[i], i, results)) for i in range(self.num_clients)]
+        for t in threads: t.start()
+        server.serve(target)
+        for t in threads: t.join()
+        server.stop()
+        self.compare_expected("Expected all clients to complete",len(results),self.num_clients)
+        for tdo in results:
+            for (expected, value) in tdo:
+                self.compare_expected("Expected bypass scan of each client to be unaffected by the other",value,expected)
+                pass
+            pass
+        for client_stats in server.stats.clients:
+            self.compare_expected("Expected TDO of every scan to be returned to its client",client_stats.bytes_sent,33*self.num_scans)
+            self.verbose.info(str(client_stats))
+            pass
+        self.passtest("Test completed")
+        pass
+    pass
+
+#c c_jtag_apb_time_test_remote_bitbang_close
+class c_jtag_apb_time_test_remote_bitbang_close(c_jtag_apb_time_test_base):
+    """
+    Test that a JtagModuleRemoteBitbang read pending when its OpenocdServer is stopped fails with a ConnectionError
+    """
+    #f client
+    def client(self, jtag_module, results):
+        try:
+            results["idcodes"] = jtag_module.jtag_read_idcodes()
+            pass
+        except ConnectionError as e:
+            results["error"] = e
+            pass
+        pass
+
+    #f run
+    def run(self):
+        server = OpenocdServer().start()
+        jtag_module = JtagModuleRemoteBitbang(port=server.port)
+        results = {}
+        thread = threading.Thread(target=self.client, args=(jtag_module, results))
+        thread.start()
+        while server.stats.bytes_received==0: time.sleep(0.001) # read sent, but never served
+        server.stop()
+        thread.join(timeout=5.)
+        self.compare_expected("Expected the pending read to return when the server is stopped",thread.is_alive(),False)
+        self.compare_expected("Expected no IDCODEs from a stopped server",results.get("idcodes"),None)
+        self.compare_expected("Expected a ConnectionError from a stopped server",isinstance(results.get("error"),ConnectionError),True)
+        self.passtest("Test completed")
+        pass
+    pass
+
 #a Hardware classes
 #c jtag_apb_timer_hw
 t_jtag = {"ntrst":1, "tms":1, "tdi":1,}
@@ -435,15 +1067,33 @@ class jtag_apb_timer_hw(HardwareThDut):
 class JtagApbTimer(TestCase):
     hw = jtag_apb_timer_hw
     kwargs = {"th_args":{"use_apb_target_jtag":False}}
+    instrumented_kwargs = {"th_args":{"use_apb_target_jtag":False, "instrument":True}}
     _tests = {
         "idcode"      : (c_jtag_apb_time_test_idcode,2*1000,     kwargs),
         "bypass"      : (c_jtag_apb_time_test_bypass,4*1000,     kwargs),
         "bypass2"     : (c_jtag_apb_time_test_bypass2,4*1000,    kwargs),
+        "bypass_list" : (c_jtag_apb_time_test_bypass_list,4*1000,kwargs),
+        "bypass_chained" : (c_jtag_apb_time_test_bypass_chained,4*1000,kwargs),
+        "bypass_stream" : (c_jtag_apb_time_test_bypass_stream,4*1000,kwargs),
+        "queue"       : (c_jtag_apb_time_test_queue,4*1000,      kwargs),
+        "write_only"  : (c_jtag_apb_time_test_write_only,4*1000, kwargs),
+        "tap_unknown" : (c_jtag_apb_time_test_tap_unknown, 4*1000, kwargs),
+        "scan_chain"  : (c_jtag_apb_time_test_scan_chain,2*1000, kwargs),
+        "trace"       : (c_jtag_apb_time_test_trace,2*1000,      kwargs),
+        "svf"         : (c_jtag_apb_time_test_svf,2*1000,        kwargs),
+        "async"       : (c_jtag_apb_time_test_async,2*1000,      kwargs),
         "timer_slow"  : (c_jtag_apb_time_test_time_slow,8*1000,  kwargs),
         "timer_fast"  : (c_jtag_apb_time_test_time_fast,8*1000,  kwargs),
         "timer_fast2" : (c_jtag_apb_time_test_time_fast2,6*1000, kwargs),
         "timer_fast3" : (c_jtag_apb_time_test_time_fast3,10*1000,kwargs),
         "comparator"  : (c_jtag_apb_time_test_comparator,10*1000,kwargs),
+        "apb_master"  : (c_jtag_apb_time_test_apb_master,8*1000, kwargs),
+        "apb_calibrate": (c_jtag_apb_time_test_apb_calibrate,8*1000, kwargs),
+        "apb_block"   : (c_jtag_apb_time_test_apb_block,4*1000,  kwargs),
+        "remote_bitbang" : (c_jtag_apb_time_test_remote_bitbang,2*1000, kwargs),
+        "remote_bitbang_clients" : (c_jtag_apb_time_test_remote_bitbang_clients, 4*1000, kwargs),
+        "remote_bitbang_close" : (c_jtag_apb_time_test_remote_bitbang_close, 1*1000, kwargs),
+        "instrumented": (c_jtag_apb_time_test_apb_master,8*1000, instrumented_kwargs),
 
         "smoke"  : (c_jtag_apb_time_test_time_slow,8*1000,  kwargs),
     }
@@ -458,11 +1108,24 @@ class ApbTargetJtagSlow(TestCase):
        "idcode"      : (c_jtag_apb_time_test_idcode,       4*1000,  kwargs),
        "bypass"      : (c_jtag_apb_time_test_bypass,      20*1000,  kwargs),
        "bypass2"     : (c_jtag_apb_time_test_bypass2,     20*1000,  kwargs),
+       "bypass_list" : (c_jtag_apb_time_test_bypass_list, 20*1000,  kwargs),
+       "bypass_chained" : (c_jtag_apb_time_test_bypass_chained, 20*1000,  kwargs),
+       "bypass_stream" : (c_jtag_apb_time_test_bypass_stream, 20*1000,  kwargs),
+       "queue"       : (c_jtag_apb_time_test_queue,       20*1000,  kwargs),
+       "write_only"  : (c_jtag_apb_time_test_write_only,  20*1000,  kwargs),
+       "tap_unknown" : (c_jtag_apb_time_test_tap_unknown,   20*1000,  kwargs),
+       "scan_chain"  : (c_jtag_apb_time_test_scan_chain,   10*1000,  kwargs),
+       "trace"       : (c_jtag_apb_time_test_trace,        10*1000,  kwargs),
+       "svf"         : (c_jtag_apb_time_test_svf,          10*1000,  kwargs),
+       "async"       : (c_jtag_apb_time_test_async,        10*1000,  kwargs),
        "timer_slow"  : (c_jtag_apb_time_test_time_slow,   40*1000,  kwargs),
        "timer_fast"  : (c_jtag_apb_time_test_time_fast,   40*1000,  kwargs),
        "timer_fast2" : (c_jtag_apb_time_test_time_fast2,  40*1000,  kwargs),
        "timer_fast3" : (c_jtag_apb_time_test_time_fast3,  40*1000, kwargs),
         "comparator"  : (c_jtag_apb_time_test_comparator, 45*1000, kwargs),
+        "apb_master"  : (c_jtag_apb_time_test_apb_master, 40*1000, kwargs),
+        "apb_calibrate": (c_jtag_apb_time_test_apb_calibrate, 50*1000, kwargs),
+        "apb_block"   : (c_jtag_apb_time_test_apb_block,  40*1000, kwargs),
 
         "smoke"  : (c_jtag_apb_time_test_time_slow,40*1000,  kwargs),
     }
@@ -476,17 +1139,66 @@ class ApbTargetJtagFast(TestCase):
     hw = jtag_apb_timer_hw
     # "verbosity":0,
     kwargs = {"th_args":{"use_apb_target_jtag":2},}
+    instrumented_kwargs = {"th_args":{"use_apb_target_jtag":2, "instrument":True},}
     _tests = {
        "idcode"      : (c_jtag_apb_time_test_idcode,       1*1000,  kwargs),
        "bypass"      : (c_jtag_apb_time_test_bypass,       6*1000,  kwargs),
        "bypass2"     : (c_jtag_apb_time_test_bypass2,      6*1000,  kwargs),
+       "bypass_list" : (c_jtag_apb_time_test_bypass_list,  6*1000,  kwargs),
+       "bypass_chained" : (c_jtag_apb_time_test_bypass_chained,  6*1000,  kwargs),
+       "bypass_stream" : (c_jtag_apb_time_test_bypass_stream,  6*1000,  kwargs),
+       "queue"       : (c_jtag_apb_time_test_queue,         6*1000,  kwargs),
+       "write_only"  : (c_jtag_apb_time_test_write_only,    6*1000,  kwargs),
+       "tap_unknown" : (c_jtag_apb_time_test_tap_unknown,     6*1000,  kwargs),
+       "scan_chain"  : (c_jtag_apb_time_test_scan_chain,    2*1000,  kwargs),
+       "trace"       : (c_jtag_apb_time_test_trace,         2*1000,  kwargs),
+       "svf"         : (c_jtag_apb_time_test_svf,           2*1000,  kwargs),
+       "async"       : (c_jtag_apb_time_test_async,         2*1000,  kwargs),
        "timer_slow"  : (c_jtag_apb_time_test_time_slow,   15*1000,  kwargs),
        "timer_fast"  : (c_jtag_apb_time_test_time_fast,   15*1000,  kwargs),
        "timer_fast2" : (c_jtag_apb_time_test_time_fast2,  15*1000,  kwargs),
        "timer_fast3" : (c_jtag_apb_time_test_time_fast3,  15*1000, kwargs),
         "comparator"  : (c_jtag_apb_time_test_comparator, 15*1000, kwargs),
+        "apb_master"  : (c_jtag_apb_time_test_apb_master, 15*1000, kwargs),
+        "bitbang_compiler" : (c_jtag_apb_time_test_bitbang_compiler, 4*1000, kwargs),
+        "remote_bitbang" : (c_jtag_apb_time_test_remote_bitbang, 4*1000, kwargs),
+        "remote_bitbang_clients" : (c_jtag_apb_time_test_remote_bitbang_clients, 6*1000, kwargs),
+        "apb_calibrate": (c_jtag_apb_time_test_apb_calibrate, 15*1000, kwargs),
+        "apb_block"   : (c_jtag_apb_time_test_apb_block,  15*1000, kwargs),
+        "instrumented": (c_jtag_apb_time_test_apb_master, 15*1000, instrumented_kwargs),
 
         "smoke"  : (c_jtag_apb_time_test_time_slow,40*1000,  kwargs),
     }
     pass
 
+#c ApbTargetJtagFifo
+class ApbTargetJtagFifo(TestCase):
+    """
+    Uses faster apb->jtag mode, with FIFO mode for long shifts
+    """
+    hw = jtag_apb_timer_hw
+    kwargs = {"th_args":{"use_apb_target_jtag":3},}
+    instrumented_kwargs = {"th_args":{"use_apb_target_jtag":3, "instrument":True},}
+    _tests = {
+       "idcode"      : (c_jtag_apb_time_test_idcode,       1*1000,  kwargs),
+       "bypass"      : (c_jtag_apb_time_test_bypass,       6*1000,  kwargs),
+       "bypass2"     : (c_jtag_apb_time_test_bypass2,      6*1000,  kwargs),
+       "bypass_list" : (c_jtag_apb_time_test_bypass_list,  6*1000,  kwargs),
+       "bypass_chained" : (c_jtag_apb_time_test_bypass_chained,  6*1000,  kwargs),
+       "bypass_stream" : (c_jtag_apb_time_test_bypass_stream,  6*1000,  kwargs),
+       "queue"       : (c_jtag_apb_time_test_queue,         6*1000,  kwargs),
+       "write_only"  : (c_jtag_apb_time_test_write_only,    6*1000,  kwargs),
+       "tap_unknown" : (c_jtag_apb_time_test_tap_unknown,     6*1000,  kwargs),
+       "fifo"        : (c_jtag_apb_time_test_fifo,         10*1000,  kwargs),
+       "scan_chain"  : (c_jtag_apb_time_test_scan_chain,    2*1000,  kwargs),
+       "trace"       : (c_jtag_apb_time_test_trace,         2*1000,  kwargs),
+       "svf"         : (c_jtag_apb_time_test_svf,           2*1000,  kwargs),
+       "apb_master"  : (c_jtag_apb_time_test_apb_master,   15*1000, kwargs),
+       "apb_block"   : (c_jtag_apb_time_test_apb_block,    15*1000, kwargs),
+       "remote_bitbang" : (c_jtag_apb_time_test_remote_bitbang, 4*1000, kwargs),
+       "remote_bitbang_clients" : (c_jtag_apb_time_test_remote_bitbang_clients, 6*1000, kwargs),
+       "instrumented": (c_jtag_apb_time_test_fifo,         10*1000, instrumented_kwargs),
+
+        "smoke"  : (c_jtag_apb_time_test_time_slow,40*1000,  kwargs),
+    }
+    pass
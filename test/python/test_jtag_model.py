@@ -0,0 +1,193 @@
+#a Copyright
+#
+#  This file 'test_jtag_model.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Documentation
+"""
+These tests run the JTAG driver tests of test_jtag on the Python model
+of tb_jtag_apb_timer (regress.jtag.jtag_model) in place of the
+simulation, so the driver suite runs in seconds without a simulation
+build ('make model').
+
+Each c_jtag_apb_time_test_* class of the TestCases of test_jtag is run
+with the same arguments, with a JtagModelThExec providing the test
+harness methods it uses (bfm_wait, the JTAG pins, the APB registers,
+and passtest/failtest/compare_expected) on a JtagApbTimerModel; the
+test must pass within the cycles allowed for it in simulation.
+
+The bulk paths of the model are also checked against its cycle by
+cycle path: every test is run on a model with bulk=False too, and the
+cycles, TCKs, APB clocks and APB accesses must match exactly.
+"""
+
+#a Imports
+import unittest
+from regress.jtag.jtag_module import JtagModule, JtagModuleApbSlow, JtagModuleApbFast, JtagModuleApbFifo
+from regress.jtag.jtag_model import JtagApbTimerModel, JtagModelTh, JtagModelApbBfm, JtagModelMap
+from regress.jtag.instrument import JtagInstrumentation
+import test_jtag
+
+#a Test harness
+#c JtagModelVerbose
+class JtagModelVerbose:
+    """
+    The verbose messages of a JtagModelThExec, which are discarded
+    """
+    #f info
+    def info(self, msg):
+        pass
+
+    #f error
+    def error(self, msg):
+        pass
+    pass
+
+#c JtagModelThExec
+class JtagModelThExec:
+    """
+    Run a c_jtag_apb_time_test_* class on a JtagApbTimerModel
+
+    The test instance is created without ThExecFile.__init__ (which
+    requires the simulation), and is given the harness methods as
+    instance attributes; run__init is replaced by run_init, which
+    creates the JtagModule* on the model as run__init does on the
+    simulation.
+    """
+    jtag_module_classes = {1:JtagModuleApbSlow, 2:JtagModuleApbFast, 3:JtagModuleApbFifo}
+    #f __init__
+    def __init__(self, test_class, use_apb_target_jtag=0, instrument=False, bulk=True):
+        self.model = JtagApbTimerModel(bulk=bulk)
+        self.model_th = JtagModelTh(self.model)
+        self.failures = []
+        th = test_class.__new__(test_class)
+        th.use_apb_target_jtag = use_apb_target_jtag
+        th.instrument = instrument
+        th.jtag_instrumentation = None
+        th.bfm_wait    = self.model_th.bfm_wait
+        th.global_cycle = self.model_th.global_cycle
+        th.tck_enable  = self.model_th.tck_enable
+        th.jtag__tms   = self.model_th.jtag__tms
+        th.jtag__tdi   = self.model_th.jtag__tdi
+        th.tdo         = self.model_th.tdo
+        th.verbose     = JtagModelVerbose()
+        th.passtest    = self.passtest
+        th.failtest    = self.failtest
+        th.compare_expected = self.compare_expected
+        self.th = th
+        pass
+
+    #f passtest
+    def passtest(self, reason):
+        pass
+
+    #f failtest
+    def failtest(self, reason):
+        self.failures.append(reason)
+        pass
+
+    #f compare_expected
+    def compare_expected(self, reason, value, expected):
+        if value!=expected: self.failtest("%s: got %s expected %s"%(reason, str(value), str(expected)))
+        pass
+
+    #f run_init
+    def run_init(self):
+        th = self.th
+        th.bfm_wait(10)
+        if th.use_apb_target_jtag:
+            jtag_module_class = self.jtag_module_classes[th.use_apb_target_jtag]
+            th.jtag_module = jtag_module_class(th, JtagModelApbBfm(self.model), JtagModelMap())
+            pass
+        else:
+            th.jtag_module = JtagModule(th.bfm_wait, th.tck_enable, th.jtag__tms, th.jtag__tdi, th.tdo, th)
+            pass
+        if th.instrument:
+            th.jtag_instrumentation = JtagInstrumentation(th.jtag_module)
+            pass
+        pass
+
+    #f run
+    def run(self):
+        """
+        Run the test; return the list of failures
+        """
+        self.run_init()
+        self.th.run()
+        self.th.run__finalize()
+        return self.failures
+    pass
+
+#a Test classes
+#c JtagModelTests
+class JtagModelTests(unittest.TestCase):
+    """
+    Run the tests of the test_jtag TestCases on the model
+    """
+    test_cases = (test_jtag.JtagApbTimer, test_jtag.ApbTargetJtagSlow, test_jtag.ApbTargetJtagFast, test_jtag.ApbTargetJtagFifo)
+    #f test_model
+    def test_model(self):
+        for test_case in self.test_cases:
+            for (name, (test_class, cycles, kwargs)) in test_case._tests.items():
+                with self.subTest(test_case=test_case.__name__, test=name):
+                    th_exec = JtagModelThExec(test_class, **kwargs["th_args"])
+                    self.assertEqual(th_exec.run(), [])
+                    self.assertLessEqual(th_exec.model.cycle, cycles)
+                    pass
+                pass
+            pass
+        pass
+    pass
+
+#c JtagModelBulkTests
+class JtagModelBulkTests(unittest.TestCase):
+    """
+    Check the bulk paths of the model against its cycle by cycle path
+
+    Tests that use an OpenocdServer are not included, as their
+    batching of the JTAG (and hence the cycles taken) depends on the
+    timing of the host threads.
+    """
+    test_cases = JtagModelTests.test_cases
+    #f counters
+    @staticmethod
+    def counters(model):
+        return {"cycle":model.cycle,
+                "tcks":model.tcks,
+                "apb_cycle":model.client.apb_cycle,
+                "apb_reads":model.apb_reads,
+                "apb_writes":model.apb_writes,
+                }
+
+    #f test_bulk
+    def test_bulk(self):
+        for test_case in self.test_cases:
+            for (name, (test_class, cycles, kwargs)) in test_case._tests.items():
+                if name.startswith("remote_bitbang"): continue
+                with self.subTest(test_case=test_case.__name__, test=name):
+                    bulk    = JtagModelThExec(test_class, bulk=True,  **kwargs["th_args"])
+                    stepped = JtagModelThExec(test_class, bulk=False, **kwargs["th_args"])
+                    self.assertEqual(bulk.run(), [])
+                    self.assertEqual(stepped.run(), [])
+                    self.assertEqual(self.counters(bulk.model), self.counters(stepped.model))
+                    pass
+                pass
+            pass
+        pass
+    pass
+
+#a Toplevel
+if __name__ == "__main__":
+    unittest.main()